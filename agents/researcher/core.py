@@ -1,11 +1,15 @@
 # 【资料员】 整理数据:清洗数据并将其整理入库 core -> lead
-import re
+import asyncio
 from loguru import logger
 
 from langchain_core.messages import ToolMessage, HumanMessage, AIMessage
 from agents.researcher.state import Researcher
 
-from tools.registry import global_rag_store
+from tools.registry import global_ingest_pipeline
+from tools.text_cleaner import BoilerplateDetector, clean_payload
+
+# 站点模板行的记忆跨请求共享(同一站点抓得越多，导航/页脚识别越准)
+boilerplate_detector = BoilerplateDetector()
 
 
 
@@ -38,29 +42,17 @@ async def core_node(state:Researcher):
                         source_url = str(args.get("urls") or args.get("url"))
                         break
 
-        # 数据清洗
+        # 数据清洗(图片/噪音行/站点模板行/空白规范化)，长文本清洗放到线程里，不卡事件循环
         raw_content = str(last_msg.content)
-
-        cleaned = re.sub(r"!\[.*?\]\(.*?\)","",raw_content) # 去掉![]()的图片格式
-        noise_keywords = ["版权所有", "©", "备案", "110报警", "营业执照", "免责声明", "出版物许可证"] # 去掉噪音
-        filtered_lines = []
-        for line in cleaned.split("\n"):
-            keep = True
-            for noise_keyword in noise_keywords:
-                if noise_keyword in line:
-                    keep = False
-                    break
-            if keep:
-                filtered_lines.append(line)
-        final_text = "\n".join(filtered_lines)
+        final_text = await asyncio.to_thread(clean_payload, raw_content, source_url, boilerplate_detector)
 
 
         if len(final_text) > 200: # 字数必须200+才记录
-            # 物理入库
-            global_rag_store.add_documents(final_text, source_url,session_id=state.get("session_id","default_session"))
+            # 投递到异步入库流水线:切分/向量化/写库在后台完成，不阻塞事件循环(writer会等待入库完成)
+            await global_ingest_pipeline.submit(final_text, source_url, session_id=state.get("session_id","default_session"))
             # 构造简单通知以返回
             new_msg = ToolMessage(
-                content="✅ [系统] 内容已存入 RAG。由于原文过长，已在当前上下文中物理删除，请调用检索工具。",
+                content="✅ [系统] 内容已提交 RAG 入库。由于原文过长，已在当前上下文中物理删除，请调用检索工具。",
                 tool_call_id=target_id,
                 name=last_msg.name,
                 id=last_msg.id
@@ -1,14 +1,11 @@
-from functools import partial
-
 from langgraph.constants import END, START
 from langgraph.graph import StateGraph
-from langgraph.prebuilt import ToolNode
 
 from agents.researcher.core import core_node
 from agents.researcher.leader import leader_node
 from agents.researcher.state import Researcher
 from agents.researcher.surfer import surfer_node
-from tools.registry import load_all_tools
+from tools.registry import load_toolbox
 
 
 # 检查返回的数据是否应还给surfer
@@ -20,13 +17,17 @@ async def build_researcher_graph():
     """
     构建 研究员 子图
     """
-    tools = await load_all_tools()
+    toolbox = await load_toolbox()
+
+    async def surfer(state:Researcher):
+        # 每次取当前工具集(让Agent看菜单):MCP重连/工具列表变化后不需要重新编译图
+        return await surfer_node(state,tools=toolbox.tools())
 
     workflow = StateGraph(Researcher)
 
-    # 注意:这里partial是指定"有什么":让Agent看菜单;之后的node节点则是"走哪里":让Agent具体节点怎么选
-    workflow.add_node("surfer",partial(surfer_node,tools=tools))
-    workflow.add_node("tools",ToolNode(tools))
+    # 注意:surfer指定"有什么":让Agent看菜单;之后的node节点则是"走哪里":让Agent具体节点怎么选
+    workflow.add_node("surfer",surfer)
+    workflow.add_node("tools",toolbox.run)
     workflow.add_node("core",core_node)
     workflow.add_node("leader",leader_node)
 
@@ -1,5 +1,6 @@
 # 【输出员】 高质量输出:只阅读RAG来产出报告
 # 总流程: manager() -  planner(确认搜索方向) - surfer(开始搜寻) - core(数据入库) - leader(对数据做检查，是否进行第二轮检索) - writer(生成报告)
+import asyncio
 from datetime import datetime
 from loguru import logger
 
@@ -9,7 +10,7 @@ from langchain_openai import ChatOpenAI
 
 from config import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL
 from state import ResearchAgent
-from tools.registry import global_rag_store
+from tools.registry import global_rag_store, global_ingest_pipeline
 
 llm = ChatOpenAI(
     model=OPENAI_MODEL,
@@ -18,6 +19,8 @@ llm = ChatOpenAI(
     temperature=0.5
 )
 
+INGEST_WAIT_TIMEOUT_SEC = 60 # 等待后台入库完成的上限，超时则用已入库的部分写报告
+
 
 async def writer_node(state:ResearchAgent):
     """
@@ -32,8 +35,14 @@ async def writer_node(state:ResearchAgent):
 
     session_id = state.get("session_id","default_session")
 
-    for i,task in enumerate(tasks):
-        retrieved_text = global_rag_store.query_formatted(task,session_id=session_id)
+    # 屏障:等研究员投递的文档全部入库后再检索
+    await global_ingest_pipeline.wait_session(session_id, timeout=INGEST_WAIT_TIMEOUT_SEC)
+
+    # 所有课题一次批量检索(一次embedding/一次向量查询/一次rerank)
+    # 先 await 拿到实例:直接访问代理属性会在组件还没就绪时阻塞事件循环
+    rag_store = await global_rag_store.aget()
+    retrieved_texts = await rag_store.aquery_many_formatted(tasks, session_id=session_id)
+    for i,(task,retrieved_text) in enumerate(zip(tasks,retrieved_texts)):
         block = f"""
         ### 课题:{i+1}:{task}
         【检索到的事实与数据】:
@@ -102,7 +111,8 @@ async def writer_node(state:ResearchAgent):
         response = await llm.ainvoke(message)
         logger.success("✅ [Writer] 报告撰写完成")
 
-        global_rag_store.clear_session(session_id)
+        # 释放引用/回收闲置文档会触碰Chroma，同样放到线程里
+        await asyncio.to_thread(rag_store.clear_session, session_id)
         logger.info(f"🧹 [Writer] 任务完成，清理 Session: {session_id}")
 
         return {
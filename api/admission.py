@@ -0,0 +1,325 @@
+# 限流与准入控制:会话级滑动窗口限流 + 全局并发令牌池
+# 多个 uvicorn worker 时用 Redis 后端共享计数/令牌；单进程(本地开发)用内存后端
+import asyncio
+import random
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from loguru import logger
+
+from config import ADMISSION_BACKEND, REDIS_URL, RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW_SEC, MAX_CONCURRENT_RUNS
+
+REDIS_KEY_PREFIX = "research_agent"
+TOKEN_LEASE_SEC = 60 # 并发令牌的租约时长，持有期间定时续约；worker 崩溃时令牌到期自动回收
+TOKEN_RENEW_SEC = 20 # 续约间隔
+ACQUIRE_POLL_SEC = 0.25 # 等待令牌时的轮询间隔(Redis 后端；内存后端由释放事件唤醒)
+
+
+def _window_estimate(prev: int, curr: int, elapsed: float, window: float) -> float:
+    # 滑动窗口计数(两桶近似):上一窗口按剩余重叠比例折算 + 当前窗口计数
+    return prev * (1 - elapsed / window) + curr
+
+
+def _retry_after(prev: int, curr: int, elapsed: float, limit: int, window: float) -> float:
+    """
+    估算多久之后可以再请求一次(秒)
+    """
+    if curr + 1 > limit:
+        # 当前窗口已经用满:等到下一窗口，且本窗口计数折算后低于上限
+        return (window - elapsed) + window * max(0.0, 1 - (limit - 1) / curr)
+    # 当前窗口没满，是上一窗口的折算量压线:等它继续衰减
+    return max(0.0, window * (1 - (limit - 1 - curr) / prev) - elapsed) if prev else 0.0
+
+
+# 会话级限流
+class MemoryRateLimiter:
+    """
+    每个key只存 (窗口编号, 当前窗口计数, 上一窗口计数)，每次请求 O(1) 更新，不再每次重建时间戳列表
+    按最近访问排序，超过两个窗口没有请求的key在访问时顺带淘汰，max_keys 兜底
+    """
+
+    def __init__(self, limit: int, window_sec: float, max_keys: int = 100_000):
+        self.limit = limit
+        self.window = window_sec
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[int, int, int]] = OrderedDict()
+
+    def _evict(self, idx: int):
+        while self._buckets:
+            key, (last_idx, _, _) = next(iter(self._buckets.items()))
+            if last_idx >= idx - 1 and len(self._buckets) <= self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+
+    async def hit(self, key: str) -> tuple[bool, float]:
+        """
+        记一次请求，返回 (是否放行, 建议重试秒数)
+        """
+        now = time.time()
+        idx = int(now // self.window)
+        elapsed = now - idx * self.window
+        last_idx, curr, prev = self._buckets.get(key, (idx, 0, 0))
+        if last_idx == idx - 1:
+            curr, prev = 0, curr
+        elif last_idx < idx - 1:
+            curr, prev = 0, 0
+
+        self._buckets[key] = (idx, curr, prev)
+        self._buckets.move_to_end(key)
+        self._evict(idx)
+        if _window_estimate(prev, curr, elapsed, self.window) + 1 > self.limit:
+            return False, _retry_after(prev, curr, elapsed, self.limit, self.window)
+        self._buckets[key] = (idx, curr + 1, prev)
+        return True, 0.0
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "keys": len(self._buckets)}
+
+
+# KEYS[1]=当前窗口计数 KEYS[2]=上一窗口计数 | ARGV: 上限, 上一窗口权重, 过期秒数
+_RATE_LIMIT_LUA = """
+local curr = tonumber(redis.call('GET', KEYS[1]) or '0')
+local prev = tonumber(redis.call('GET', KEYS[2]) or '0')
+if prev * tonumber(ARGV[2]) + curr + 1 > tonumber(ARGV[1]) then
+    return {0, curr, prev}
+end
+curr = redis.call('INCR', KEYS[1])
+if curr == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return {1, curr, prev}
+"""
+
+
+class RedisRateLimiter:
+    """
+    同样的两桶滑动窗口，计数放在 Redis(每个窗口一个key，两个窗口后过期)，一次 Lua 调用原子完成 判断+计数
+    """
+
+    def __init__(self, redis, limit: int, window_sec: float):
+        self.redis = redis
+        self.limit = limit
+        self.window = window_sec
+        self._script = redis.register_script(_RATE_LIMIT_LUA)
+
+    async def hit(self, key: str) -> tuple[bool, float]:
+        now = time.time()
+        idx = int(now // self.window)
+        elapsed = now - idx * self.window
+        # {key} 哈希标签:两个窗口的key落在同一个集群槽位
+        base = f"{REDIS_KEY_PREFIX}:rl:{{{key}}}"
+        allowed, curr, prev = await self._script(
+            keys=[f"{base}:{idx}", f"{base}:{idx - 1}"],
+            args=[self.limit, 1 - elapsed / self.window, int(self.window * 2) + 1],
+        )
+        if allowed:
+            return True, 0.0
+        return False, _retry_after(int(prev), int(curr), elapsed, self.limit, self.window)
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+
+# 全局并发令牌池
+class MemoryTokenPool:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._holders: set[str] = set()
+        self._released = asyncio.Event()
+
+    async def try_acquire(self, holder: str) -> bool:
+        if holder in self._holders or len(self._holders) < self.capacity:
+            self._holders.add(holder)
+            return True
+        return False
+
+    async def renew(self, holder: str):
+        pass
+
+    async def release(self, holder: str):
+        self._holders.discard(holder)
+        self._released.set()
+
+    async def wait_release(self, timeout: float):
+        self._released.clear()
+        try:
+            await asyncio.wait_for(self._released.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def in_use(self) -> int:
+        return len(self._holders)
+
+
+# KEYS[1]=持有者有序集合(score=租约到期时间) | ARGV: 持有者, 租约秒数, 容量
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+    return 1
+end
+return 0
+"""
+
+_RENEW_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+return redis.call('ZADD', KEYS[1], 'XX', now + tonumber(ARGV[2]), ARGV[1])
+"""
+
+# 租约到期时间以 Redis 服务器时钟为准，统计未过期令牌时也用服务器时间，不和本机时钟比较
+_IN_USE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+return redis.call('ZCOUNT', KEYS[1], '(' .. now, '+inf')
+"""
+
+
+class RedisTokenPool:
+    """
+    令牌 = 有序集合里的一个成员(score 为租约到期时间，以 Redis 服务器时钟为准)
+    获取时先清掉过期租约再判断容量；持有期间定时续约，进程崩溃/被杀时令牌最多 TOKEN_LEASE_SEC 后回收
+    """
+
+    def __init__(self, redis, capacity: int):
+        self.redis = redis
+        self.capacity = capacity
+        self.key = f"{REDIS_KEY_PREFIX}:tokens"
+        self._acquire = redis.register_script(_ACQUIRE_LUA)
+        self._renew = redis.register_script(_RENEW_LUA)
+        self._in_use = redis.register_script(_IN_USE_LUA)
+
+    async def try_acquire(self, holder: str) -> bool:
+        return bool(await self._acquire(keys=[self.key], args=[holder, TOKEN_LEASE_SEC, self.capacity]))
+
+    async def renew(self, holder: str):
+        await self._renew(keys=[self.key], args=[holder, TOKEN_LEASE_SEC])
+
+    async def release(self, holder: str):
+        await self.redis.zrem(self.key, holder)
+
+    async def wait_release(self, timeout: float):
+        # 跨进程的释放通知不值得引入 pub/sub，短轮询(带抖动，避免各 worker 同步撞车)
+        await asyncio.sleep(min(timeout, ACQUIRE_POLL_SEC * (0.5 + random.random())))
+
+    async def in_use(self) -> int:
+        return int(await self._in_use(keys=[self.key]))
+
+
+class AdmissionController:
+    """
+    - limiter: 会话级滑动窗口限流(请求入口调用 check_rate)
+    - pool: 全局并发令牌池(图执行期间持有一个令牌，slot() 上下文负责 获取/续约/释放)
+    Redis 不可用时:限流放行(fail-open)，并发令牌退回进程内令牌池，服务不因 Redis 故障整体不可用
+    """
+
+    def __init__(self, limiter, pool, fallback_pool: MemoryTokenPool | None = None):
+        self.limiter = limiter
+        self.pool = pool
+        self.fallback_pool = fallback_pool
+        self.stats_counter = {"rate_limited": 0, "admitted": 0, "waited": 0, "wait_ms_total": 0.0, "backend_errors": 0}
+
+    async def check_rate(self, key: str) -> tuple[bool, float]:
+        try:
+            allowed, retry_after = await self.limiter.hit(key)
+        except Exception as e:
+            self.stats_counter["backend_errors"] += 1
+            logger.warning(f"⚠️ [Admission] 限流后端不可用，本次放行: {e}")
+            return True, 0.0
+        if not allowed:
+            self.stats_counter["rate_limited"] += 1
+        return allowed, retry_after
+
+    async def _call(self, method: str, *args):
+        try:
+            return await getattr(self.pool, method)(*args)
+        except Exception as e:
+            if self.fallback_pool is None:
+                raise
+            self.stats_counter["backend_errors"] += 1
+            logger.warning(f"⚠️ [Admission] 令牌池后端不可用，改用进程内令牌: {e}")
+            return await getattr(self.fallback_pool, method)(*args)
+
+    async def acquire(self, holder: str):
+        start = time.perf_counter()
+        waited = False
+        while not await self._call("try_acquire", holder):
+            waited = True
+            await self._call("wait_release", ACQUIRE_POLL_SEC * 4)
+        if waited:
+            self.stats_counter["waited"] += 1
+            self.stats_counter["wait_ms_total"] += (time.perf_counter() - start) * 1000
+        self.stats_counter["admitted"] += 1
+
+    async def release(self, holder: str):
+        if self.fallback_pool is not None:
+            # 获取时可能退回过进程内令牌池，两边都归还(不存在时是空操作)
+            await self.fallback_pool.release(holder)
+        await self._call("release", holder)
+
+    async def _keep_alive(self, holder: str):
+        while True:
+            await asyncio.sleep(TOKEN_RENEW_SEC)
+            try:
+                await self._call("renew", holder)
+            except Exception as e:
+                logger.warning(f"⚠️ [Admission] 令牌续约失败: {e}")
+
+    @asynccontextmanager
+    async def slot(self, holder: str):
+        """
+        持有一个全局并发令牌直到退出(等待期间不占令牌)
+        """
+        await self.acquire(holder)
+        async with self.held(holder):
+            yield
+
+    @asynccontextmanager
+    async def held(self, holder: str):
+        """
+        已经 acquire 到的令牌:退出前定时续约，退出时归还
+        """
+        keep_alive = asyncio.create_task(self._keep_alive(holder))
+        try:
+            yield
+        finally:
+            keep_alive.cancel()
+            # 取消/异常退出时也要归还令牌
+            await asyncio.shield(self.release(holder))
+
+    async def stats(self) -> dict:
+        try:
+            in_use = await self._call("in_use")
+        except Exception:
+            in_use = None
+        waited = self.stats_counter["waited"]
+        return {
+            **self.stats_counter,
+            "wait_ms_total": round(self.stats_counter["wait_ms_total"], 1),
+            "avg_wait_ms": round(self.stats_counter["wait_ms_total"] / waited, 1) if waited else 0.0,
+            "capacity": self.pool.capacity,
+            "in_use": in_use,
+            "limiter": self.limiter.stats(),
+        }
+
+
+def build_admission() -> AdmissionController:
+    if ADMISSION_BACKEND == "redis":
+        from redis.asyncio import Redis
+        redis = Redis.from_url(REDIS_URL)
+        logger.info(f"🚦 [Admission] 使用 Redis 限流/并发令牌: {REDIS_URL}")
+        return AdmissionController(
+            RedisRateLimiter(redis, RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW_SEC),
+            RedisTokenPool(redis, MAX_CONCURRENT_RUNS),
+            fallback_pool=MemoryTokenPool(MAX_CONCURRENT_RUNS),
+        )
+    return AdmissionController(
+        MemoryRateLimiter(RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW_SEC),
+        MemoryTokenPool(MAX_CONCURRENT_RUNS),
+    )
+
+
+admission = build_admission()
@@ -1,21 +1,24 @@
-import time
+import asyncio
 import uuid
-from collections import defaultdict
 from fastapi import APIRouter,Request
 from langchain_core.messages import HumanMessage
 from loguru import logger
 from pydantic import BaseModel
 from starlette.responses import JSONResponse, StreamingResponse
+from api.admission import admission
+from api.run_queue import run_queue
+from api.runs import run_store
 from api.stream import event_generator
-from tools.registry import SERVICE_STATUS
+from tools.registry import SERVICE_STATUS, global_mcp_pool, global_rag_store, global_ingest_pipeline
+from tools.startup import all_ready, component_status
+from config import RATE_LIMIT_MAX_REQUESTS
 
 class ChatRequest(BaseModel):
     message:str
     session_id:str = None
 
 
-# 限流存储（内存级别，重启清零，够用） - 不存在key 自动创建空list
-request_counts = defaultdict(list)
+STARTUP_WAIT_TIMEOUT_SEC = 60 # 服务刚启动时，请求最多等待组件初始化的时长
 
 # 挂载路由
 router = APIRouter()
@@ -26,16 +29,36 @@ async def chat_endpoint(payload:ChatRequest,request:Request): # 其中payload与
     sid = payload.session_id or str(uuid.uuid4())
     logger.info(f"收到请求 | Session: {sid}")
 
-    # 限流检查
-    now = time.time()
-    request_counts[sid] = [t for t in request_counts[sid] if now - t < 3600]  # 清理一小时前的记录
-    if len(request_counts[sid]) >= 6: # 超过六次拒绝
+    # 启动阶段的请求等待组件就绪(不阻塞事件循环)；超时/初始化失败返回503，不计入限流次数
+    try:
+        graph, _ = await asyncio.wait_for(
+            asyncio.gather(request.app.state.graph.aget(), global_rag_store.aget()),
+            timeout=STARTUP_WAIT_TIMEOUT_SEC,
+        )
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=503, content={"detail":"服务正在启动，请稍后再试"})
+    except Exception as e:
+        logger.error(f"❌ 服务组件初始化失败: {e}")
+        return JSONResponse(status_code=503, content={"detail":f"服务初始化失败: {e}"})
+
+    # 排队预计等待超出预算时直接拒绝(不计入限流次数)，避免请求在队列里耗到前端超时
+    eta = await run_queue.admit_or_reject()
+    if eta is not None:
+        return JSONResponse(
+            status_code=503,
+            content={"detail":f"当前排队人数较多(预计等待约{round(eta)}秒)，请稍后再试"},
+            headers={"Retry-After": str(round(eta))},
+        )
+
+    # 限流检查(会话级滑动窗口，多 worker 时由 Redis 共享计数)
+    allowed, retry_after = await admission.check_rate(sid)
+    if not allowed:
         logger.warning(f"🚫 限流触发 | Session: {sid}")
         return JSONResponse(
             status_code=429,
-            content={"detail":"每小时最多访问6次，请稍后再试!"}
+            content={"detail":f"每小时最多访问{RATE_LIMIT_MAX_REQUESTS}次，请稍后再试!"},
+            headers={"Retry-After": str(int(retry_after) + 1)},
         )
-    request_counts[sid].append(now)
 
 
     # 构造config(为数据库指明会话)
@@ -48,19 +71,62 @@ async def chat_endpoint(payload:ChatRequest,request:Request): # 其中payload与
         "messages":[HumanMessage(content=payload.message)],
         "session_id":sid
     }
-    graph = request.app.state.graph
-    # 返回流式响应
+    # 图在后台任务里执行，与本次连接解耦；连接断开后可通过 /runs/{run_id}/events 续传
+    run_id = str(uuid.uuid4())
+    run = run_store.start(run_id, sid, event_generator(graph, inputs, config, sid, run_id))
+    return _sse_response(run_store.subscribe(run), run_id)
+
+
+# 订阅/续传一次运行的事件流(已完成的运行直接返回缓存的记录)
+@router.get("/runs/{run_id}/events")
+async def run_events(run_id:str, request:Request, last_event_id:int = None):
+    run = run_store.get(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"detail":"运行不存在或已过期"})
+    # 浏览器 EventSource 重连时自动带 Last-Event-ID 头；其他客户端也可以用查询参数
+    header = request.headers.get("last-event-id")
+    if header and header.isdigit():
+        last_event_id = int(header)
+    return _sse_response(run_store.subscribe(run, last_event_id), run_id)
+
+
+def _sse_response(frames, run_id:str):
     return StreamingResponse(
-        event_generator(graph,inputs, config,sid),
+        frames,
         media_type="text/event-stream", # SSE流
         # 减少中间件缓冲
         headers={
             "Cache-Control": "no-cache", # 不要缓存流
             "Connection": "keep-alive", # 保持长连接
             "X-Accel-Buffering": "no", # 不要缓冲
+            "X-Run-Id": run_id, # 客户端据此断线重连
         },
     )
 
 @router.get("/service/status")
 async def service_status():
-    return SERVICE_STATUS
\ No newline at end of file
+    """
+    不依赖任何重组件，启动后立即可用(健康检查)；components 给出各组件的初始化状态
+    """
+    return {**SERVICE_STATUS, "ready": all_ready(), "components": component_status()}
+
+@router.get("/service/metrics")
+async def service_metrics():
+    """
+    运行指标(缓存命中率/入库队列等)，用于观察优化效果
+    """
+    if not global_rag_store.ready:
+        return JSONResponse(status_code=503, content={"detail":"RAG 系统尚未就绪","components":component_status()})
+    return {
+        "embedding_cache": global_rag_store.embedding.stats(),
+        "embedding_dispatch": global_rag_store.embedding.base.stats() if hasattr(global_rag_store.embedding.base, "stats") else {},
+        "ingest": global_ingest_pipeline.stats(),
+        "chunk_dedup": global_rag_store.chunk_dedup.stats(),
+        "corpus": global_rag_store.corpus.stats(),
+        "vector_backend": global_rag_store.backend.stats(),
+        "rerank": {**global_rag_store.rerank_batcher.stats(), **global_rag_store.rerank_stats},
+        "mcp": global_mcp_pool.stats(),
+        "admission": await admission.stats(),
+        "queue": run_queue.stats(),
+        "runs": run_store.stats(),
+    }
@@ -0,0 +1,180 @@
+# 图执行排队:令牌池前面的先来先服务队列
+# 原来令牌用完时请求卡在 async with 里，客户端什么也收不到，可能等到前端读超时；
+# 现在排队期间定时推送 queued 事件(位置 + 预计等待)，预计等待超出预算时直接 503
+import asyncio
+import heapq
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from loguru import logger
+
+from api.admission import AdmissionController, admission
+from config import QUEUE_MAX_WAIT_SEC
+
+QUEUE_UPDATE_SEC = 5 # 排队期间 queued 事件的推送间隔(同时充当心跳，避免前端读超时)
+RUN_ESTIMATE_INIT_SEC = 60 # 没有历史数据时，单次图执行的预估时长
+RUN_ESTIMATE_ALPHA = 0.2 # 单次执行时长的 EWMA 平滑系数
+
+
+@dataclass(eq=False)
+class _Ticket:
+    holder: str
+    weight: float # 相对开销，1 = 一次普通研究；只影响预计等待时间的估算
+    enqueued: float
+    acquire: asyncio.Task | None = None
+    admitted: bool = False
+
+
+class RunQueue:
+    """
+    - 本进程内严格按到达顺序放行:只有队首去令牌池取令牌，后面的只等待，不会被后到的请求插队
+    - 预计等待:按当前运行中任务的剩余时长 + 前面排队任务的预估时长，模拟 capacity 个槽位依次空出
+    - 单次执行时长用 EWMA 估计(按权重归一化)
+    多 worker(Redis 令牌池)时各 worker 各自排队，队列之间不保证顺序，其他 worker 上运行中的任务按半个平均时长估算
+    """
+
+    def __init__(self, controller: AdmissionController, max_wait_sec: float):
+        self.admission = controller
+        self.max_wait_sec = max_wait_sec
+        self._waiting: deque[_Ticket] = deque()
+        self._running: dict[str, tuple[float, float]] = {} # holder -> (开始时间, 权重)
+        self._changed = asyncio.Event()
+        self._run_sec = RUN_ESTIMATE_INIT_SEC # 权重为1的一次执行的平均时长
+        self.stats_counter = {"queued": 0, "admitted": 0, "rejected": 0, "abandoned": 0, "queue_ms_total": 0.0}
+
+    # 预计等待
+    async def _slots(self) -> list[float]:
+        """
+        每个槽位还要多久空出(秒)
+        """
+        now = time.monotonic()
+        capacity = self.admission.pool.capacity
+        busy = [max(self._run_sec * w - (now - start), 0.0) for start, w in self._running.values()]
+        try:
+            in_use = await self.admission._call("in_use")
+        except Exception:
+            in_use = len(busy)
+        busy += [self._run_sec / 2] * max(0, in_use - len(busy)) # 其他 worker 上的任务
+        busy.sort()
+        slots = busy[:capacity] + [0.0] * max(0, capacity - len(busy))
+        heapq.heapify(slots)
+        return slots
+
+    async def _eta(self, ahead: list[_Ticket]) -> float:
+        slots = await self._slots()
+        for t in ahead:
+            heapq.heappush(slots, heapq.heappop(slots) + self._run_sec * t.weight)
+        return slots[0]
+
+    async def estimate_wait(self) -> float:
+        """
+        现在入队的话，预计要等多久(秒)
+        """
+        return await self._eta(list(self._waiting))
+
+    async def admit_or_reject(self) -> float | None:
+        """
+        入口检查:预计等待超出预算时返回预计秒数(调用方返回 503)，否则返回 None
+        """
+        eta = await self.estimate_wait()
+        if eta > self.max_wait_sec:
+            self.stats_counter["rejected"] += 1
+            logger.warning(f"🚧 [Queue] 预计等待 {eta:.0f}s 超出预算 {self.max_wait_sec}s，拒绝 | 排队 {len(self._waiting)}")
+            return eta
+        return None
+
+    # 排队
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _remove(self, ticket: _Ticket):
+        try:
+            self._waiting.remove(ticket)
+        except ValueError:
+            return
+        self._notify()
+
+    async def wait_turn(self, holder: str, weight: float = 1.0):
+        """
+        排队直到取得令牌；等待期间产出 (前面的任务数, 预计等待秒数)
+        正常结束时已经持有令牌，之后用 running(holder) 包住图执行；中途退出(客户端断开)时自动出队
+        """
+        ticket = _Ticket(holder, weight, time.monotonic())
+        self._waiting.append(ticket)
+        queued = False
+        last_sent = None
+        try:
+            while True:
+                changed = self._changed
+                if ticket.acquire is None and self._waiting[0] is ticket:
+                    ticket.acquire = asyncio.create_task(self.admission.acquire(holder))
+                    await asyncio.sleep(0) # 有空闲令牌时直接拿到，不产生排队事件
+                if ticket.acquire is not None and ticket.acquire.done():
+                    ticket.acquire.result()
+                    ticket.admitted = True
+                    break
+
+                position = self._waiting.index(ticket)
+                eta = await self._eta(list(self._waiting)[:position])
+                now = time.monotonic()
+                if last_sent is None or last_sent[0] != position or now - last_sent[1] >= QUEUE_UPDATE_SEC:
+                    if not queued:
+                        queued = True
+                        self.stats_counter["queued"] += 1
+                        logger.info(f"⏳ [Queue] 排队 | run_id={holder} 前面 {position} 个 | 预计 {eta:.0f}s")
+                    last_sent = (position, now)
+                    yield position, eta
+
+                waiters = [asyncio.ensure_future(changed.wait())]
+                if ticket.acquire is not None:
+                    waiters.append(ticket.acquire)
+                await asyncio.wait(waiters, timeout=QUEUE_UPDATE_SEC, return_when=asyncio.FIRST_COMPLETED)
+                waiters[0].cancel()
+        finally:
+            self._remove(ticket)
+            if not ticket.admitted:
+                self.stats_counter["abandoned"] += 1
+                if ticket.acquire is not None:
+                    ticket.acquire.cancel()
+                    try:
+                        await ticket.acquire
+                        # 取消前刚好拿到了令牌
+                        await asyncio.shield(self.admission.release(holder))
+                    except (asyncio.CancelledError, Exception):
+                        pass
+        self.stats_counter["admitted"] += 1
+        self.stats_counter["queue_ms_total"] += (time.monotonic() - ticket.enqueued) * 1000
+
+    @asynccontextmanager
+    async def running(self, holder: str, weight: float = 1.0):
+        """
+        wait_turn 拿到令牌之后的执行阶段:续约/归还令牌，并记录执行时长用于预估
+        """
+        start = time.monotonic()
+        self._running[holder] = (start, weight)
+        try:
+            async with self.admission.held(holder):
+                yield
+            # 被取消的运行时长不代表正常耗时，不计入预估
+            seconds = (time.monotonic() - start) / weight
+            self._run_sec += RUN_ESTIMATE_ALPHA * (seconds - self._run_sec)
+        finally:
+            del self._running[holder]
+            self._notify()
+
+    def stats(self) -> dict:
+        admitted = self.stats_counter["admitted"]
+        return {
+            **self.stats_counter,
+            "queue_ms_total": round(self.stats_counter["queue_ms_total"], 1),
+            "avg_queue_ms": round(self.stats_counter["queue_ms_total"] / admitted, 1) if admitted else 0.0,
+            "waiting": len(self._waiting),
+            "running": len(self._running),
+            "run_estimate_s": round(self._run_sec, 1),
+        }
+
+
+run_queue = RunQueue(admission, QUEUE_MAX_WAIT_SEC)
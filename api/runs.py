@@ -0,0 +1,289 @@
+# 研究任务与推送解耦:图在后台任务里执行，事件写入每个运行自己的缓冲区，客户端随时(重新)订阅
+# 原来图的执行绑在 /chat 这个 HTTP 请求上，连接一断几分钟的 LLM/搜索工作就白做了，也无法重连
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator
+
+from loguru import logger
+
+from api.stream import make_event
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+RUN_BUFFER_EVENTS = 2000 # 每个运行保留的最近事件数(断线续传的窗口)
+RUN_CACHE_MAX = 200 # 最多缓存多少个已完成的运行
+RUN_CACHE_TTL_SEC = 3600 # 已完成运行的缓存时长
+RUN_ORPHAN_GRACE_SEC = 20 # 运行中没有任何订阅者(客户端断开且未重连)超过该时长就取消，不再白白消耗 LLM/搜索
+
+
+ENVELOPE_FIELDS = ("protocol_version", "run_id", "session_id") # 同一运行内所有事件都相同的字段
+
+if ORJSON_AVAILABLE:
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    # 紧凑分隔符 + 复用同一个编码器实例
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+class Run:
+    """
+    一次研究运行
+    - buffer: 最近 RUN_BUFFER_EVENTS 个原始事件(环形缓冲)，断线后按 Last-Event-ID 从中续传
+    - snapshot: 压缩后的完整记录(同一来源的连续 token 合并成一条)，续传点已被环形缓冲挤出/首次打开时用它重放
+    - 完成后 snapshot 一次性编码成SSE文本缓存，之后重新打开报告直接返回，不再重复序列化
+    """
+
+    def __init__(self, run_id: str, sid: str):
+        self.run_id = run_id
+        self.sid = sid
+        self.seq = 0 # 最后一个事件的编号(从1开始)
+        self.buffer: deque[tuple[int, str]] = deque(maxlen=RUN_BUFFER_EVENTS)
+        self.snapshot: list[tuple[int, dict]] = [] # (该条覆盖到的最后一个事件编号, 事件)
+        self.done = False
+        self.created = time.time()
+        self.finished: float | None = None
+        self.task: asyncio.Task | None = None
+        self.exec_started: float | None = None # 排队结束、开始执行的时间
+        self.cancelled = False
+        self.subscribers = 0
+        self.unwatched_sec = 0.0 # 运行中没有订阅者的累计时长
+        self._unwatched_since: float | None = None
+        self._orphan_timer: asyncio.TimerHandle | None = None
+        self._replay: str | None = None
+        self._changed = asyncio.Event()
+        # 静态字段只编码一次，每帧只序列化变化的部分再拼接
+        self._envelope = dumps({"protocol_version": "v1", "run_id": run_id, "session_id": sid})[:-1]
+
+    def _frame(self, seq: int, data: dict) -> str:
+        # 带 id 的SSE帧，客户端断线重连时通过 Last-Event-ID 带回
+        body = dumps({k: v for k, v in data.items() if k not in ENVELOPE_FIELDS})
+        return f"id: {seq}\ndata: {self._envelope},{body[1:]}\n\n"
+
+    def append(self, data: dict):
+        if self.exec_started is None and data.get("type") != "queued":
+            self.exec_started = time.time()
+        frame = self._frame(self.seq + 1, data) # 先编码:事件无法序列化时抛出，不留下空缺的编号
+        self.seq += 1
+        self.buffer.append((self.seq, frame))
+        last = self.snapshot[-1][1] if self.snapshot else None
+        if (last is not None and data.get("type") == "token" and last.get("type") == "token"
+                and last.get("source") == data.get("source")):
+            self.snapshot[-1] = (self.seq, {**last, "content": last.get("content", "") + data.get("content", "")})
+        elif last is not None and data.get("type") == "queued" and last.get("type") == "queued":
+            self.snapshot[-1] = (self.seq, data) # 排队进度只保留最新一条
+        else:
+            self.snapshot.append((self.seq, data))
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self.finished = time.time()
+        self._attach() # 结算无人观看时长，撤掉取消计时
+        self._replay = "".join(self._frame(seq, data) for seq, data in self.snapshot)
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _replay_frames(self, reset: bool) -> str:
+        head = ""
+        if reset:
+            # reset 不带 id:它后面若断线，客户端仍带着旧的续传点回来，重新走一遍重放
+            reset_event = {"type": "reset", "protocol_version": "v1", "ts": int(time.time() * 1000),
+                           "run_id": self.run_id, "session_id": self.sid}
+            head = f"data: {dumps(reset_event)}\n\n"
+        if self._replay is not None:
+            return head + self._replay
+        return head + "".join(self._frame(seq, data) for seq, data in self.snapshot)
+
+    # 断线检测:订阅者归零时开始计时，宽限期内没有重连就取消运行
+    def _attach(self):
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+        if self._unwatched_since is not None:
+            self.unwatched_sec += time.time() - self._unwatched_since
+            self._unwatched_since = None
+
+    def _detach(self):
+        if self.subscribers or self.done or self._orphan_timer is not None:
+            return
+        self._unwatched_since = time.time()
+        self._orphan_timer = asyncio.get_running_loop().call_later(RUN_ORPHAN_GRACE_SEC, self._cancel_orphan)
+
+    def _cancel_orphan(self):
+        self._orphan_timer = None
+        if self.subscribers or self.done or self.task is None:
+            return
+        logger.warning(f"🔌 [Runs] 客户端已断开 {RUN_ORPHAN_GRACE_SEC}s 未重连，取消运行 | run_id={self.run_id}")
+        self.cancel()
+
+    def cancel(self):
+        if not self.done and self.task is not None:
+            self.cancelled = True
+            self.task.cancel()
+
+    async def subscribe(self, last_event_id: int | None = None) -> AsyncIterator[str]:
+        """
+        产出SSE帧:last_event_id 之后的事件 + 之后的实时事件，直到运行结束
+        - 不带 last_event_id:从头重放(压缩记录)
+        - 续传点仍在环形缓冲内:只补发缺失的事件
+        - 续传点已被挤出:先发 reset(客户端清空已显示的内容)，再重放压缩记录
+        客户端断开时 StreamingResponse 取消/关闭本生成器，finally 里登记断开
+        """
+        self.subscribers += 1
+        self._attach()
+        try:
+            async for frames in self._frames(last_event_id):
+                yield frames
+        finally:
+            self.subscribers -= 1
+            self._detach()
+
+    async def _frames(self, last_event_id: int | None) -> AsyncIterator[str]:
+        cursor = last_event_id or 0
+        if last_event_id is None and self.seq:
+            yield self._replay_frames(reset=False)
+            cursor = self.seq
+        while True:
+            changed = self._changed
+            if cursor < self.seq:
+                if self.buffer and cursor < self.buffer[0][0] - 1:
+                    # 消费太慢/断线太久，缺失的部分已经不在缓冲区里
+                    yield self._replay_frames(reset=True)
+                    cursor = self.seq
+                else:
+                    frames = [frame for seq, frame in self.buffer if seq > cursor]
+                    cursor = self.seq
+                    yield "".join(frames)
+                continue
+            if self.done:
+                return
+            await changed.wait()
+
+    def status(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "session_id": self.sid,
+            "done": self.done,
+            "cancelled": self.cancelled,
+            "subscribers": self.subscribers,
+            "events": self.seq,
+            "created": self.created,
+            "seconds": round((self.finished or time.time()) - self.created, 1),
+        }
+
+
+class RunStore:
+    """
+    运行登记表:运行中的任务一直保留；已完成的按 LRU + TTL 缓存
+    单进程内有效，多 worker 部署时需要按 run_id/会话做粘性路由
+    """
+
+    def __init__(self, max_finished: int = RUN_CACHE_MAX, ttl_sec: float = RUN_CACHE_TTL_SEC):
+        self.max_finished = max_finished
+        self.ttl_sec = ttl_sec
+        self._runs: OrderedDict[str, Run] = OrderedDict()
+        self.stats_counter = {
+            "started": 0, "completed": 0, "cancelled": 0,
+            "subscriptions": 0, "resumes": 0, "cache_hits": 0, "evicted": 0,
+            # 执行耗时(不含排队):跑完的算有效，被取消的算浪费；unwatched 是执行期间没有客户端在看的时长
+            "useful_run_s": 0.0, "wasted_run_s": 0.0, "unwatched_run_s": 0.0,
+        }
+
+    def start(self, run_id: str, sid: str, events: AsyncIterator[dict]) -> Run:
+        run = Run(run_id, sid)
+        self._runs[run_id] = run
+        run.task = asyncio.create_task(self._drive(run, events), name=f"run-{run_id}")
+        run._detach() # 客户端在响应开始前就断开时同样会被回收
+        self.stats_counter["started"] += 1
+        self._evict()
+        return run
+
+    async def _drive(self, run: Run, events: AsyncIterator[dict]):
+        try:
+            try:
+                async for data in events:
+                    run.append(data)
+            except asyncio.CancelledError:
+                run.cancelled = True
+                # 之后重连/打开这个运行的客户端能看到明确的结束
+                run.append(make_event("error", run.run_id, run.sid, source="system", content="研究已取消(客户端断开)"))
+                run.append(make_event("done", run.run_id, run.sid))
+                raise
+            except Exception as e:
+                logger.exception(f"❌ [Runs] 运行异常 | run_id={run.run_id}")
+                run.append(make_event("error", run.run_id, run.sid, source="system", content=str(e)))
+            finally:
+                # 关闭事件源(归还令牌/退出运行队列)；关闭本身出错也不能影响下面的收尾
+                try:
+                    await events.aclose()
+                except Exception:
+                    logger.exception(f"❌ [Runs] 关闭事件源失败 | run_id={run.run_id}")
+        finally:
+            # 不管事件源怎样结束，都要标记完成，否则订阅者会一直等下去
+            run.finish()
+            self._account(run)
+            logger.info(f"🏁 [Runs] 运行结束 | run_id={run.run_id} 事件 {run.seq} 个"
+                        f"{' (已取消)' if run.cancelled else ''}")
+
+    def _account(self, run: Run):
+        exec_sec = run.finished - run.exec_started if run.exec_started else 0.0
+        self.stats_counter["cancelled" if run.cancelled else "completed"] += 1
+        self.stats_counter["wasted_run_s" if run.cancelled else "useful_run_s"] += exec_sec
+        self.stats_counter["unwatched_run_s"] += min(run.unwatched_sec, exec_sec)
+
+    def get(self, run_id: str) -> Run | None:
+        self._evict()
+        run = self._runs.get(run_id)
+        if run is not None:
+            self._runs.move_to_end(run_id)
+        return run
+
+    def subscribe(self, run: Run, last_event_id: int | None = None) -> AsyncIterator[str]:
+        self.stats_counter["subscriptions"] += 1
+        if last_event_id is not None:
+            self.stats_counter["resumes"] += 1
+        elif run.done:
+            self.stats_counter["cache_hits"] += 1
+        return run.subscribe(last_event_id)
+
+    def _evict(self):
+        now = time.time()
+        finished = [r for r in self._runs.values() if r.done]
+        overflow = len(finished) - self.max_finished
+        for run in finished: # 按最近访问从旧到新
+            if overflow > 0 or now - run.finished > self.ttl_sec:
+                del self._runs[run.run_id]
+                overflow -= 1
+                self.stats_counter["evicted"] += 1
+
+    async def close(self):
+        tasks = [r.task for r in self._runs.values() if r.task is not None and not r.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        running = sum(1 for r in self._runs.values() if not r.done)
+        useful, wasted = self.stats_counter["useful_run_s"], self.stats_counter["wasted_run_s"]
+        return {
+            **self.stats_counter,
+            "useful_run_s": round(useful, 1),
+            "wasted_run_s": round(wasted, 1),
+            "unwatched_run_s": round(self.stats_counter["unwatched_run_s"], 1),
+            "wasted_ratio": round(wasted / (useful + wasted), 3) if useful + wasted else 0.0,
+            "running": running,
+            "cached": len(self._runs) - running,
+        }
+
+
+run_store = RunStore()
@@ -1,15 +1,16 @@
 import asyncio
-import json
 import re
-import uuid
 import time
+from contextlib import aclosing
 from loguru import logger
+from api.run_queue import run_queue
+from tools.registry import global_ingest_pipeline, global_rag_store
 from tools.utils_event import parse_langgraph_event
 
 
-# 全局并发限制
-MAX_CONCURRENT_USERS = asyncio.Semaphore(5)
 GRAPH_RUN_TIMEOUT_SEC = 240
+TOKEN_FLUSH_CHARS = 200 # token 合并:攒够这么多字符就推送一帧
+TOKEN_FLUSH_SEC = 0.05 # token 合并:第一个 token 到达后最多攒这么久(保持打字机效果)
 
 def _to_phase_from_source(source:str):
     if source in ("manager","planner"):
@@ -87,37 +88,113 @@ def adapt_event_for_ui(data:dict,fsm_state:dict,run_id:str,sid:str):
 
 
 
+async def coalesce_tokens(events, max_chars:int = TOKEN_FLUSH_CHARS, max_delay:float = TOKEN_FLUSH_SEC):
+    """
+    把同一来源的连续 token 合并成一个:攒够 max_chars 或超过 max_delay 就推送，其他事件到达前先推送已攒的
+    原来每个 token 单独一帧(构造事件 + 序列化 + 前端整篇重绘)；合并后帧数降一个数量级
+    源事件在单独的任务里拉取(astream_events 始终在同一个任务里迭代)，按时间窗等待时不会打断它；退出时取消该任务
+    """
+    queue = asyncio.Queue(maxsize=256)
+
+    async def pump():
+        try:
+            async for data in events:
+                await queue.put((data, None))
+            await queue.put((None, None))
+        except Exception as e:
+            await queue.put((None, e))
+
+    producer = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    pending, deadline = None, None # 正在攒的 token 事件 / 它必须推送的时间
+    try:
+        while True:
+            try:
+                if deadline is None:
+                    data, error = await queue.get()
+                else:
+                    data, error = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+            except TimeoutError:
+                yield pending
+                pending, deadline = None, None
+                continue
+            if error is not None or data is None: # 源出错/结束:先推送已攒的
+                break
+            if data.get("type") == "token":
+                if pending is not None and pending["source"] == data.get("source"):
+                    pending["content"] += data["content"]
+                else:
+                    if pending is not None:
+                        yield pending
+                    pending, deadline = dict(data), loop.time() + max_delay
+                if len(pending["content"]) >= max_chars:
+                    yield pending
+                    pending, deadline = None, None
+                continue
+            if pending is not None:
+                yield pending
+                pending, deadline = None, None
+            yield data
+        if pending is not None:
+            yield pending
+        if error is not None:
+            raise error
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+
+async def _parsed_events(graph,inputs:dict,config:dict):
+    # 启动Graph流式执行 - 这里只负责丢数据，展示什么数据(如on_tool_start)由前端来管
+    async for event in graph.astream_events(inputs,config,version="v2"):# 产出原始事件
+        data = parse_langgraph_event(event)
+        if data:
+            yield data
+
+
 # 流式输出
-async def event_generator(graph,inputs:dict,config:dict,sid:str):
+async def event_generator(graph,inputs:dict,config:dict,sid:str,run_id:str):
     """
-    翻译层 | 将LangGraph事件转换为SSE数据流
+    翻译层 | 将LangGraph事件转换为UI协议事件(由 api/runs.py 写入运行缓冲区并编码为SSE)
     """
-    # 限制最大并发数
-    async with MAX_CONCURRENT_USERS:
-        run_id = str(uuid.uuid4())
+    # 限制最大并发数(全局令牌池，多 worker 共享):令牌用完时排队，并把排队位置推给前端
+    async with aclosing(run_queue.wait_turn(run_id)) as waiting:
+        async for position, eta in waiting:
+            yield make_event("queued", run_id, sid, source="system", position=position, eta_sec=round(eta))
+    async with run_queue.running(run_id):
         try:
             fsm_state = {"phase": None}
             async with asyncio.timeout(GRAPH_RUN_TIMEOUT_SEC):
-                # 启动Graph流式执行 - 这里只负责丢数据，展示什么数据(如on_tool_start)由前端来管
-                async for event in graph.astream_events(inputs,config,version="v2"):# 产出原始事件
-                    data = parse_langgraph_event(event)
-                    ui_events = adapt_event_for_ui(data,fsm_state,run_id,sid)
-                    for data in ui_events:
-                        # 返回SSE协议格式数据
-                        yield f"data: {json.dumps(data,ensure_ascii=False)}\n\n"
+                # 连续的 token 先合并，再转换成协议事件(每帧只构造/序列化一次)
+                async with aclosing(coalesce_tokens(_parsed_events(graph,inputs,config))) as events:
+                    async for data in events:
+                        for ui_event in adapt_event_for_ui(data,fsm_state,run_id,sid):
+                            yield ui_event
+        except asyncio.CancelledError:
+            # 客户端断开(或服务关闭):取消信号已经沿着 astream_events 传进各个节点/研究员子图/MCP调用，
+            # 这里再丢弃该会话还没入库的文档，并释放已写入的部分(writer 不会再跑)
+            logger.warning(f"🛑 研究已取消 | sid={sid} run_id={run_id}")
+            await asyncio.shield(_release_session(sid))
+            raise
         except TimeoutError:
             err_str = f"⏰ 本次研究超时（>{GRAPH_RUN_TIMEOUT_SEC}s），请缩小问题范围或稍后重试。"
             logger.warning(f"Graph run timeout | sid={sid} run_id={run_id}")
-            error_data = make_event("error", run_id, sid, source="system", content=err_str)
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+            yield make_event("error", run_id, sid, source="system", content=err_str)
         except Exception as e:
             err_str = str(e)
             # 如果是风控导致的后续崩溃，直接返回用户
             if "Content Exists Risk" in err_str or "No AIMessage found" in err_str:
                 err_str = "⚠️ 系统安全策略拦截：该话题无法继续研究。"
             logger.exception("❌ 运行出错")
-            error_data = make_event("error",run_id,sid,source="system",content=err_str)
-            yield f"data: {json.dumps(error_data,ensure_ascii=False)}\n\n"
-        finally:
-            done = make_event("done",run_id,sid)
-            yield f"data: {json.dumps(done,ensure_ascii=False)}\n\n"
\ No newline at end of file
+            yield make_event("error",run_id,sid,source="system",content=err_str)
+        # done 放在 try 之后而不是 finally 里:调用方 aclose() 关闭生成器时(GeneratorExit)不能再 yield
+        yield make_event("done",run_id,sid)
+
+
+async def _release_session(sid:str):
+    try:
+        await global_ingest_pipeline.cancel_session(sid)
+        rag_store = await global_rag_store.aget()
+        await asyncio.to_thread(rag_store.clear_session, sid)
+    except Exception as e:
+        logger.error(f"❌ 取消后清理会话失败: {e}")
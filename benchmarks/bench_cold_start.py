@@ -0,0 +1,78 @@
+# 冷启动基准:从拉起 uvicorn 进程开始计时，轮询 /service/status
+# 记录 首次响应(健康检查可用) 的时间，以及每个组件 就绪/失败 的时间
+# 运行: python -m benchmarks.bench_cold_start [--port 8799 --timeout 120 --runs 3]
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+POLL_INTERVAL_SEC = 0.02
+
+
+def port_in_use(port: int) -> bool:
+    try:
+        urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=0.5)
+    except urllib.error.HTTPError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def run_once(port: int, timeout: float) -> dict:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    t0 = time.perf_counter()
+    result = {"first_response_s": None, "components": {}}
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/service/status", timeout=1) as r:
+                    data = json.loads(r.read())
+            except OSError:
+                time.sleep(POLL_INTERVAL_SEC)
+                continue
+            now = time.perf_counter() - t0
+            if result["first_response_s"] is None:
+                result["first_response_s"] = round(now, 2)
+            for name, c in data.get("components", {}).items():
+                if c["state"] in ("ready", "failed") and name not in result["components"]:
+                    result["components"][name] = {"state": c["state"], "at_s": round(now, 2), "init_s": c["seconds"]}
+            components = data.get("components", {})
+            if components and all(c["state"] in ("ready", "failed") for c in components.values()):
+                result["all_settled_s"] = round(now, 2)
+                break
+            time.sleep(POLL_INTERVAL_SEC)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    if port_in_use(args.port):
+        raise SystemExit(f"端口 {args.port} 已被占用，换一个 --port")
+    results = []
+    for i in range(args.runs):
+        res = run_once(args.port, args.timeout)
+        results.append(res)
+        print(f"run {i + 1}: {json.dumps(res, ensure_ascii=False)}")
+    firsts = [r["first_response_s"] for r in results if r["first_response_s"] is not None]
+    if firsts:
+        print(f"首次响应 中位数 {statistics.median(firsts):.2f}s | 最慢 {max(firsts):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
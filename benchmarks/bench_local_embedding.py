@@ -0,0 +1,81 @@
+# 本地Embedding基准:PyTorch HuggingFaceEmbeddings vs int8 ONNX(合批)，比较 冷启动/常驻内存/吞吐
+# 每个引擎在独立子进程里跑，峰值内存(ru_maxrss)互不影响；需要能下载模型(或本地已有缓存)
+# 运行: python -m benchmarks.bench_local_embedding [--chunks 256 --clients 8 --engines torch,onnx]
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import EMBEDDING_MODEL_NAME, LOCAL_EMBEDDING_ONNX_FILE, LOCAL_EMBEDDING_ONNX_REPO
+
+WORDS = "检索 增强 生成 向量 数据库 模型 推理 量化 research agent embedding retrieval latency throughput".split()
+
+
+def make_chunks(n: int) -> list[str]:
+    # 长短不一的片段(切片上限1200字)，接近真实入库的长度分布
+    rng = random.Random(0)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 400))) for _ in range(n)]
+
+
+def load(engine: str):
+    if engine == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL_NAME,
+            model_kwargs={"device": "cpu"},
+            encode_kwargs={"normalize_embeddings": True},
+        )
+    from tools.local_embedding import shared_engine
+    return shared_engine(repo_id=LOCAL_EMBEDDING_ONNX_REPO, model_file=LOCAL_EMBEDDING_ONNX_FILE)
+
+
+def child(engine: str, n_chunks: int, clients: int):
+    chunks = make_chunks(n_chunks)
+    t0 = time.perf_counter()
+    model = load(engine)
+    model.embed_query("warmup")
+    cold_start = time.perf_counter() - t0
+
+    # clients 个并发调用方，各自按 8 条一组提交(模拟多个会话同时入库)
+    groups = [chunks[i: i + 8] for i in range(0, len(chunks), 8)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        vectors = [v for part in pool.map(model.embed_documents, groups) for v in part]
+    elapsed = time.perf_counter() - t0
+
+    print(json.dumps({
+        "engine": engine,
+        "cold_start_s": round(cold_start, 1),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+        "chunks_per_s": round(len(vectors) / elapsed, 1),
+        "dim": len(vectors[0]),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=256)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--engines", default="torch,onnx")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.chunks, args.clients)
+        return
+    for engine in args.engines.split(","):
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_local_embedding", "--child", engine,
+             "--chunks", str(args.chunks), "--clients", str(args.clients)],
+            capture_output=True, text=True,
+        )
+        lines = out.stdout.strip().splitlines()
+        print(lines[-1] if out.returncode == 0 and lines else f"{engine}: 失败\n{out.stderr[-2000:]}")
+
+
+if __name__ == "__main__":
+    main()
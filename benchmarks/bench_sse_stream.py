@@ -0,0 +1,126 @@
+# SSE 推送基准:一篇典型报告(约4000字)逐 token 推送时的 帧数/字节数/序列化吞吐/前端重绘量
+# 旧:每个 token 一帧(make_event + json.dumps(ensure_ascii=False))，前端每帧对全文 format_sources_simple 并整篇重绘
+# 新:token 按 大小/时间窗 合并，静态字段预编码(orjson 可用时用 orjson)，前端只刷新最后一段
+# 运行: python -m benchmarks.bench_sse_stream [--rates 30,60,120 --speedup 10]
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "frontend"))
+
+import api.stream as stream  # noqa: E402
+from api.runs import ORJSON_AVAILABLE, Run  # noqa: E402
+from chat_flow import IncrementalMarkdown, format_sources_simple  # noqa: E402
+
+RUN_ID = "3f1c2a9e-6b0d-4c4e-9a57-1e2f3a4b5c6d"
+SESSION_ID = "8d7e6f5a-4b3c-2d1e-0f9a-8b7c6d5e4f3a"
+
+
+def make_report(seed: int = 0) -> str:
+    rng = random.Random(seed)
+    words = ["市场", "规模", "增长", "技术", "路线", "成本", "下降", "应用", "场景", "政策", "支持", "竞争", "格局",
+             "头部", "厂商", "份额", "数据", "显示", "预计", "未来", "三年", "复合", "增速", "达到", "核心", "瓶颈"]
+    parts = ["# 行业深度研究报告\n"]
+    for i in range(1, 7):
+        parts.append(f"## {i}. 课题{i}\n")
+        for _ in range(3):
+            sentence = "".join(rng.choice(words) for _ in range(rng.randint(60, 110)))
+            parts.append(f"{sentence}[{rng.randint(1, 8)}]。\n")
+    parts.append("数据来源 " + " ".join(f"[{i}] https://example.com/report-{i}" for i in range(1, 9)))
+    return "\n".join(parts)
+
+
+def tokenize(text: str, seed: int = 0) -> list[str]:
+    # 中文 LLM 的 token 大多是 1~3 个字
+    rng = random.Random(seed)
+    tokens, i = [], 0
+    while i < len(text):
+        n = rng.choice((1, 1, 2, 2, 2, 3))
+        tokens.append(text[i:i + n])
+        i += n
+    return tokens
+
+
+class _Slot:
+    # 模拟 st.empty()/st.container()，只统计推给浏览器的 markdown 字符数
+    def __init__(self, counter: list):
+        self.counter = counter
+
+    def container(self):
+        return _Slot(self.counter)
+
+    def empty(self):
+        return _Slot(self.counter)
+
+    def markdown(self, text):
+        self.counter[0] += len(text)
+
+
+def legacy(tokens: list[str]) -> dict:
+    # 原实现:每个 token 一帧
+    start = time.perf_counter()
+    frames = [f"data: {json.dumps(stream.make_event('token', RUN_ID, SESSION_ID, source='writer', content=t), ensure_ascii=False)}\n\n"
+              for t in tokens]
+    encode_s = time.perf_counter() - start
+    rendered, full = 0, ""
+    for t in tokens:
+        full += t
+        rendered += len(format_sources_simple(full))
+    return {"frames": len(frames), "bytes": sum(len(f.encode()) for f in frames), "encode_s": encode_s, "rendered_chars": rendered}
+
+
+async def _coalesced_events(tokens: list[str], rate: float, speedup: float) -> list[dict]:
+    # 按 rate(token/s) 匀速到达；时间按 speedup 等比压缩(到达间隔和合并时间窗一起缩短，帧数不变)
+    interval = 1 / (rate * speedup)
+
+    async def source():
+        t0 = time.perf_counter()
+        for i, t in enumerate(tokens):
+            delay = t0 + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield {"type": "token", "content": t, "source": "writer"}
+
+    return [e async for e in stream.coalesce_tokens(source(), max_delay=stream.TOKEN_FLUSH_SEC / speedup)]
+
+
+def coalesced(tokens: list[str], rate: float, speedup: float) -> dict:
+    events = asyncio.run(_coalesced_events(tokens, rate, speedup))
+    run = Run(RUN_ID, SESSION_ID)
+    start = time.perf_counter()
+    frames = [run._frame(i, stream.make_event("token", RUN_ID, SESSION_ID, **e)) for i, e in enumerate(events, 1)]
+    encode_s = time.perf_counter() - start
+    counter = [0]
+    renderer = IncrementalMarkdown(_Slot(counter))
+    for e in events:
+        renderer.append(e["content"])
+    return {"frames": len(frames), "bytes": sum(len(f.encode()) for f in frames), "encode_s": encode_s, "rendered_chars": counter[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rates", default="30,60,120", help="LLM 吐字速度(token/s)，逗号分隔")
+    parser.add_argument("--speedup", type=float, default=10, help="时间压缩倍数")
+    args = parser.parse_args()
+
+    report = make_report()
+    tokens = tokenize(report)
+    print(f"报告 {len(report)} 字 | {len(tokens)} 个 token | 序列化: {'orjson' if ORJSON_AVAILABLE else 'json'}")
+
+    base = legacy(tokens)
+    rows = [("逐 token (旧)", base)]
+    for rate in (float(r) for r in args.rates.split(",")):
+        rows.append((f"合并 @{rate:.0f} tok/s", coalesced(tokens, rate, args.speedup)))
+
+    print(f"{'模式':<18}{'帧数':>8}{'线上字节':>12}{'序列化 帧/秒':>16}{'序列化耗时ms':>14}{'前端重绘字符':>14}")
+    for name, r in rows:
+        fps = r["frames"] / r["encode_s"] if r["encode_s"] else 0
+        print(f"{name:<18}{r['frames']:>8}{r['bytes']:>12}{fps:>16,.0f}{r['encode_s'] * 1000:>14.2f}{r['rendered_chars']:>14,}")
+
+
+if __name__ == "__main__":
+    main()
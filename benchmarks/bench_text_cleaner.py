@@ -0,0 +1,95 @@
+# 清洗基准:core_node 原来的 行 x 关键词 双重循环 vs tools.text_cleaner
+# 页面来源(真实抓取结果):
+#   默认读取抓取缓存 ./cache/fetch 下的正文(*.txt，MCP服务运行一段时间后就有)
+#   或 --pages 指定一个目录，里面的 *.html 用 trafilatura 抽取正文后使用
+# 运行: python -m benchmarks.bench_text_cleaner [--pages DIR --target-kb 150 --rounds 50]
+import argparse
+import glob
+import os
+import re
+import time
+
+from tools.articles import ARTICLE_SEPARATOR, format_article
+from tools.text_cleaner import _IMAGE_RE, BoilerplateDetector, clean_payload, drop_noise_lines
+
+
+def legacy_clean(raw_content: str) -> str:
+    # 原 core_node 的实现，原样保留用于对比
+    cleaned = re.sub(r"!\[.*?\]\(.*?\)", "", raw_content)
+    noise_keywords = ["版权所有", "©", "备案", "110报警", "营业执照", "免责声明", "出版物许可证"]
+    filtered_lines = []
+    for line in cleaned.split("\n"):
+        keep = True
+        for noise_keyword in noise_keywords:
+            if noise_keyword in line:
+                keep = False
+                break
+        if keep:
+            filtered_lines.append(line)
+    return "\n".join(filtered_lines)
+
+
+def load_pages(pages_dir: str | None) -> list[str]:
+    if pages_dir:
+        import trafilatura
+        from trafilatura.utils import decode_file
+        texts = []
+        for path in sorted(glob.glob(os.path.join(pages_dir, "*.htm*"))):
+            with open(path, "rb") as f:
+                text = trafilatura.extract(decode_file(f.read()))
+            if text:
+                texts.append(text)
+        return texts
+    texts = []
+    for path in sorted(glob.glob("./cache/fetch/**/*.txt", recursive=True)):
+        with open(path, encoding="utf-8") as f:
+            texts.append(f.read())
+    return texts
+
+
+def build_payload(pages: list[str], target_bytes: int) -> str:
+    # 拼成 batch_fetch 的格式；每篇页面以两个URL出现在同一站点下，模拟同站模板
+    articles, size, i = [], 0, 0
+    while size < target_bytes:
+        text = pages[i % len(pages)]
+        url = f"https://site{i % len(pages)}.example.com/p/{i}"
+        articles.append(format_article(url, text))
+        size += len(text.encode("utf-8"))
+        i += 1
+    return ARTICLE_SEPARATOR.join(articles)
+
+
+def bench(name: str, fn, payload: str, rounds: int):
+    fn(payload)
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        out = fn(payload)
+    ms = (time.perf_counter() - t0) * 1000 / rounds
+    mb = len(payload.encode("utf-8")) / 1024 / 1024
+    print(f"{name:<22} {ms:8.2f} ms/payload | {mb / ms * 1000:7.1f} MB/s | output {len(out):>8} chars")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", help="目录，包含抓取下来的 *.html")
+    parser.add_argument("--target-kb", type=int, default=150)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages)
+    if not pages:
+        raise SystemExit("没有可用页面:先运行MCP服务积累 ./cache/fetch，或用 --pages 指定html目录")
+    payload = build_payload(pages, args.target_kb * 1024)
+    print(f"pages={len(pages)} payload={len(payload.encode('utf-8')) / 1024:.0f} KB "
+          f"articles={payload.count(ARTICLE_SEPARATOR) + 1} lines={payload.count(chr(10))}")
+
+    bench("legacy (loop)", legacy_clean, payload, args.rounds)
+    # 与原实现功能完全相同的部分(图片 + 噪音行)
+    bench("noise only (regex)", lambda p: drop_noise_lines(_IMAGE_RE.sub("", p)), payload, args.rounds)
+    bench("clean_payload", lambda p: clean_payload(p, "batch"), payload, args.rounds)
+    # 模板识别带跨请求记忆，每轮新建一个，测的是首次见到这些站点的开销
+    bench("clean_payload+boiler", lambda p: clean_payload(p, "batch", BoilerplateDetector()), payload, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# 向量后端基准:Chroma vs 内存(NumPy暴力) vs 内存(HNSW)，比较 入库/检索/删除 延迟
+# 用随机向量模拟一个会话的片段(bge-m3 为 1024 维)，不依赖Embedding API
+# 运行: python -m benchmarks.bench_vector_backend [--chunks 2000 --queries 8 --rounds 20]
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from tools.vector_backends import HNSW_AVAILABLE, ChromaBackend, MemoryBackend
+
+DIM = 1024
+DOCS = 40  # 一个会话大约抓取的文章数
+K = 50
+
+
+def make_session(n_chunks: int, rng):
+    chunks = []
+    for i in range(n_chunks):
+        doc_id = f"doc{i % DOCS}"
+        chunk = Document(page_content=f"chunk {i}", metadata={"source": f"https://example.com/{doc_id}", "doc_id": doc_id})
+        chunk.id = f"{doc_id}:{i}"
+        chunks.append(chunk)
+    vectors = rng.standard_normal((n_chunks, DIM), dtype=np.float32)
+    return chunks, vectors.tolist()
+
+
+def run(name: str, backend, chunks, vectors, queries, rounds: int):
+    doc_ids = sorted({c.metadata["doc_id"] for c in chunks})
+
+    t0 = time.perf_counter()
+    for i in range(0, len(chunks), 50):  # 与 RAGStore 的入库批次一致
+        backend.add(chunks[i: i + 50], vectors[i: i + 50])
+    insert_ms = (time.perf_counter() - t0) * 1000
+
+    # 第一次检索包含范围索引的构建(内存后端)，单独统计
+    t0 = time.perf_counter()
+    backend.search(queries, K, doc_ids)
+    first_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        backend.search(queries, K, doc_ids)
+    query_ms = (time.perf_counter() - t0) * 1000 / rounds
+
+    t0 = time.perf_counter()
+    backend.delete_docs(doc_ids)
+    delete_ms = (time.perf_counter() - t0) * 1000
+
+    print(f"{name:<14} insert {insert_ms:9.1f} ms | first query {first_ms:8.2f} ms | "
+          f"query {query_ms:8.2f} ms | delete {delete_ms:8.1f} ms")
+
+
+def recall(chunks, vectors, queries, threshold: int) -> float:
+    # HNSW 相对暴力检索的 Top-K 召回率
+    exact, approx = MemoryBackend(hnsw_threshold=10 ** 9), MemoryBackend(hnsw_threshold=threshold)
+    doc_ids = sorted({c.metadata["doc_id"] for c in chunks})
+    for backend in (exact, approx):
+        backend.add(chunks, vectors)
+    truth = exact.search(queries, K, doc_ids)
+    found = approx.search(queries, K, doc_ids)
+    hit = sum(len({r[0] for r in t} & {r[0] for r in f}) for t, f in zip(truth, found))
+    return hit / sum(len(t) for t in truth)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    chunks, vectors = make_session(args.chunks, rng)
+    queries = rng.standard_normal((args.queries, DIM), dtype=np.float32).tolist()
+    print(f"chunks={args.chunks} dim={DIM} queries/search={args.queries} k={K}")
+
+    run("memory-flat", MemoryBackend(hnsw_threshold=10 ** 9), chunks, vectors, queries, args.rounds)
+    if HNSW_AVAILABLE:
+        run("memory-hnsw", MemoryBackend(hnsw_threshold=0), chunks, vectors, queries, args.rounds)
+        print(f"hnsw recall@{K}: {recall(chunks, vectors, queries, 0):.3f}")
+
+    tmp = tempfile.mkdtemp(prefix="bench_chroma_")
+    try:
+        run("chroma", ChromaBackend(persist_directory=tmp, embedding=None), chunks, vectors, queries, args.rounds)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Redis 准入后端自检:用 fakeredis(lupa 执行 Lua 脚本)跑 RedisRateLimiter / RedisTokenPool 的真实脚本，不需要 Redis 服务
+# - 滑动窗口:窗口内超限拒绝并给出重试时间，两个窗口后恢复
+# - 令牌租约:容量用满后拒绝，租约到期(以 Redis 服务器时钟为准)自动回收，in_use 同步变化
+# - 降级:Redis 不可用时限流放行、令牌退回进程内令牌池，归还时两边都释放
+# 运行: pip install fakeredis lupa && python -m benchmarks.check_admission_redis [--window 2]
+import argparse
+import asyncio
+import time
+
+import fakeredis
+
+import api.admission as admission
+from api.admission import AdmissionController, MemoryTokenPool, RedisRateLimiter, RedisTokenPool
+
+
+async def _window_start(window: float):
+    # 从窗口开头开始，避免跨窗口时上一窗口的折算量干扰计数
+    await asyncio.sleep(window - time.time() % window + 0.05)
+
+
+async def check_window(redis, window: float):
+    limit = 3
+    limiter = RedisRateLimiter(redis, limit, window)
+    await _window_start(window)
+    results = [await limiter.hit("session-a") for _ in range(limit + 1)]
+    assert all(allowed for allowed, _ in results[:limit]), results
+    allowed, retry_after = results[-1]
+    assert not allowed and 0 < retry_after <= 2 * window, results[-1]
+    # 其他会话不受影响
+    assert (await limiter.hit("session-b"))[0]
+    await asyncio.sleep(2 * window)
+    assert (await limiter.hit("session-a"))[0], "两个窗口后应恢复"
+    print(f"✅ 滑动窗口: {limit} 次放行，第 {limit + 1} 次拒绝(建议 {retry_after:.2f}s 后重试)，两个窗口后恢复")
+
+
+async def check_lease(redis, lease_sec: float):
+    admission.TOKEN_LEASE_SEC = lease_sec
+    pool = RedisTokenPool(redis, capacity=2)
+    assert await pool.try_acquire("run-1") and await pool.try_acquire("run-2")
+    assert not await pool.try_acquire("run-3"), "容量已满应拒绝"
+    assert await pool.try_acquire("run-1"), "已持有者重复获取应成功"
+    assert await pool.in_use() == 2
+    await asyncio.sleep(lease_sec / 2)
+    await pool.renew("run-1")
+    await asyncio.sleep(lease_sec / 2 + 0.1)
+    # run-2 没续约已过期，run-1 续约后仍有效
+    assert await pool.in_use() == 1, await pool.in_use()
+    assert await pool.try_acquire("run-3"), "过期租约应被回收"
+    await pool.release("run-1")
+    await pool.release("run-3")
+    assert await pool.in_use() == 0
+    print(f"✅ 令牌租约: 容量 2 用满后拒绝，未续约的令牌 {lease_sec}s 后回收，续约的保留")
+
+
+async def check_fallback():
+    server = fakeredis.FakeServer()
+    server.connected = False # 模拟 Redis 宕机:所有命令抛 ConnectionError
+    redis = fakeredis.FakeAsyncRedis(server=server)
+    controller = AdmissionController(
+        RedisRateLimiter(redis, 1, 60),
+        RedisTokenPool(redis, capacity=1),
+        fallback_pool=MemoryTokenPool(1),
+    )
+    assert await controller.check_rate("session-a") == (True, 0.0), "限流后端不可用时应放行"
+    async with controller.slot("run-1"):
+        assert await controller.fallback_pool.in_use() == 1
+    assert await controller.fallback_pool.in_use() == 0, "退出时应归还进程内令牌"
+    assert controller.stats_counter["backend_errors"] >= 3
+    print(f"✅ 降级: Redis 不可用时限流放行、令牌退回进程内令牌池 (backend_errors={controller.stats_counter['backend_errors']})")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--window", type=float, default=2, help="限流窗口(秒)")
+    parser.add_argument("--lease", type=float, default=1, help="令牌租约(秒)")
+    args = parser.parse_args()
+
+    redis = fakeredis.FakeAsyncRedis()
+    await check_window(redis, args.window)
+    await check_lease(redis, args.lease)
+    await check_fallback()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,40 +1,51 @@
 # 生命周期管理
-from contextlib import asynccontextmanager
+import asyncio
+import importlib
+from contextlib import asynccontextmanager, AsyncExitStack
 from fastapi import FastAPI
-from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from loguru import logger
-from graph import build_graph
+from api.runs import run_store
+from tools.registry import global_mcp_pool, global_rag_store, global_reranker
+from tools.startup import AsyncComponent
 
 
 @asynccontextmanager
 async def lifespan(app:FastAPI):
     """
     服务器总开关
-    FastAPI启动时执行yield前面的代码(建立连接)
+    FastAPI启动时执行yield前面的代码(只发起后台初始化，不等待)
     FastAPI关闭时执行yield后面的代码(断开连接)
     """
     logger.info("🚀 Server 正在启动...")
+    exit_stack = AsyncExitStack()
 
-    # 建立SQLite数据库连接
-    conn = AsyncSqliteSaver.from_conn_string("db/checkpointer.sqlite")
+    async def build():
+        # langgraph/langchain 的导入本身就要1~2秒，放到线程里做，事件循环保持可响应(健康检查立即返回)
+        sqlite_aio = await asyncio.to_thread(importlib.import_module, "langgraph.checkpoint.sqlite.aio")
+        graph_module = await asyncio.to_thread(importlib.import_module, "graph")
 
-    # 激活连接上下文
-    async with conn as checkpointer: # 针对conn这个对象，进行异步上下文管理，并在正式进入上下文管理后，将其称作为checkpointer
-        """
-        只做启动/关闭时的资源初始化
-        
-        """
+        # 建立SQLite数据库连接，连接上下文由 exit_stack 保持到服务关闭
+        checkpointer = await exit_stack.enter_async_context(
+            sqlite_aio.AsyncSqliteSaver.from_conn_string("db/checkpointer.sqlite")
+        )
         logger.info("💾 SQLite 数据库已连接")
 
-        # 编译Graph:连接数据库，让数据库在运行时自动把状态保存到sqlite文件中
-        compiled_graph = await build_graph(checkpointer=checkpointer)
-
-        # 存入app的state变量内，之后再用
-        app.state.graph = compiled_graph
+        # 编译Graph(其中会连接MCP加载工具):连接数据库，让数据库在运行时自动把状态保存到sqlite文件中
+        compiled_graph = await graph_module.build_graph(checkpointer=checkpointer)
         logger.info("✅ Graph 已编译 (带持久化记忆)")
-
-        # 服务器运行，直至被关闭
-        yield
-
-        # async with已自动清理
-        logger.info("👋 Server 已关闭，数据库连接已断开") # 注:async with代表自动上下文管理的语法/@asynccontextmanager代表实现自动上下文管理的具体工具
\ No newline at end of file
+        return compiled_graph
+
+    # 三路并行:Reranker模型 / 向量库+Embedding(线程) / 图编译+MCP连接(事件循环)
+    global_reranker.start()
+    global_rag_store.start()
+    # 存入app的state变量内，之后再用(/chat 里 await 就绪)
+    app.state.graph = AsyncComponent("graph", build).start()
+
+    # 服务器运行，直至被关闭
+    yield
+
+    app.state.graph.cancel()
+    await run_store.close()
+    await global_mcp_pool.close()
+    await exit_stack.aclose()
+    logger.info("👋 Server 已关闭，数据库连接已断开")
@@ -28,4 +28,28 @@ EMBEDDING_BASE_URL = "https://api.siliconflow.cn/v1"
 
 # --- 模型选择 ---
 # 云端和本地都用 BGE-M3，保持效果一致
-EMBEDDING_MODEL_NAME = "BAAI/bge-m3"
\ No newline at end of file
+EMBEDDING_MODEL_NAME = "BAAI/bge-m3"
+
+# --- 本地模式推理引擎 (USE_LOCAL_EMBEDDING = True 时生效) ---
+# "onnx" = int8量化的 ONNX 模型 + ONNX Runtime，进程内共享一份并跨请求合批 (内存约1G以内，4G 服务器可用)
+# "torch" = HuggingFaceEmbeddings (PyTorch fp32，内存占用数G)
+LOCAL_EMBEDDING_ENGINE = "onnx"
+LOCAL_EMBEDDING_ONNX_REPO = "Xenova/bge-m3" # BGE-M3 的 ONNX 导出(含预量化版本)
+LOCAL_EMBEDDING_ONNX_FILE = "onnx/model_quantized.onnx"
+
+# --- 向量后端 ---
+# "chroma" = 持久化到 ./chroma_db (默认，重启后共享文档库仍可复用)
+# "chroma_session" = 每个会话一个独立集合，检索不带过滤，会话结束整个集合删除
+# "memory" = 进程内 NumPy 暴力检索，单会话片段数超过阈值时切换 HNSW (需 pip install hnswlib)
+VECTOR_BACKEND = "chroma"
+MEMORY_INDEX_HNSW_THRESHOLD = 50_000
+
+# --- 限流与准入控制 ---
+# "memory" = 进程内计数(单 worker)
+# "redis" = 多个 uvicorn worker / 多副本共享限流计数与并发令牌 (REDIS_URL)
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_MAX_REQUESTS = 6 # 每个会话在一个窗口内最多发起的研究次数
+RATE_LIMIT_WINDOW_SEC = 3600 # 限流窗口(滑动)
+MAX_CONCURRENT_RUNS = 5 # 全局(所有 worker 合计)同时执行的图数量
+QUEUE_MAX_WAIT_SEC = 180 # 排队预计等待超过该值时直接返回503，不再入队
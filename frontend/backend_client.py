@@ -1,17 +1,51 @@
 # 处理SSE协议的工具函数
 import json
 import os
+import time
 import requests
 
 BACKEND_URL = os.getenv("BACKEND_URL") or "http://localhost"
 
 
+RESUME_ATTEMPTS = 3 # 流中途断开时，按 Last-Event-ID 续传的最多次数
+
+
+def _iter_sse(response,cursor):
+    """
+    逐行解析SSE，cursor["last_id"] 记录最后收到的事件编号(续传用)
+    """
+    for line in response.iter_lines(): # iter_lines:切片模式，(发现换行)立刻切走
+        if not line:
+            continue
+        decoded_line = line.decode("utf-8")
+        if decoded_line.startswith("id:"):
+            cursor["last_id"] = decoded_line[3:].strip()
+            continue
+        if decoded_line.startswith("data:"):
+            json_str = decoded_line[5:].strip()
+            if not json_str:
+                continue
+            if "[DONE]" in json_str:
+                cursor["done"] = True
+                break # 结束
+            try:
+                data = json.loads(json_str)
+            except Exception:
+                continue
+            if data.get("type") == "done":
+                cursor["done"] = True
+            yield data
+
+
 def stream_from_backend(user_input,session_id):
     """
     连接docker后端，并把复杂的数据流按SSE协议解析成简单的Py对象
+    研究在后端后台执行，连接中途断开时按 run_id + Last-Event-ID 重新接上，不会丢失进度
     """
     # docker后端地址
     api_url = f"{BACKEND_URL}:8011/chat"
+    cursor = {"last_id": None, "done": False}
+    run_id = None
     try:
         with requests.post(
             api_url,
@@ -24,32 +58,55 @@ def stream_from_backend(user_input,session_id):
                 yield {"type": "error", "content": "⚠️ 每小时最多使用6次，请稍后再试"}
                 return
 
+            # 排队已满(预计等待超出后端预算)
+            if response.status_code == 503:
+                try:
+                    detail = response.json().get("detail","")
+                except Exception:
+                    detail = ""
+                yield {"type": "error", "content": f"⚠️ {detail or '服务繁忙，请稍后再试'}"}
+                return
+
             if response.status_code != 200:
                 yield {"type": "error", "content": f"服务器报错: {response.status_code}"}
                 return
 
-            # 逐行监听
-            for line in response.iter_lines(): # iter_lines:切片模式，(发现换行)立刻切走
-                if line:
-                    decoded_line = line.decode("utf-8")
-                    if decoded_line.startswith("data:"):
-                        json_str = decoded_line[5:].strip()
-                        if not json_str:
-                            continue
-                        if "[DONE]" in json_str:
-                            break # 结束
-                        try:
-                            yield json.loads(json_str)
-                        except Exception:
-                            pass
+            run_id = response.headers.get("X-Run-Id")
+            yield from _iter_sse(response,cursor)
+            if cursor["done"]:
+                return
     except Exception as e:
-        yield {"type":"error","content":f"连接失败:{str(e)}"}
+        if not run_id:
+            yield {"type":"error","content":f"连接失败:{str(e)}"}
+            return
+
+    # 流中途断开:续传
+    for attempt in range(RESUME_ATTEMPTS):
+        time.sleep(attempt)
+        headers = {"Last-Event-ID": cursor["last_id"]} if cursor["last_id"] else {}
+        try:
+            with requests.get(
+                f"{BACKEND_URL}:8011/runs/{run_id}/events",
+                headers=headers,
+                stream=True,
+                timeout=(3,300)
+            ) as response:
+                if response.status_code != 200:
+                    break
+                yield from _iter_sse(response,cursor)
+                if cursor["done"]:
+                    return
+        except Exception:
+            continue
+    yield {"type":"error","content":"连接中断，请稍后重试"}
 
 def check_services_status():
     """检查服务是否在线"""
     status = {
         "backend_online": False,
         "mcp_online": False,
+        "ready": False,
+        "failed": [],
     }
     try:
         r = requests.get(f"{BACKEND_URL}:8011/service/status",timeout=1.5)
@@ -57,6 +114,8 @@ def check_services_status():
             data = r.json()
             status["backend_online"] = True
             status["mcp_online"] = data.get("mcp_online",False)
+            status["ready"] = data.get("ready",True) # 后端组件是否已全部初始化完成
+            status["failed"] = [name for name,c in data.get("components",{}).items() if c.get("state") == "failed"]
         else:
             status["backend_online"] = False
     except Exception:
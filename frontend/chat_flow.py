@@ -4,16 +4,65 @@ import streamlit as st
 from backend_client import stream_from_backend
 
 
+SOURCES_MARKER = "数据来源"
+
+
+def _split_source_refs(text):
+    return re.sub(r"(?<!^)\[(\d+)\]",r"\n[\1]",text)
+
+
 # 优化数据来源展示
 def format_sources_simple(text):
     if not text:
         return ""
-    marker = "数据来源"
-    if marker not in text:
+    if SOURCES_MARKER not in text:
         return text
-    head,tail = text.split(marker,1)
-    tail = re.sub(r"(?<!^)\[(\d+)\]",r"\n[\1]",tail)
-    return head + marker + tail
+    head,tail = text.split(SOURCES_MARKER,1)
+    return head + SOURCES_MARKER + _split_source_refs(tail)
+
+
+class IncrementalMarkdown:
+    """
+    流式正文的增量渲染:已经写完的段落(空行分隔、且不在代码块里)各自渲染一次后不再改动，只有最后一段随 token 刷新
+    原来每个 token 都对全文做 format_sources_simple 并整体重绘，长报告是 O(n²)
+    """
+
+    def __init__(self, slot):
+        self.slot = slot # st.empty()，reset 时整体清空
+        self.container = None
+        self.tail_slot = None
+        self.tail = "" # 尚未完结的最后一段
+        self.in_sources = False # 已经进入"数据来源"部分
+        self.in_code = False # 已完结段落累计下来是否停在代码块内
+
+    def _format(self, block):
+        if self.in_sources:
+            return _split_source_refs(block)
+        return format_sources_simple(block)
+
+    def _next_block_end(self):
+        start = 0
+        while True:
+            idx = self.tail.find("\n\n", start)
+            if idx < 0:
+                return -1
+            # 代码块内的空行不能切
+            if (self.in_code + self.tail.count("```", 0, idx)) % 2 == 0:
+                return idx
+            start = idx + 2
+
+    def append(self, text):
+        if self.container is None:
+            self.container = self.slot.container()
+            self.tail_slot = self.container.empty()
+        self.tail += text
+        while (end := self._next_block_end()) >= 0:
+            block, self.tail = self.tail[:end], self.tail[end + 2:]
+            self.tail_slot.markdown(self._format(block))
+            self.in_code = (self.in_code + block.count("```")) % 2 == 1
+            self.in_sources = self.in_sources or SOURCES_MARKER in block
+            self.tail_slot = self.container.empty()
+        self.tail_slot.markdown(self._format(self.tail))
 
 
 def handle_chat_turn(prompt):
@@ -29,8 +78,8 @@ def handle_chat_turn(prompt):
         with status_placeholder.container():
             status_container = st.status("🤔 Agent正在思考...",expanded=True)
         response_placeholder = st.empty()
+        renderer = IncrementalMarkdown(response_placeholder)
         full_response = ""
-        final_response = ""
         tool_logs = []
 
         # 仅由工具事件判断“研究模式”
@@ -54,26 +103,35 @@ def handle_chat_turn(prompt):
                 if msg:
                     status_container.info(msg)
                 continue
+            elif event_type == "reset": # 续传时后端从头重放，清空已显示的内容
+                full_response = ""
+                tool_logs = []
+                response_placeholder.empty()
+                renderer = IncrementalMarkdown(response_placeholder)
+                continue
+            elif event_type == "queued": # 并发已满，排队中
+                position = data.get("position",0)
+                ahead = f"前面还有 {position} 个任务" if position else "下一个就轮到你"
+                status_container.info(f"⏳ 排队中:{ahead}，预计等待约 {data.get('eta_sec',0)} 秒")
+                continue
             elif event_type == "status":
                 # 只在后端真有内容时展示
                 if content:
                     status_container.info(content)
                 continue
-            elif event_type == "token": # 流式输出
+            elif event_type == "token": # 流式输出(后端会把连续 token 合并成一帧)
                 if content:
                     full_response += content
-                    final_response = format_sources_simple(full_response)
-                    response_placeholder.markdown(final_response)
+                    renderer.append(content)
                 continue
             elif event_type == "message": # 整段消息返回
                 # 协议兜底:仅在没有流式时展示整段
-                if content and not final_response:
+                if content and not full_response:
                     full_response += content
-                    final_response = format_sources_simple(full_response)
-                    response_placeholder.markdown(final_response)
+                    renderer.append(content)
                 continue
             elif event_type == "tool_start":
-                if not shown_waiting_text:
+                if not shown_waiting_text and not full_response:
                     response_placeholder.markdown("正在并发搜索资料中，请耐心等待...")
                     shown_waiting_text = True
                 is_research = True
@@ -97,6 +155,7 @@ def handle_chat_turn(prompt):
             status_container.update(label="✅️ 生成完毕", state="complete", expanded=False)
         else:
             status_placeholder.empty()
+        final_response = format_sources_simple(full_response)
         if not final_response or not final_response.strip():
             final_response = "未生成有效内容，请重试。"
 
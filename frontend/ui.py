@@ -40,7 +40,11 @@ def render_sidebar(status):
         # 检测后端联通
         if status["backend_online"]:
             st.success("🟢 后端服务在线")
-            if status["mcp_online"]:
+            if status["failed"]:
+                st.error(f"🔴 组件初始化失败: {', '.join(status['failed'])} (详见后端日志)")
+            elif not status["ready"]:
+                st.info("⏳ 后端组件初始化中 (模型/向量库/MCP)，首个请求会稍等片刻")
+            elif status["mcp_online"]:
                 st.success("🟢 MCP服务在线")
             else:
                 st.warning("⚪ MCP服务未启动 （可能是协议不匹配或暂时无响应）")
@@ -0,0 +1,32 @@
+# batch_fetch 的多篇文章拼接格式:MCP服务端按此拼接，入库端按此拆回单篇
+# 保持轻量(无第三方依赖)，MCP服务进程和后端进程都会导入
+from typing import Iterator
+
+ARTICLE_SEPARATOR = "\n\n=== 文章分隔线 ===\n\n" # 多篇文章之间的分隔线
+ARTICLE_SOURCE_PREFIX = "来源: " # 每篇文章首行标注来源URL
+
+
+def format_article(url: str, body: str) -> str:
+    return f"{ARTICLE_SOURCE_PREFIX}{url}\n\n{body}"
+
+
+def iter_articles(text: str, default_source: str = "") -> Iterator[tuple[str, str]]:
+    """
+    按分隔线逐篇产出 (来源URL, 正文)，不一次性切出整个列表
+    没有"来源: "首行的片段(如 get_page_content 的单篇结果)归到 default_source
+    """
+    start = 0
+    while start <= len(text):
+        end = text.find(ARTICLE_SEPARATOR, start)
+        if end == -1:
+            end = len(text)
+        part = text[start:end]
+        start = end + len(ARTICLE_SEPARATOR)
+
+        source = default_source
+        if part.startswith(ARTICLE_SOURCE_PREFIX):
+            first_line, _, part = part.partition("\n")
+            source = first_line[len(ARTICLE_SOURCE_PREFIX):].strip() or default_source
+        part = part.strip()
+        if part:
+            yield source, part
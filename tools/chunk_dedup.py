@@ -0,0 +1,148 @@
+# 片段去重:在调用Embedding之前丢掉同一会话里完全相同/高度相似的片段
+# 同一会话抓的多篇文章经常有相同的导航栏、版权声明、转载的同一段新闻稿
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.documents import Document
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4 # 64位分4段，海明距离<=3的两个指纹至少有一段完全相同(抽屉原理)
+SHINGLE_SIZE = 4 # 字符4-gram，中英文都不需要分词
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text).strip().casefold()
+
+
+def simhash(text: str) -> int:
+    """
+    64位SimHash(字符 shingle)
+    shingle 用内置 hash()，进程内稳定即可(指纹只保存在内存里)
+    """
+    n = len(text) - SHINGLE_SIZE + 1
+    if n <= 0:
+        shingles = [text]
+    else:
+        shingles = {text[i: i + SHINGLE_SIZE] for i in range(n)}
+    hashes = np.fromiter((hash(s) & 0xFFFFFFFFFFFFFFFF for s in shingles), dtype=np.uint64, count=len(shingles))
+    bits = (hashes[:, None] >> np.arange(SIMHASH_BITS, dtype=np.uint64)) & np.uint64(1)
+    # 每一位上 1 多于 0 则置 1
+    votes = bits.sum(axis=0) * 2 > len(hashes)
+    return int(np.packbits(votes[::-1]).view(">u8")[0])
+
+
+class _SessionIndex:
+    __slots__ = ("exact", "bands")
+
+    def __init__(self):
+        self.exact: set[bytes] = set()
+        self.bands: list[dict[int, list[int]]] = [{} for _ in range(SIMHASH_BANDS)]
+
+
+class ChunkDeduplicator:
+    """
+    按会话去重(会话内先到先留):
+    - 精确重复:规范化空白后的 sha1 相同
+    - 近似重复:SimHash 海明距离 <= max_distance (分段索引，只比较候选)
+    不跨会话去重；被去掉了片段的文档不完整，由调用方挂到会话私有的 doc_id 下，不进入共享文档库
+    """
+
+    def __init__(self, max_distance: int = 3, min_chars: int = 80, max_sessions: int = 256):
+        self.max_distance = max_distance
+        self.min_chars = min_chars # 过短的片段只做精确去重，SimHash在短文本上误判多
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, _SessionIndex] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counter = {"chunks_in": 0, "exact_dups": 0, "near_dups": 0, "bytes_in": 0, "bytes_saved": 0}
+
+    def _index(self, session_id: str) -> _SessionIndex:
+        index = self._sessions.get(session_id)
+        if index is None:
+            index = self._sessions[session_id] = _SessionIndex()
+            # 正常情况下 clear_session 会释放；兜底防止异常中断的会话一直占内存
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        return index
+
+    def _near_duplicate(self, index: _SessionIndex, fp: int) -> bool:
+        band_bits = SIMHASH_BITS // SIMHASH_BANDS
+        mask = (1 << band_bits) - 1
+        for b in range(SIMHASH_BANDS):
+            for other in index.bands[b].get((fp >> (b * band_bits)) & mask, ()):
+                if (fp ^ other).bit_count() <= self.max_distance:
+                    return True
+        return False
+
+    def _remember(self, index: _SessionIndex, fp: int):
+        band_bits = SIMHASH_BITS // SIMHASH_BANDS
+        mask = (1 << band_bits) - 1
+        for b in range(SIMHASH_BANDS):
+            index.bands[b].setdefault((fp >> (b * band_bits)) & mask, []).append(fp)
+
+    def filter(self, chunks: list[Document], session_id: str) -> tuple[list[Document], list[tuple[bytes, int | None]]]:
+        """
+        返回 (去重后保留的片段(保持原顺序), 它们的指纹)
+        只比对不记录:片段写入向量库成功后再 remember(指纹)，入库失败/取消后重试时不会把同一内容当成重复丢掉
+        同一批内部的重复也会被丢掉
+        """
+        kept, marks = [], []
+        batch = _SessionIndex()
+        # 指纹计算不持锁
+        prepared = []
+        for chunk in chunks:
+            text = _normalize(chunk.page_content)
+            digest = hashlib.sha1(text.encode("utf-8")).digest()
+            fp = simhash(text) if len(text) >= self.min_chars else None
+            prepared.append((chunk, digest, fp))
+
+        with self._lock:
+            index = self._index(session_id)
+            for chunk, digest, fp in prepared:
+                size = len(chunk.page_content.encode("utf-8"))
+                self.stats_counter["chunks_in"] += 1
+                self.stats_counter["bytes_in"] += size
+                if digest in index.exact or digest in batch.exact:
+                    self.stats_counter["exact_dups"] += 1
+                    self.stats_counter["bytes_saved"] += size
+                    continue
+                if fp is not None and (self._near_duplicate(index, fp) or self._near_duplicate(batch, fp)):
+                    self.stats_counter["near_dups"] += 1
+                    self.stats_counter["bytes_saved"] += size
+                    continue
+                batch.exact.add(digest)
+                if fp is not None:
+                    self._remember(batch, fp)
+                kept.append(chunk)
+                marks.append((digest, fp))
+        return kept, marks
+
+    def remember(self, marks: list[tuple[bytes, int | None]], session_id: str):
+        """
+        记住已成功入库的片段指纹，供该会话后续文档比对
+        """
+        with self._lock:
+            index = self._index(session_id)
+            for digest, fp in marks:
+                index.exact.add(digest)
+                if fp is not None:
+                    self._remember(index, fp)
+
+    def release(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        dropped = self.stats_counter["exact_dups"] + self.stats_counter["near_dups"]
+        return {
+            **self.stats_counter,
+            # 每个被丢掉的片段就是一次省掉的Embedding输入
+            "embedding_inputs_saved": dropped,
+            "dedup_rate": round(dropped / self.stats_counter["chunks_in"], 3) if self.stats_counter["chunks_in"] else 0.0,
+        }
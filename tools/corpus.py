@@ -0,0 +1,126 @@
+# 跨会话共享文档库的登记簿:文档(URL+内容哈希)只入库一次，会话只持有引用
+# 向量本身仍在Chroma里(metadata.doc_id)，这里只记录 文档 <-> 会话 的引用关系
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+
+def make_doc_id(text: str, source_url: str) -> str:
+    """
+    文档ID = sha256(来源 + 内容哈希):同一URL内容变了会得到新文档，旧版本随引用归零被回收
+    """
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{source_url}\0{content_hash}".encode("utf-8")).hexdigest()[:32]
+
+
+def make_private_doc_id(doc_id: str, session_id: str) -> str:
+    """
+    会话私有文档ID:会话内去重丢掉了部分片段的文档不完整，不能占用共享的 doc_id 给别的会话复用
+    """
+    return hashlib.sha256(f"{doc_id}\0{session_id}".encode("utf-8")).hexdigest()[:32]
+
+
+class DocumentCorpus:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id TEXT PRIMARY KEY,
+                source TEXT,
+                chunk_count INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                shared INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE TABLE IF NOT EXISTS session_docs (
+                session_id TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                PRIMARY KEY (session_id, doc_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_session_docs_doc ON session_docs(doc_id);
+        """)
+        # 旧库补列:之前登记的文档都是完整入库的，可以共享
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(docs)")}
+        if "shared" not in columns:
+            self._conn.execute("ALTER TABLE docs ADD COLUMN shared INTEGER NOT NULL DEFAULT 1")
+        self._conn.commit()
+
+    def register(self, doc_id: str, source: str, chunk_count: int, session_id: str, shared: bool = True):
+        """
+        新文档入库完成后登记，并挂到当前会话下
+        shared=False:会话私有文档(不完整)，其他会话 attach 不到，会话结束后尽快回收
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO docs(doc_id, source, chunk_count, created_at, last_used, shared) VALUES(?,?,?,?,?,?)",
+                (doc_id, source, chunk_count, now, now, int(shared))
+            )
+            self._conn.execute("INSERT OR IGNORE INTO session_docs(session_id, doc_id) VALUES(?,?)", (session_id, doc_id))
+            self._conn.commit()
+
+    def attach(self, doc_id: str, session_id: str) -> bool:
+        """
+        文档已在库中则直接引用(引用计数+1)，返回True；不存在(或是会话私有文档)返回False
+        """
+        with self._lock:
+            updated = self._conn.execute("UPDATE docs SET last_used=? WHERE doc_id=? AND shared=1", (time.time(), doc_id)).rowcount
+            if not updated:
+                return False
+            self._conn.execute("INSERT OR IGNORE INTO session_docs(session_id, doc_id) VALUES(?,?)", (session_id, doc_id))
+            self._conn.commit()
+            return True
+
+    def session_doc_ids(self, session_id: str) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT doc_id FROM session_docs WHERE session_id=?", (session_id,)).fetchall()
+        return [r[0] for r in rows]
+
+    def refcount(self, doc_id: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM session_docs WHERE doc_id=?", (doc_id,)).fetchone()[0]
+
+    def release_session(self, session_id: str) -> int:
+        """
+        会话结束:释放该会话的所有引用(共享文档保留，供后续会话复用；私有文档标记为立即可回收)，返回释放数量
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE docs SET last_used=CASE WHEN shared THEN ? ELSE 0 END "
+                "WHERE doc_id IN (SELECT doc_id FROM session_docs WHERE session_id=?)",
+                (now, session_id)
+            )
+            released = self._conn.execute("DELETE FROM session_docs WHERE session_id=?", (session_id,)).rowcount
+            self._conn.commit()
+        return released
+
+    def collect_garbage(self, max_idle_sec: float, delete_vectors: Callable[[list[str]], None]) -> list[str]:
+        """
+        回收:无会话引用且闲置超过 max_idle_sec 的文档，返回被删除的doc_id
+        向量在持锁期间删除:doc_id/片段id是确定性的，锁释放后同一文档重新入库写入的新向量不会被误删
+        删向量失败时登记不删，下次再回收
+        """
+        cutoff = time.time() - max_idle_sec
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id FROM docs WHERE last_used < ? AND doc_id NOT IN (SELECT doc_id FROM session_docs)",
+                (cutoff,)
+            ).fetchall()
+            doc_ids = [r[0] for r in rows]
+            if not doc_ids:
+                return []
+            delete_vectors(doc_ids)
+            self._conn.executemany("DELETE FROM docs WHERE doc_id=?", [(d,) for d in doc_ids])
+            self._conn.commit()
+        return doc_ids
+
+    def stats(self) -> dict:
+        with self._lock:
+            docs, chunks = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(chunk_count), 0) FROM docs").fetchone()
+            sessions = self._conn.execute("SELECT COUNT(DISTINCT session_id) FROM session_docs").fetchone()[0]
+        return {"docs": docs, "chunks": chunks, "active_sessions": sessions}
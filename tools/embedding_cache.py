@@ -0,0 +1,146 @@
+# Embedding缓存:片段内容哈希 -> 向量(float32)，落盘在SQLite
+# 同一篇文章被两个子图抓到、模板化的段落、热门话题的重复会话，都不必再调一次Embedding API
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    包装任意 LangChain Embeddings:先查缓存，只把未命中的文本交给底层模型
+    key = sha256(模型名 + 文本)，换模型不会串用旧向量
+    """
+
+    def __init__(self, base: Embeddings, namespace: str, path: str = "./cache/embeddings.sqlite", max_entries: int = 200_000):
+        self.base = base
+        self.namespace = namespace
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS vectors (
+                key TEXT PRIMARY KEY,
+                vec BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_access ON vectors(last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+        self.stats_counter = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            # SQLite单条语句的变量数有上限，分段查询
+            for i in range(0, len(keys), 500):
+                part = keys[i: i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM vectors WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                self._conn.executemany("UPDATE vectors SET last_access=? WHERE key=?", [(now, k) for k in found])
+                self._conn.commit()
+        return found
+
+    def _store(self, items: dict[str, list[float]]):
+        now = time.time()
+        with self._lock:
+            rows = [(k, array("f", v).tobytes(), now) for k, v in items.items()]
+            # 先 INSERT OR IGNORE:rowcount 就是新增的条目数，条目计数直接累加，不再每次全表 COUNT
+            inserted = self._conn.executemany("INSERT OR IGNORE INTO vectors(key, vec, last_access) VALUES(?,?,?)", rows).rowcount
+            if inserted < len(rows):
+                # 少数已存在的key(并发未命中时别的请求刚写入)覆盖为最新向量
+                self._conn.executemany("UPDATE vectors SET vec=?, last_access=? WHERE key=?", [(b, t, k) for k, b, t in rows])
+            self._count += inserted
+            if self._count > self.max_entries:
+                # 按最近访问时间淘汰，一次多删10%，避免每次写入都触发
+                overflow = self._count - int(self.max_entries * 0.9)
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM vectors WHERE key IN (SELECT key FROM vectors ORDER BY last_access ASC LIMIT ?)",
+                        (overflow,)
+                    )
+                    self._count -= overflow
+                    self.stats_counter["evictions"] += overflow
+                    logger.info(f"🧹 [EmbedCache] LRU淘汰 {overflow} 条向量")
+            self._conn.commit()
+
+    def _split(self, texts: list[str]):
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(list(set(keys)))
+        # 同一批内重复的文本只算一次
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+        hits = len(keys) - sum(1 for k in keys if k not in found)
+        self.stats_counter["hits"] += hits
+        self.stats_counter["misses"] += len(missing)
+        return keys, found, missing
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, missing = self._split(texts)
+        if missing:
+            key_to_text = dict(zip(keys, texts))
+            vectors = self.base.embed_documents([key_to_text[k] for k in missing])
+            new = dict(zip(missing, vectors))
+            self._store(new)
+            found.update(new)
+        return [found[k] for k in keys]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        # 缓存读写是同步SQLite(带锁)，放到线程里，不阻塞事件循环
+        keys, found, missing = await asyncio.to_thread(self._split, texts)
+        if missing:
+            key_to_text = dict(zip(keys, texts))
+            vectors = await self.base.aembed_documents([key_to_text[k] for k in missing])
+            new = dict(zip(missing, vectors))
+            await asyncio.to_thread(self._store, new)
+            found.update(new)
+        return [found[k] for k in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        # 查询向量也缓存:writer 经常重复问研究员问过的问题
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            self.stats_counter["hits"] += 1
+            return found[key]
+        self.stats_counter["misses"] += 1
+        vector = self.base.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = self._key(text)
+        found = await asyncio.to_thread(self._lookup, [key])
+        if key in found:
+            self.stats_counter["hits"] += 1
+            return found[key]
+        self.stats_counter["misses"] += 1
+        vector = await self.base.aembed_query(text)
+        await asyncio.to_thread(self._store, {key: vector})
+        return vector
+
+    def stats(self) -> dict:
+        lookups = self.stats_counter["hits"] + self.stats_counter["misses"]
+        return {
+            **self.stats_counter,
+            "hit_rate": round(self.stats_counter["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": self._count,
+        }
@@ -0,0 +1,209 @@
+# Embedding请求调度:按token数切批 + 多批并发 + RPS/TPM预算 + 限流(429)自适应退避
+# 位于 CachedEmbeddings 与云端模型之间:缓存未命中的文本才会走到这里
+import asyncio
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估token数(不加载分词器):中日韩字符约1字1token，其余约4字符1token
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+class _TokenBucket:
+    """
+    令牌桶(预约式):先扣后等，返回需要等待的秒数，多线程按调用顺序排队
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+def _is_rate_limited(e: Exception) -> bool:
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status == 429 or type(e).__name__ == "RateLimitError"
+
+
+_TRANSIENT_ERRORS = {
+    "APITimeoutError", "APIConnectionError", "InternalServerError", # openai
+    "TimeoutException", "ConnectTimeout", "ReadTimeout", "ConnectError", "ReadError", "RemoteProtocolError", # httpx
+}
+
+
+def _is_transient(e: Exception) -> bool:
+    """
+    超时/连接中断/5xx:SDK 自带重试已关闭(max_retries=0，429 交给调度器)，这几类偶发错误也要由调度器重试
+    按类名判断，不依赖具体 SDK(openai / httpx / 内置异常)
+    """
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    return type(e).__name__ in _TRANSIENT_ERRORS
+
+
+def _retry_after(e: Exception) -> float | None:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingDispatcher(Embeddings):
+    """
+    - rps / tpm: 请求数/token数预算(按服务商限额配置)，超出时在本地排队，而不是打出去吃429
+    - max_batch_tokens / max_batch_items: 单次请求的token上限与条数上限(按token切批，长片段不会撑爆单个请求)
+    - max_concurrency: 同时在途的请求数上限；遇到429减半(AIMD)，连续成功后逐个加回
+    - max_retries / max_transient_retries: 429 与 超时/连接错误/5xx 各自的重试次数(指数退避 + 抖动)
+    一篇几十个片段的长文会被切成多个小批并发发出，总耗时约等于一次往返
+    """
+
+    def __init__(self, base: Embeddings, rps: float = 30, tpm: int = 500_000, max_concurrency: int = 8,
+                 max_batch_tokens: int = 8000, max_batch_items: int = 64, max_retries: int = 6,
+                 max_transient_retries: int = 3):
+        self.base = base
+        self.max_concurrency = max_concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_retries = max_retries
+        self.max_transient_retries = max_transient_retries
+        self._requests = _TokenBucket(rps, capacity=max(1.0, rps))
+        # 按10秒的量放开突发，避免一分钟的额度在一瞬间打光
+        self._tokens = _TokenBucket(tpm / 60, capacity=tpm / 6)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+
+        self._cond = threading.Condition()
+        self._limit = max_concurrency
+        self._inflight = 0
+        self._success_streak = 0
+        self.stats_counter = {"requests": 0, "texts": 0, "est_tokens": 0, "throttled": 0, "transient_errors": 0, "retries": 0}
+
+    def make_batches(self, texts: list[str]) -> list[tuple[list[int], int]]:
+        """
+        按输入顺序装箱:每批不超过 max_batch_tokens / max_batch_items，返回 [(下标列表, token估计)]
+        """
+        batches, idxs, tokens = [], [], 0
+        for i, text in enumerate(texts):
+            n = estimate_tokens(text)
+            if idxs and (tokens + n > self.max_batch_tokens or len(idxs) >= self.max_batch_items):
+                batches.append((idxs, tokens))
+                idxs, tokens = [], 0
+            idxs.append(i)
+            tokens += n
+        if idxs:
+            batches.append((idxs, tokens))
+        return batches
+
+    def _acquire_slot(self):
+        with self._cond:
+            while self._inflight >= self._limit:
+                self._cond.wait()
+            self._inflight += 1
+
+    def _release_slot(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _on_success(self):
+        with self._cond:
+            self._success_streak += 1
+            if self._limit < self.max_concurrency and self._success_streak >= self._limit:
+                self._limit += 1
+                self._success_streak = 0
+                self._cond.notify_all()
+
+    def _on_throttled(self):
+        with self._cond:
+            self._limit = max(1, self._limit // 2)
+            self._success_streak = 0
+        self.stats_counter["throttled"] += 1
+
+    def _embed_batch(self, texts: list[str], tokens: int) -> list[list[float]]:
+        throttled = transient = 0
+        while True:
+            # 先等预算再占并发名额:等待RPS/TPM额度期间不挡住其他批次
+            time.sleep(max(self._requests.reserve(1), self._tokens.reserve(tokens)))
+            self._acquire_slot()
+            try:
+                vectors = self.base.embed_documents(texts)
+            except Exception as e:
+                if _is_rate_limited(e) and throttled < self.max_retries:
+                    self._on_throttled()
+                    delay = _retry_after(e) or min(30.0, 0.5 * 2 ** throttled) * (0.5 + random.random())
+                    throttled += 1
+                    logger.warning(f"🐢 [Embed] 触发限流，并发降至 {self._limit}，{delay:.1f}s 后重试 ({throttled}/{self.max_retries})")
+                elif not _is_rate_limited(e) and _is_transient(e) and transient < self.max_transient_retries:
+                    self.stats_counter["transient_errors"] += 1
+                    delay = min(8.0, 0.5 * 2 ** transient) * (0.5 + random.random())
+                    transient += 1
+                    logger.warning(f"🔁 [Embed] 请求失败({type(e).__name__})，{delay:.1f}s 后重试 ({transient}/{self.max_transient_retries})")
+                else:
+                    raise
+            else:
+                self._on_success()
+                self.stats_counter["requests"] += 1
+                self.stats_counter["texts"] += len(texts)
+                self.stats_counter["est_tokens"] += tokens
+                return vectors
+            finally:
+                self._release_slot()
+            # 退避期间不占并发名额
+            self.stats_counter["retries"] += 1
+            time.sleep(delay)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        batches = self.make_batches(texts)
+        if len(batches) == 1:
+            return self._embed_batch(texts, batches[0][1])
+        futures = [self._pool.submit(self._embed_batch, [texts[i] for i in idxs], tokens) for idxs, tokens in batches]
+        vectors = [None] * len(texts)
+        for (idxs, _), future in zip(batches, futures):
+            for i, vector in zip(idxs, future.result()):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed_batch([text], estimate_tokens(text))[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await asyncio.to_thread(self.embed_query, text)
+
+    def stats(self) -> dict:
+        requests = self.stats_counter["requests"]
+        return {
+            **self.stats_counter,
+            "concurrency_limit": self._limit,
+            "inflight": self._inflight,
+            "avg_texts_per_request": round(self.stats_counter["texts"] / requests, 1) if requests else 0.0,
+        }
@@ -0,0 +1,168 @@
+# 正文抽取进程池:trafilatura.extract 是CPU密集的lxml解析，放到独立进程里跑，不再和I/O线程抢GIL
+# 注意:子进程以spawn方式启动，本模块只应依赖轻量的包，避免worker冷启动过慢
+import asyncio
+import multiprocessing
+import os
+import signal
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import trafilatura
+from loguru import logger
+from trafilatura.utils import decode_file
+
+
+class ExtractionTimeout(Exception):
+    """单篇文档抽取超过CPU时间上限"""
+
+
+class _Collateral(Exception):
+    """所在进程池因另一篇文档墙钟超时被杀掉"""
+
+
+def _on_cpu_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+
+def _init_worker(pids):
+    # SIGVTALRM 只统计本进程的CPU时间:I/O等待不计入，真正卡在解析上的超大页面才会被打断
+    if hasattr(signal, "SIGVTALRM"):
+        signal.signal(signal.SIGVTALRM, _on_cpu_timeout)
+    # 上报pid:墙钟超时时父进程据此杀掉卡死的worker(ProcessPoolExecutor 没有公开的终止接口)
+    pids.put(os.getpid())
+
+
+def extract_document(body: bytes, cpu_timeout_sec: float):
+    """
+    (子进程内执行) 编码探测 + 正文抽取，返回 (html, 正文)
+    """
+    use_timer = hasattr(signal, "ITIMER_VIRTUAL")
+    if use_timer:
+        signal.setitimer(signal.ITIMER_VIRTUAL, cpu_timeout_sec)
+    try:
+        # 与 trafilatura.fetch_url 一致的编码探测，避免无charset的中文页面乱码
+        downloaded = decode_file(body)
+        return downloaded, trafilatura.extract(downloaded)
+    finally:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+
+
+class ExtractionPool:
+    """
+    - max_workers: 抽取进程数
+    - max_pending: 同时提交到进程池的文档数上限(队列深度)，超出的在协程里排队
+    - docs_per_worker: 平均每个worker处理N篇后整池回收重建，防止lxml内存碎片持续增长
+    - cpu_timeout_sec: 单篇CPU时间上限(信号打断，worker 继续可用)
+    - wall_timeout_sec: 单篇执行的墙钟上限(不含排队)，兜住卡在C扩展里、信号打断不了的抽取；
+      超时后杀掉整池worker重建(卡住的进程否则一直占着名额)，同池被连带中断的文档重试一次
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 16, docs_per_worker: int = 200,
+                 cpu_timeout_sec: float = 10, wall_timeout_sec: float = 20):
+        self.max_workers = max_workers
+        self.docs_per_worker = docs_per_worker
+        self.cpu_timeout_sec = cpu_timeout_sec
+        self.wall_timeout_sec = wall_timeout_sec
+        self._slots = asyncio.Semaphore(max_pending)
+        # 进程池里同时只放 max_workers 篇，墙钟计时只覆盖执行，不把在进程池内排队的时间算进去
+        self._running = asyncio.Semaphore(max_workers)
+        self._executor: ProcessPoolExecutor | None = None
+        self._pids = None # 当前进程池 worker 上报pid的队列
+        self._killed: weakref.WeakSet[ProcessPoolExecutor] = weakref.WeakSet() # 因墙钟超时被主动杀掉的进程池
+        self._submitted = 0  # 当前进程池已接收的文档数
+        self.stats_counter = {"extracted": 0, "timeouts": 0, "failures": 0, "pool_recycles": 0, "pool_restarts": 0, "workers_killed": 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # 整池轮换代替 max_tasks_per_child:后者在部分Python版本上替换worker时会卡死
+        # 旧池 shutdown(wait=False) 后仍会把手头的文档做完再退出
+        if self._executor is not None and self._submitted >= self.docs_per_worker * self.max_workers:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self.stats_counter["pool_recycles"] += 1
+        if self._executor is None:
+            # 服务端有多个线程在跑，fork不安全，统一用spawn
+            ctx = multiprocessing.get_context("spawn")
+            self._pids = ctx.SimpleQueue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(self._pids,),
+            )
+            self._submitted = 0
+            logger.info(f"🧵 [Extractor] 抽取进程池已启动 | workers: {self.max_workers}")
+        self._submitted += 1
+        return self._executor
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        # 同一个池崩溃会让多篇文档各报一次，只重建一次
+        if self._executor is executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self.stats_counter["pool_restarts"] += 1
+
+    def _kill(self, executor: ProcessPoolExecutor):
+        """
+        墙钟超时:杀掉该池的全部worker(看不出是哪个进程在跑这篇)，池随之失效，下次提交时重建
+        """
+        if executor is not self._executor:
+            return
+        pids = []
+        while not self._pids.empty():
+            pids.append(self._pids.get())
+        self._killed.add(executor)
+        self._restart(executor)
+        for pid in pids:
+            try:
+                os.kill(pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+                self.stats_counter["workers_killed"] += 1
+            except (ProcessLookupError, PermissionError):
+                pass # 已被回收/退出
+
+    async def _run(self, body: bytes):
+        async with self._running:
+            executor = self._get_executor()
+            future = asyncio.get_running_loop().run_in_executor(executor, extract_document, body, self.cpu_timeout_sec)
+            try:
+                return await asyncio.wait_for(future, timeout=self.wall_timeout_sec)
+            except asyncio.TimeoutError:
+                logger.warning(f"🔪 [Extractor] 抽取超过墙钟上限 {self.wall_timeout_sec}s，回收卡住的worker")
+                self._kill(executor)
+                raise
+            except BrokenProcessPool:
+                if executor in self._killed:
+                    raise _Collateral()
+                # worker被OOM杀掉等情况，整个池不可用，重建后本篇放弃
+                logger.error("💥 [Extractor] 抽取进程池崩溃，正在重建")
+                self._restart(executor)
+                raise
+
+    async def extract(self, body: bytes):
+        """
+        返回 (html, 正文)；超时或失败时正文为None
+        """
+        async with self._slots:
+            try:
+                try:
+                    html, text = await self._run(body)
+                except _Collateral:
+                    # 同池别的文档超时导致本篇被连带中断，换新池重试一次
+                    html, text = await self._run(body)
+                self.stats_counter["extracted"] += 1
+                return html, text
+            except (ExtractionTimeout, asyncio.TimeoutError):
+                self.stats_counter["timeouts"] += 1
+                logger.warning(f"⏰ [Extractor] 正文抽取超时 ({len(body) // 1024}KB)，已放弃")
+                return None, None
+            except (BrokenProcessPool, _Collateral):
+                self.stats_counter["failures"] += 1
+                return None, None
+            except Exception as e:
+                self.stats_counter["failures"] += 1
+                logger.error(f"❌ [Extractor] 正文抽取失败: {e}")
+                return None, None
+
+    def stats(self) -> dict:
+        return dict(self.stats_counter)
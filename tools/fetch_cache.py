@@ -0,0 +1,201 @@
+# 抓取缓存:按URL索引、按内容寻址的磁盘缓存，同时保存原始HTML与抽取后的正文
+# 目录结构: <cache_dir>/index.sqlite (索引) + <cache_dir>/blobs/<hash前两位>/<hash>.html|.txt (内容)
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+from loguru import logger
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    content_hash: str
+    html: str
+    text: str
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float
+    fresh: bool  # 是否仍在TTL内(过期条目可用ETag/Last-Modified做条件请求复活)
+
+
+class FetchCache:
+    """
+    URL -> (HTML, 正文) 的持久化缓存
+    - TTL: 超过 ttl_sec 的条目视为过期，需要条件请求重新验证
+    - LRU: 总体积超过 max_bytes 时，按最近访问时间淘汰
+    - 内容寻址: 相同HTML(如镜像站/重定向)只存一份
+    """
+
+    def __init__(self, cache_dir: str = "./cache/fetch", ttl_sec: int = 6 * 3600, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        # 多个线程(to_thread)会并发读写，统一用一把锁串行化sqlite操作
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url_hash TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                content_hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access);
+        """)
+        self._conn.commit()
+
+        # 命中统计(进程内，重启清零)
+        self.stats_counter = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def _hash(data: str) -> str:
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _blob_path(self, content_hash: str, suffix: str) -> str:
+        return os.path.join(self.blob_dir, content_hash[:2], f"{content_hash}.{suffix}")
+
+    def _read_blob(self, content_hash: str, suffix: str) -> str | None:
+        try:
+            with open(self._blob_path(content_hash, suffix), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_blob(self, content_hash: str, suffix: str, data: str):
+        path = self._blob_path(content_hash, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，避免并发读到半截内容
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, url: str) -> CacheEntry | None:
+        """
+        查找缓存。不存在返回None；存在则返回条目(可能已过期，由fresh标记)
+        """
+        url_hash = self._hash(url)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, etag, last_modified, fetched_at FROM entries WHERE url_hash=?",
+                (url_hash,)
+            ).fetchone()
+            if row is None:
+                self.stats_counter["misses"] += 1
+                return None
+            content_hash, etag, last_modified, fetched_at = row
+            html = self._read_blob(content_hash, "html")
+            text = self._read_blob(content_hash, "txt")
+            if html is None or text is None:
+                # 文件被外部删除，索引作废
+                self._conn.execute("DELETE FROM entries WHERE url_hash=?", (url_hash,))
+                self._conn.commit()
+                self.stats_counter["misses"] += 1
+                return None
+            self._conn.execute("UPDATE entries SET last_access=? WHERE url_hash=?", (time.time(), url_hash))
+            self._conn.commit()
+
+        fresh = time.time() - fetched_at < self.ttl_sec
+        self.stats_counter["hits" if fresh else "stale"] += 1
+        return CacheEntry(url, content_hash, html, text, etag, last_modified, fetched_at, fresh)
+
+    def put(self, url: str, html: str, text: str, etag: str | None = None, last_modified: str | None = None):
+        """
+        写入(或覆盖)一条缓存，并在超出容量时触发淘汰
+        """
+        content_hash = self._hash(html)
+        url_hash = self._hash(url)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT content_hash FROM entries WHERE url_hash=?", (url_hash,)).fetchone()
+            exists = self._conn.execute("SELECT 1 FROM blobs WHERE content_hash=?", (content_hash,)).fetchone()
+            if not exists:
+                self._write_blob(content_hash, "html", html)
+                self._write_blob(content_hash, "txt", text)
+                size = len(html.encode("utf-8")) + len(text.encode("utf-8"))
+                self._conn.execute("INSERT INTO blobs(content_hash, size) VALUES(?,?)", (content_hash, size))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries(url_hash, url, content_hash, etag, last_modified, fetched_at, last_access) "
+                "VALUES(?,?,?,?,?,?,?)",
+                (url_hash, url, content_hash, etag, last_modified, now, now)
+            )
+            # 页面内容变了，旧版本若无人引用则回收
+            if old and old[0] != content_hash:
+                self._drop_blob_if_orphan_locked(old[0])
+            self._conn.commit()
+            self.stats_counter["stores"] += 1
+            self._evict_locked()
+
+    def mark_revalidated(self, url: str, etag: str | None = None, last_modified: str | None = None):
+        """
+        条件请求返回304:内容未变，只刷新时间戳(和新的校验头)
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET fetched_at=?, last_access=?, "
+                "etag=COALESCE(?, etag), last_modified=COALESCE(?, last_modified) WHERE url_hash=?",
+                (now, now, etag, last_modified, self._hash(url))
+            )
+            self._conn.commit()
+        self.stats_counter["revalidated"] += 1
+        self.stats_counter["hits"] += 1
+
+    def _drop_blob_if_orphan_locked(self, content_hash: str) -> int:
+        """
+        内容不再被任何URL引用时删除文件，返回释放的字节数(调用方需持有锁)
+        """
+        if self._conn.execute("SELECT 1 FROM entries WHERE content_hash=?", (content_hash,)).fetchone():
+            return 0
+        row = self._conn.execute("SELECT size FROM blobs WHERE content_hash=?", (content_hash,)).fetchone()
+        for suffix in ("html", "txt"):
+            try:
+                os.remove(self._blob_path(content_hash, suffix))
+            except OSError:
+                pass
+        self._conn.execute("DELETE FROM blobs WHERE content_hash=?", (content_hash,))
+        return row[0] if row else 0
+
+    def _evict_locked(self):
+        """
+        LRU淘汰:按最近访问时间删除URL条目，再回收不再被引用的内容文件(调用方需持有锁)
+        """
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT url_hash, content_hash FROM entries ORDER BY last_access ASC").fetchall()
+        for url_hash, content_hash in rows:
+            if total <= self.max_bytes * 0.9:  # 留10%余量，避免每次写入都触发淘汰
+                break
+            self._conn.execute("DELETE FROM entries WHERE url_hash=?", (url_hash,))
+            self.stats_counter["evictions"] += 1
+            total -= self._drop_blob_if_orphan_locked(content_hash)
+        self._conn.commit()
+        logger.info(f"🧹 [FetchCache] LRU淘汰完成 | 当前体积: {total / 1024 / 1024:.1f}MB")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        lookups = self.stats_counter["hits"] + self.stats_counter["misses"]
+        return {
+            **self.stats_counter,
+            "hit_rate": round(self.stats_counter["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+        }
@@ -0,0 +1,110 @@
+# 原生异步抓取引擎:共享连接池(keep-alive/HTTP2) + 按域名限流 + 响应体大小上限
+# 只负责下载，CPU密集的正文抽取由调用方另行处理
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+import httpx
+from loguru import logger
+
+try:
+    import h2  # noqa: F401  # 装了 h2 才能开启 HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+@dataclass
+class FetchResponse:
+    url: str
+    status: int
+    body: bytes
+    etag: str | None
+    last_modified: str | None
+    truncated: bool = False  # 超过大小上限被截断
+
+
+class AsyncFetcher:
+    """
+    所有抓取共享一个 httpx.AsyncClient:同域名的多个URL复用连接，不再每个URL新建连接、占一个线程
+    """
+
+    def __init__(self, user_agent: str, timeout_sec: float = 25, max_connections: int = 64,
+                 max_keepalive: int = 32, per_host_limit: int = 4, max_body_bytes: int = 5 * 1024 * 1024):
+        self.user_agent = user_agent
+        self.timeout_sec = timeout_sec
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.per_host_limit = per_host_limit
+        self.max_body_bytes = max_body_bytes
+        self._client: httpx.AsyncClient | None = None
+        # host -> [信号量, 正在使用(持有+等待)的请求数]；归零时删除，长期运行的服务不会随见过的域名无限增长
+        self._host_sems: dict[str, list] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # 懒加载:必须在事件循环里创建
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                follow_redirects=True,
+                timeout=httpx.Timeout(self.timeout_sec, connect=10),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive),
+                headers={"User-Agent": self.user_agent},
+            )
+            logger.info(f"🌐 [Fetcher] 连接池已创建 | HTTP/2: {HTTP2_AVAILABLE}")
+        return self._client
+
+    @asynccontextmanager
+    async def _host_slot(self, url: str):
+        # 按域名限流:批量URL来自同一站点时不至于把对方打爆/触发反爬
+        host = urlsplit(url).netloc.lower()
+        entry = self._host_sems.get(host)
+        if entry is None:
+            entry = self._host_sems[host] = [asyncio.Semaphore(self.per_host_limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._host_sems[host]
+
+    async def fetch(self, url: str, etag: str | None = None, last_modified: str | None = None) -> FetchResponse:
+        """
+        下载单个URL。带 etag/last_modified 时发条件请求，304 时 body 为空
+        网络异常直接抛出，由调用方转成错误字符串
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        async with self._host_slot(url):
+            async with self._get_client().stream("GET", url, headers=headers) as resp:
+                chunks = []
+                size = 0
+                truncated = False
+                # 流式读取，超过上限立刻停止，避免超大页面吃满内存
+                async for chunk in resp.aiter_bytes():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= self.max_body_bytes:
+                        truncated = True
+                        logger.warning(f"✂️ [Fetcher] 响应体超过 {self.max_body_bytes // 1024}KB，已截断: {url}")
+                        break
+                return FetchResponse(
+                    url=url,
+                    status=resp.status_code,
+                    body=b"".join(chunks)[:self.max_body_bytes],
+                    etag=resp.headers.get("ETag"),
+                    last_modified=resp.headers.get("Last-Modified"),
+                    truncated=truncated,
+                )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
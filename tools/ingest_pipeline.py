@@ -0,0 +1,206 @@
+# 异步入库流水线:切分/向量化/写库全部移出事件循环，core_node 只负责投递
+# core(投递) -> 有界队列 -> worker(按文章拆分/切分/去重) -> embedding(调度器按token切批并发) -> 向量库
+import asyncio
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from tools.articles import iter_articles
+from tools.corpus import make_doc_id
+
+
+@dataclass(eq=False)
+class IngestJob:
+    text: str
+    source_url: str
+    session_id: str
+    future: asyncio.Future
+    finished: asyncio.Event = field(default_factory=asyncio.Event) # worker 处理完(或放弃)时置位
+
+
+class IngestPipeline:
+    """
+    - max_queue: 队列上限，满了之后 submit 会等待(背压)，防止内存被大批量抓取撑爆
+    - workers: 同时处理的文档数
+    embedding请求的切批/并发/限流由 RAGStore 里的 EmbeddingDispatcher 统一负责(跨文档、跨检索共享预算)
+    """
+
+    def __init__(self, rag_store, max_queue: int = 64, workers: int = 2):
+        # rag_store 是 LazyComponent:在事件循环里先 await aget() 拿到实例再用，不走会阻塞的属性代理
+        self.rag_store = rag_store
+        self.max_queue = max_queue
+        self.workers = workers
+        self._queue: asyncio.Queue | None = None
+        self._worker_tasks: list[asyncio.Task] = []
+        # session_id -> 该会话尚未完成的入库任务，writer 据此等待
+        self._pending: dict[str, set[asyncio.Future]] = {}
+        # doc_id -> 正在入库的同一文档，跨会话共享结果
+        self._docs_inflight: dict[str, asyncio.Future] = {}
+        # worker 正在处理的任务(取消会话时等它们在下一个步骤边界停下)
+        self._active: set[IngestJob] = set()
+        self.stats_counter = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "articles": 0, "reused": 0, "chunks": 0}
+
+    def _ensure_started(self):
+        # 懒启动:必须在事件循环内创建队列和worker
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.create_task(self._worker(len(self._worker_tasks))))
+
+    async def submit(self, text: str, source_url: str, session_id: str) -> asyncio.Future:
+        """
+        投递一篇文档，立即返回(队列满时等待)。返回的future在入库完成后置为 True/False
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(session_id, set())
+        pending.add(future)
+        future.add_done_callback(lambda f: self._forget(session_id, f))
+        await self._queue.put(IngestJob(text, source_url, session_id, future))
+        self.stats_counter["submitted"] += 1
+        logger.info(f"📥 [Ingest] 已投递入库队列 | 排队: {self._queue.qsize()} | 来源: {source_url}")
+        return future
+
+    def _forget(self, session_id: str, future: asyncio.Future):
+        pending = self._pending.get(session_id)
+        if pending is not None:
+            pending.discard(future)
+            if not pending:
+                self._pending.pop(session_id, None)
+
+    async def wait_session(self, session_id: str, timeout: float | None = None) -> bool:
+        """
+        屏障:等待该会话所有已投递文档入库完成。超时返回False(已入库的部分仍可检索)
+        """
+        pending = list(self._pending.get(session_id, ()))
+        if not pending:
+            return True
+        logger.info(f"⏳ [Ingest] 等待会话 {session_id} 的 {len(pending)} 篇文档入库...")
+        _, not_done = await asyncio.wait(pending, timeout=timeout)
+        if not_done:
+            logger.warning(f"⏰ [Ingest] 等待入库超时，{len(not_done)} 篇文档尚未完成")
+            return False
+        return True
+
+    async def cancel_session(self, session_id: str, timeout: float = 10) -> int:
+        """
+        研究被取消时调用:丢弃该会话还在排队的文档；正在处理的在下一个步骤边界停下(线程里已开始的那一步无法中断)
+        返回被取消的文档数。之后由调用方清理该会话已写入的部分
+        """
+        pending = list(self._pending.get(session_id, ()))
+        for future in pending:
+            future.cancel()
+        active = [asyncio.ensure_future(job.finished.wait()) for job in self._active if job.session_id == session_id]
+        if active:
+            _, not_done = await asyncio.wait(active, timeout=timeout)
+            for waiter in not_done:
+                waiter.cancel()
+        if pending:
+            logger.warning(f"🛑 [Ingest] 会话 {session_id} 已取消，丢弃 {len(pending)} 篇未完成的文档")
+        return len(pending)
+
+    async def _worker(self, idx: int):
+        while True:
+            job = await self._queue.get()
+            if job.future.cancelled():
+                # 会话已取消，直接跳过
+                self.stats_counter["cancelled"] += 1
+                job.finished.set()
+                self._queue.task_done()
+                continue
+            self._active.add(job)
+            try:
+                ok = await self._ingest(job)
+                if not job.future.done():
+                    job.future.set_result(ok)
+                self.stats_counter["cancelled" if job.future.cancelled() else "completed"] += 1
+            except Exception as e:
+                logger.error(f"❌ [Ingest #{idx}] 入库失败: {e}")
+                self.stats_counter["failed"] += 1
+                if not job.future.done():
+                    job.future.set_result(False)
+            finally:
+                self._active.discard(job)
+                job.finished.set()
+                self._queue.task_done()
+
+    async def _ingest(self, job: IngestJob) -> bool:
+        # batch_fetch 的结果按分隔线逐篇入库:每篇是独立文档，带各自的来源URL
+        # 同一任务内按顺序处理，会话内去重保持"先到先留"
+        store = await self.rag_store.aget()
+        stored = False
+        for url, article in iter_articles(job.text, job.source_url):
+            if job.future.cancelled():
+                break
+            self.stats_counter["articles"] += 1
+            stored = await self._ingest_article(store, job, url, article) or stored
+        return stored
+
+    async def _ingest_article(self, store, job: IngestJob, source_url: str, text: str) -> bool:
+        doc_id = make_doc_id(text, source_url)
+        # 共享库已有同一文档(其他会话抓过):直接引用，跳过切分/向量化
+        if await asyncio.to_thread(store.attach_document, doc_id, job.session_id):
+            self.stats_counter["reused"] += 1
+            logger.info(f"♻️ [Ingest] 共享库已有该文档，直接引用 (来源: {source_url})")
+            return True
+
+        # 另一个会话正在入库同一文档:等它完成后引用，避免重复向量化
+        inflight = self._docs_inflight.get(doc_id)
+        if inflight is not None:
+            ok = await asyncio.shield(inflight)
+            if ok and await asyncio.to_thread(store.attach_document, doc_id, job.session_id):
+                self.stats_counter["reused"] += 1
+                return True
+            # 按会话分区时引用不到别的会话集合里的文档，自己再写一份(向量已在Embedding缓存里)
+
+        inflight = asyncio.get_running_loop().create_future()
+        owner = self._docs_inflight.setdefault(doc_id, inflight) is inflight
+        ok = False
+        try:
+            ok = await self._ingest_new(store, job, source_url, text, doc_id)
+            return ok
+        finally:
+            if owner:
+                self._docs_inflight.pop(doc_id, None)
+            inflight.set_result(ok)
+
+    async def _ingest_new(self, store, job: IngestJob, source_url: str, text: str, doc_id: str) -> bool:
+        # 切分/去重是纯CPU操作，也放到线程里，避免长文卡住事件循环
+        chunks = await asyncio.to_thread(store.split_documents, text, source_url, doc_id)
+        if not chunks:
+            return False
+        chunks, kept_doc_id, marks = await asyncio.to_thread(store.dedup_chunks, chunks, job.session_id)
+        if not chunks:
+            # 整篇都与本会话已入库的内容重复，不需要再写
+            return True
+        if job.future.cancelled(): # 向量化前最后一次检查，取消后不再花 embedding 额度
+            return False
+        write = asyncio.ensure_future(asyncio.to_thread(store.add_chunks, chunks, job.session_id))
+        try:
+            await asyncio.shield(write)
+        except BaseException:
+            # 可能已写入一部分片段，未登记的向量 GC 回收不到，这里删掉
+            # 任务被取消时线程还在写，先等它结束再删，否则删完又写进来
+            await asyncio.gather(write, return_exceptions=True)
+            await asyncio.to_thread(store.backend.delete_docs, [kept_doc_id], job.session_id)
+            raise
+        if job.future.cancelled():
+            # 向量已写入但不再登记:同样要删掉，否则成了 GC 看不到的孤儿向量
+            await asyncio.to_thread(store.backend.delete_docs, [kept_doc_id], job.session_id)
+            return False
+        # 全部片段写入后才登记，检索不会看到半截文档；去重丢过片段的登记为会话私有，不进入共享库
+        await asyncio.to_thread(store.register_document, kept_doc_id, source_url, len(chunks), job.session_id,
+                                kept_doc_id == doc_id)
+        # 写入成功后才记住指纹，失败/取消后重试不会被当成重复
+        store.remember_chunks(marks, job.session_id)
+        self.stats_counter["chunks"] += len(chunks)
+        logger.info(f"✅ [Ingest] 全部入库完成 (共 {len(chunks)} 个片段 | 来源: {source_url})")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            **self.stats_counter,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "sessions_pending": len(self._pending),
+        }
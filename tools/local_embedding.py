@@ -0,0 +1,247 @@
+# 本地Embedding引擎:int8量化的 BGE-M3 ONNX + ONNX Runtime，替代 PyTorch 版 HuggingFaceEmbeddings
+# - 进程内单例:同一进程里的所有调用方共用一份模型(shared_engine)
+# - 跨请求合批:与 RerankBatcher 同样的思路，所有推理在一个后台线程串行执行，ONNX自身的多线程吃满CPU
+# - 首次加载时由 ONNX Runtime 做图优化并把优化后的模型落盘(权重放在外部数据文件)，之后启动直接加载，跳过优化
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import onnxruntime as ort
+from huggingface_hub import hf_hub_download
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+from tokenizers import Tokenizer
+
+MODEL_CACHE_DIR = "./models"
+
+
+class _EmbedJob:
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.future: Future = Future()
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    - repo_id / model_file: HuggingFace 上的ONNX导出(默认预量化int8)，同目录需有 tokenizer.json
+    - max_length: 单条文本的token上限(切片 1200 字，2048 足够，不必用满 8192)
+    - max_batch_texts / max_wait_ms: 合批上限与凑批等待，多个会话同时入库/检索时合成一次推理
+    - max_batch_tokens: 单次推理的 (条数 x 补齐后长度) 上限；合并后的请求按长度排序再切分，短文本不会被补齐到长文本的长度
+    - threads: ONNX Runtime 线程数，0 = 由 ONNX Runtime 决定(物理核数)
+    """
+
+    def __init__(self, repo_id: str, model_file: str, max_length: int = 2048, max_batch_texts: int = 64,
+                 max_batch_tokens: int = 16384, max_wait_ms: float = 10, threads: int = 0,
+                 cache_dir: str = MODEL_CACHE_DIR):
+        self.max_length = max_length
+        self.max_batch_texts = max_batch_texts
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait_sec = max_wait_ms / 1000
+
+        start = time.perf_counter()
+        model_path = hf_hub_download(repo_id, model_file, cache_dir=cache_dir)
+        tokenizer_path = hf_hub_download(repo_id, "tokenizer.json", cache_dir=cache_dir)
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.no_padding() # 补齐在排序分批之后按批做
+        self.tokenizer.enable_truncation(max_length)
+        self.pad_id = self.tokenizer.token_to_id("<pad>") or 0
+
+        self.session = self._load_session(model_path, repo_id, model_file, threads, cache_dir)
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self._output_names = [o.name for o in self.session.get_outputs()]
+        logger.info(f"✅ [Embed] 本地ONNX模型就绪 ({repo_id}/{model_file}，耗时 {time.perf_counter() - start:.1f}s)")
+
+        self._queue: queue.Queue[_EmbedJob] = queue.Queue()
+        self._carry: _EmbedJob | None = None # 上一批放不下的请求，下一批优先处理
+        self.stats_counter = {"requests": 0, "batches": 0, "texts": 0, "tokens": 0, "padded_tokens": 0, "infer_ms": 0.0}
+        self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _load_session(model_path: str, repo_id: str, model_file: str, threads: int, cache_dir: str) -> ort.InferenceSession:
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        # 每批长度不同，内存池会按历史峰值一直占着；关掉后推理完即释放
+        opts.enable_cpu_mem_arena = False
+
+        # 优化后的模型与 ONNX Runtime 版本绑定，换版本重新生成
+        name = f"{repo_id}/{model_file}".replace("/", "--").removesuffix(".onnx")
+        optimized = os.path.join(cache_dir, "optimized", f"{name}.ort{ort.__version__}.onnx")
+        if os.path.exists(optimized):
+            # 已优化过:跳过图优化，权重从外部数据文件加载(ONNX Runtime 对外部数据按文件映射读取)
+            opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            return ort.InferenceSession(optimized, opts, providers=["CPUExecutionProvider"])
+
+        logger.info("⚙️ [Embed] 首次加载，生成优化后的模型(仅一次)...")
+        os.makedirs(os.path.dirname(optimized), exist_ok=True)
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        opts.optimized_model_filepath = optimized
+        opts.add_session_config_entry("session.optimized_model_external_initializers_file_name", os.path.basename(optimized) + ".data")
+        opts.add_session_config_entry("session.optimized_model_external_initializers_min_size_in_bytes", "1024")
+        return ort.InferenceSession(model_path, opts, providers=["CPUExecutionProvider"])
+
+    # 推理
+    def _run(self, encodings: list) -> np.ndarray:
+        """
+        一次推理:补齐到本批最长，输出归一化的稠密向量(BGE-M3 取 [CLS])
+        """
+        width = max(len(e.ids) for e in encodings)
+        input_ids = np.full((len(encodings), width), self.pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, e in enumerate(encodings):
+            input_ids[row, :len(e.ids)] = e.ids
+            attention_mask[row, :len(e.ids)] = 1
+
+        onnx_input = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            onnx_input["token_type_ids"] = np.zeros_like(input_ids)
+
+        outputs = dict(zip(self._output_names, self.session.run(None, onnx_input)))
+        # 有的导出直接给出句向量，否则从 last_hidden_state 取 [CLS]
+        vectors = outputs.get("sentence_embedding", outputs.get("dense_vecs"))
+        if vectors is None:
+            vectors = outputs[self._output_names[0]][:, 0]
+        vectors = vectors.astype(np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        self.stats_counter["tokens"] += int(attention_mask.sum())
+        self.stats_counter["padded_tokens"] += input_ids.size
+        return vectors
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """
+        (在合批线程里调用) 按长度排序后切成若干次推理，结果按输入顺序返回
+        """
+        encodings = self.tokenizer.encode_batch(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(encodings[i].ids))
+        result = np.empty((len(texts), 0), dtype=np.float32)
+        start = 0
+        while start < len(order):
+            # 排过序，当前这条最长；补齐后的总token数不超过上限
+            end = start + 1
+            while end < len(order) and end - start < self.max_batch_texts \
+                    and (end - start + 1) * len(encodings[order[end]].ids) <= self.max_batch_tokens:
+                end += 1
+            idxs = order[start:end]
+            vectors = self._run([encodings[i] for i in idxs])
+            if result.shape[1] == 0:
+                result = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            result[idxs] = vectors
+            start = end
+        return result
+
+    # 跨请求合批
+    def _submit(self, texts: list[str]) -> Future:
+        job = _EmbedJob(texts)
+        self._queue.put(job)
+        return job.future
+
+    def _collect(self) -> list[_EmbedJob]:
+        """
+        凑一批:取出的请求先 set_running_or_notify_cancel()，调用方已取消(aembed_* 的任务被取消)的直接丢掉
+        """
+        first, self._carry = self._carry, None
+        while first is None:
+            job = self._queue.get()
+            if job.future.set_running_or_notify_cancel():
+                first = job
+        jobs = [first]
+        size = len(first.texts)
+        deadline = time.monotonic() + self.max_wait_sec
+        while size < self.max_batch_texts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            if size + len(job.texts) > self.max_batch_texts:
+                # 放不下就留到下一批的开头
+                self._carry = job
+                break
+            jobs.append(job)
+            size += len(job.texts)
+        return jobs
+
+    def _loop(self):
+        # 唯一的合批线程:任何异常都不能让它退出，否则之后所有 embedding 请求都会一直挂起
+        while True:
+            try:
+                self._run_batch(self._collect())
+            except Exception as e:
+                logger.exception(f"❌ [Embed] 合批线程异常: {e}")
+
+    def _run_batch(self, jobs: list[_EmbedJob]):
+        texts = [t for job in jobs for t in job.texts]
+        start = time.perf_counter()
+        try:
+            vectors = self.encode(texts)
+        except Exception as e:
+            for job in jobs:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            return
+        offset = 0
+        for job in jobs:
+            if not job.future.done():
+                job.future.set_result(vectors[offset: offset + len(job.texts)].tolist())
+            offset += len(job.texts)
+        self.stats_counter["requests"] += len(jobs)
+        self.stats_counter["batches"] += 1
+        self.stats_counter["texts"] += len(texts)
+        self.stats_counter["infer_ms"] += (time.perf_counter() - start) * 1000
+
+    # LangChain Embeddings 接口
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return self._submit(texts).result()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._submit([text]).result()[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        # 直接等待合批线程的结果，不额外占用线程
+        return await asyncio.wrap_future(self._submit(texts))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await asyncio.wrap_future(self._submit([text])))[0]
+
+    def stats(self) -> dict:
+        batches = self.stats_counter["batches"]
+        padded = self.stats_counter["padded_tokens"]
+        return {
+            **self.stats_counter,
+            "infer_ms": round(self.stats_counter["infer_ms"], 1),
+            "avg_requests_per_batch": round(self.stats_counter["requests"] / batches, 2) if batches else 0.0,
+            "padding_efficiency": round(self.stats_counter["tokens"] / padded, 3) if padded else 0.0,
+            "queue_size": self._queue.qsize(),
+        }
+
+
+_shared: OnnxEmbeddings | None = None
+_shared_lock = threading.Lock()
+
+
+def shared_engine(**kwargs) -> OnnxEmbeddings:
+    """
+    进程内单例:第一次调用时加载模型，之后的调用(参数忽略)都返回同一个实例
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = OnnxEmbeddings(**kwargs)
+        return _shared
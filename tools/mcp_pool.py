@@ -0,0 +1,300 @@
+# MCP 工具连接池:持久会话 + 后台健康探测 + 断线重连
+# 原来 get_tools() 得到的工具每次调用都新建一个HTTP会话(建连 + initialize 握手)，而且只在启动时连一次:
+# mcp-server 容器晚于后端启动时，直到后端重启之前都没有搜索工具
+import asyncio
+import itertools
+import statistics
+import time
+import uuid
+from collections import deque
+from datetime import timedelta
+from typing import Callable
+
+import httpx
+from loguru import logger
+
+PROBE_INTERVAL_SEC = 15 # 在线时的探测间隔
+PROBE_TIMEOUT_SEC = 5 # 单次探测(ping)超时
+CONNECT_TIMEOUT_SEC = 10 # 建立会话(initialize + list_tools)超时
+RECONNECT_BACKOFF_SEC = (1, 30) # 离线时重连的初始间隔/上限(指数退避)
+CALL_WAIT_SEC = 15 # 工具调用时若正在重连，最多等待的时长
+POOL_MAX_CONNECTIONS = 32 # 持久会话底层 HTTP keep-alive 连接池大小(并发的工具调用复用这些连接)
+LATENCY_WINDOW = 200 # 探测延迟统计的滑动窗口
+
+
+def _pooled_http_client(headers: dict[str, str] | None = None, timeout: httpx.Timeout | None = None,
+                        auth: httpx.Auth | None = None) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=POOL_MAX_CONNECTIONS, max_keepalive_connections=POOL_MAX_CONNECTIONS)
+    return httpx.AsyncClient(
+        headers=headers,
+        timeout=timeout or httpx.Timeout(30, read=300),
+        auth=auth,
+        limits=limits,
+        follow_redirects=True,
+    )
+
+
+class McpToolPool:
+    """
+    - 一个长期存活的 MCP 会话(底层连接池复用)，所有工具调用共用，不再每次调用都握手
+    - 后台任务定时 ping:记录延迟；失败则断开并按指数退避重连，重连后重新拉取工具列表
+    - 工具对象绑定在连接池上而不是某个会话上，重连后旧的工具对象依然可用；工具列表变化时 version 递增，使用方据此换用新工具集
+    本对象对工具实现了 ClientSession 的 list_tools/call_tool 两个方法，交给 langchain_mcp_adapters 转换成 LangChain 工具
+    """
+
+    def __init__(self, url: str, server_name: str, on_status: Callable[[bool], None] | None = None):
+        self.url = url
+        self.server_name = server_name
+        self.on_status = on_status
+        self.tools: list = []
+        self.version = 0 # 工具列表版本，变化时递增
+        self._tool_signature: tuple | None = None
+
+        self._session = None
+        self._session_started: float | None = None
+        self._closing: asyncio.Event | None = None # 通知会话任务退出
+        self._online = asyncio.Event()
+        self._wake = asyncio.Event() # 调用失败时提前唤醒探测任务
+        self._prober: asyncio.Task | None = None
+        self._runner: asyncio.Task | None = None
+        self._background: set[asyncio.Task] = set() # 取消通知等后台发送任务(保持引用)
+        # 调用关联ID:连接池自己编号(前缀区分多个后端进程)，随请求的 _meta 发给服务端，日志/重试/取消都用它
+        self._call_prefix = uuid.uuid4().hex[:8]
+        self._call_seq = itertools.count(1)
+
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._last_probe: float | None = None
+        self.stats_counter = {
+            "probes": 0, "probe_failures": 0,
+            "connects": 0, "connect_failures": 0, "disconnects": 0,
+            "calls": 0, "call_failures": 0, "call_retries": 0, "call_cancelled": 0,
+        }
+
+    @property
+    def online(self) -> bool:
+        return self._session is not None
+
+    def _connection(self) -> dict:
+        return {
+            "transport": "streamable_http",
+            "url": self.url,
+            "timeout": timedelta(seconds=30),
+            "httpx_client_factory": _pooled_http_client,
+        }
+
+    # 生命周期
+    async def start(self, wait_sec: float = 0):
+        """
+        启动后台探测(必须在事件循环内调用)；wait_sec > 0 时最多等这么久让第一次连接完成
+        """
+        if self._prober is None:
+            self._prober = asyncio.create_task(self._probe_loop(), name="mcp-prober")
+        if wait_sec > 0 and not self._online.is_set():
+            try:
+                await asyncio.wait_for(self._online.wait(), wait_sec)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ [MCP] {wait_sec:.0f}s 内未连上 {self.url}，后台继续重连")
+
+    async def close(self):
+        if self._prober is not None:
+            self._prober.cancel()
+            self._prober = None
+        self._disconnect("shutdown")
+        if self._runner is not None:
+            await asyncio.gather(self._runner, return_exceptions=True)
+
+    async def _run_session(self, ready: asyncio.Future):
+        """
+        持有一个会话直到被要求关闭(会话上下文基于 anyio，进入和退出必须在同一个任务里)
+        """
+        from langchain_mcp_adapters.sessions import create_session
+        closing = asyncio.Event()
+        try:
+            async with create_session(self._connection()) as session:
+                await session.initialize()
+                if ready.done(): # 建连超时，调用方已放弃
+                    return
+                self._closing = closing
+                ready.set_result(session)
+                await closing.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e if isinstance(e, Exception) else ConnectionError(repr(e)))
+            elif not closing.is_set():
+                # 会话在使用中异常结束(服务端断开等)
+                logger.warning(f"⚠️ [MCP] 会话异常结束: {type(e).__name__}: {e}")
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            if ready.done() and not ready.cancelled() and ready.exception() is None and self._session is ready.result():
+                self._disconnect("session ended")
+
+    async def _connect(self) -> bool:
+        from langchain_mcp_adapters.tools import load_mcp_tools
+        ready = asyncio.get_running_loop().create_future()
+        runner = asyncio.create_task(self._run_session(ready), name="mcp-session")
+        try:
+            session = await asyncio.wait_for(asyncio.shield(ready), CONNECT_TIMEOUT_SEC)
+            self._session = session
+            # 工具绑定在连接池(self)上，之后重连不需要重新生成
+            tools = await asyncio.wait_for(load_mcp_tools(self, server_name=self.server_name), CONNECT_TIMEOUT_SEC)
+        except Exception as e:
+            self.stats_counter["connect_failures"] += 1
+            logger.debug(f"[MCP] 连接失败: {type(e).__name__}: {e}")
+            if not ready.done():
+                ready.cancel()
+            self._session = None
+            if self._closing is not None:
+                self._closing.set()
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+            return False
+
+        self._runner = runner
+        self._session_started = time.monotonic()
+        self.stats_counter["connects"] += 1
+        self._swap_tools(tools)
+        self._online.set()
+        logger.success(f"✅ [MCP] 已连接 {self.url} | 工具: {[t.name for t in self.tools]}")
+        if self.on_status:
+            self.on_status(True)
+        return True
+
+    def _disconnect(self, reason: str):
+        if self._session is None:
+            return
+        self._session = None
+        self._session_started = None
+        self._online.clear()
+        if self._closing is not None:
+            self._closing.set()
+        self.stats_counter["disconnects"] += 1
+        logger.warning(f"🔌 [MCP] 连接断开 ({reason})")
+        if self.on_status:
+            self.on_status(False)
+        self._wake.set()
+
+    def _swap_tools(self, tools: list):
+        signature = tuple(sorted((t.name, t.description, str(t.args_schema)) for t in tools))
+        if signature != self._tool_signature:
+            self._tool_signature = signature
+            self.tools = tools
+            self.version += 1
+            logger.info(f"🔁 [MCP] 工具列表更新 (version {self.version})")
+
+    # 健康探测
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _probe(self) -> bool:
+        session = self._session
+        start = time.perf_counter()
+        self.stats_counter["probes"] += 1
+        self._last_probe = time.time()
+        try:
+            await asyncio.wait_for(session.send_ping(), PROBE_TIMEOUT_SEC)
+        except Exception as e:
+            self.stats_counter["probe_failures"] += 1
+            if self._session is session:
+                self._disconnect(f"探测失败: {type(e).__name__}")
+            return False
+        self._latencies.append((time.perf_counter() - start) * 1000)
+        return True
+
+    async def _probe_loop(self):
+        backoff = RECONNECT_BACKOFF_SEC[0]
+        while True:
+            try:
+                if self._session is None:
+                    if not await self._connect():
+                        await self._sleep(backoff)
+                        backoff = min(backoff * 2, RECONNECT_BACKOFF_SEC[1])
+                        continue
+                    backoff = RECONNECT_BACKOFF_SEC[0]
+                elif not await self._probe():
+                    continue # 立即重连
+                await self._sleep(PROBE_INTERVAL_SEC)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 探测任务本身不能退出
+                logger.error(f"❌ [MCP] 探测任务异常: {e}")
+                await self._sleep(backoff)
+
+    # ClientSession 接口(供 langchain_mcp_adapters 的工具调用)
+    async def _wait_session(self):
+        if self._session is None:
+            self._wake.set()
+            try:
+                await asyncio.wait_for(self._online.wait(), CALL_WAIT_SEC)
+            except asyncio.TimeoutError:
+                raise ConnectionError(f"MCP 服务暂不可用 ({self.url})") from None
+        return self._session
+
+    async def list_tools(self, cursor: str | None = None):
+        session = await self._wait_session()
+        return await session.list_tools(cursor=cursor)
+
+    async def call_tool(self, name: str, arguments: dict | None = None, **kwargs):
+        self.stats_counter["calls"] += 1
+        call_id = f"{self._call_prefix}-{next(self._call_seq)}"
+        kwargs["meta"] = {**(kwargs.get("meta") or {}), "correlation_id": call_id}
+        for attempt in range(2):
+            session = await self._wait_session()
+            try:
+                return await session.call_tool(name, arguments, **kwargs)
+            except asyncio.CancelledError:
+                # 研究被取消:通知服务端放弃这次调用(尽力而为，不等待结果)
+                self.stats_counter["call_cancelled"] += 1
+                logger.info(f"🛑 [MCP] 调用 {name} 已取消 ({call_id})")
+                task = asyncio.create_task(self._send_cancel(call_id))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+                raise
+            except Exception:
+                # 工具本身的错误会正常返回(isError)；这里抛异常说明可能是连接问题，ping 一下确认
+                if attempt == 0 and self._session is session and not await self._probe():
+                    self.stats_counter["call_retries"] += 1
+                    logger.warning(f"🔁 [MCP] 调用 {name} 时连接断开，重连后重试 ({call_id})")
+                    continue
+                self.stats_counter["call_failures"] += 1
+                logger.warning(f"⚠️ [MCP] 调用 {name} 失败 ({call_id})")
+                raise
+
+    async def _send_cancel(self, call_id: str):
+        """
+        服务端是无状态HTTP，每个请求各自一个会话，协议里的 CancelledNotification 到不了原请求；
+        改为按关联ID调用服务端的取消接口
+        """
+        url = httpx.URL(self.url).copy_with(path=f"/calls/{call_id}/cancel", query=None)
+        try:
+            async with httpx.AsyncClient(timeout=PROBE_TIMEOUT_SEC) as client:
+                await client.post(url)
+        except Exception as e:
+            logger.debug(f"[MCP] 取消请求发送失败 ({call_id}): {e}")
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        latency = {}
+        if latencies:
+            latency = {
+                "last": round(self._latencies[-1], 1),
+                "avg": round(statistics.fmean(latencies), 1),
+                "p50": round(latencies[len(latencies) // 2], 1),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+                "max": round(latencies[-1], 1),
+            }
+        return {
+            **self.stats_counter,
+            "online": self.online,
+            "url": self.url,
+            "tools": [t.name for t in self.tools],
+            "tools_version": self.version,
+            "session_age_s": round(time.monotonic() - self._session_started, 1) if self._session_started else None,
+            "last_probe_age_s": round(time.time() - self._last_probe, 1) if self._last_probe else None,
+            "probe_latency_ms": latency,
+        }
@@ -1,11 +1,20 @@
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
 
 import asyncio
+from functools import wraps
 from loguru import logger
 
+import httpx
 from ddgs import DDGS
-import trafilatura
 from mcp.server.transport_security import TransportSecuritySettings
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from tools.articles import ARTICLE_SEPARATOR, format_article
+from tools.extractor import ExtractionPool
+from tools.fetch_cache import FetchCache
+from tools.http_fetcher import AsyncFetcher
+from tools.search_cache import SearchCache, TIMELIMIT_TTL_SEC
 
 mcp = FastMCP(
     "SearchService",
@@ -23,29 +32,100 @@ mcp = FastMCP(
 
 
 SINGLE_FETCH_TIMEOUT_SEC = 25 # 单URL超时
-BATCH_FETCH_TIMEOUT_SEC = 90 # 批量总超时
-MAX_BATCH_CONCURRENCY = 3 # 批量并发上限
+BATCH_FETCH_TIMEOUT_SEC = 90 # 批量截止时间，只淘汰未完成的页面
+PER_HOST_CONCURRENCY = 4 # 同一域名的并发上限
+MAX_FETCH_CONNECTIONS = 64 # 连接池总连接数上限
+MAX_BODY_BYTES = 5 * 1024 * 1024 # 单页响应体上限，超出截断
+
+EXTRACT_WORKERS = 2 # 正文抽取进程数
+EXTRACT_MAX_PENDING = 16 # 同时提交给抽取进程池的文档上限
+EXTRACT_DOCS_PER_WORKER = 200 # 每个抽取进程处理N篇后回收重建
+EXTRACT_CPU_TIMEOUT_SEC = 10 # 单篇抽取CPU时间上限
+EXTRACT_WALL_TIMEOUT_SEC = 12 # 单篇抽取墙钟上限(不含排队)，要明显小于单URL超时，给下载留出时间；超时会回收卡住的worker
+
+FETCH_CACHE_TTL_SEC = 6 * 3600 # 抓取缓存有效期，过期后走ETag/Last-Modified条件请求
+FETCH_CACHE_MAX_BYTES = 512 * 1024 * 1024 # 抓取缓存磁盘上限，超出按LRU淘汰
+FETCH_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+# 多个研究员子图/多个会话经常抓取同一批热门URL，落盘缓存后重复抓取只需读文件
+fetch_cache = FetchCache("./cache/fetch", ttl_sec=FETCH_CACHE_TTL_SEC, max_bytes=FETCH_CACHE_MAX_BYTES)
+# 异步抓取引擎:共享连接池，替代每个URL一个线程的 trafilatura.fetch_url
+fetcher = AsyncFetcher(
+    FETCH_USER_AGENT,
+    timeout_sec=SINGLE_FETCH_TIMEOUT_SEC,
+    max_connections=MAX_FETCH_CONNECTIONS,
+    per_host_limit=PER_HOST_CONCURRENCY,
+    max_body_bytes=MAX_BODY_BYTES,
+)
+# 正文抽取进程池
+extraction_pool = ExtractionPool(
+    max_workers=EXTRACT_WORKERS,
+    max_pending=EXTRACT_MAX_PENDING,
+    docs_per_worker=EXTRACT_DOCS_PER_WORKER,
+    cpu_timeout_sec=EXTRACT_CPU_TIMEOUT_SEC,
+    wall_timeout_sec=EXTRACT_WALL_TIMEOUT_SEC,
+)
+# 搜索结果缓存(内存级)，有效期随timelimit缩放
+search_cache = SearchCache(max_entries=1000)
+
+# 进行中的工具调用:客户端关联ID -> 执行任务，供 /calls/{id}/cancel 取消
+# 无状态HTTP下每个请求各自一个会话，协议的 CancelledNotification 找不到原请求，只能按关联ID取消
+_inflight_calls: dict[str, asyncio.Task] = {}
 
 
+def _correlation_id() -> str | None:
+    try:
+        meta = mcp.get_context().request_context.meta
+    except (LookupError, ValueError):
+        return None
+    return getattr(meta, "correlation_id", None)
+
+
+def cancellable(fn):
+    """
+    工具在独立任务里执行并按关联ID登记；被客户端取消时返回错误文本，请求本身正常结束
+    工具内部互相调用(batch_fetch -> get_page_content)时直接执行，由最外层登记
+    """
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        call_id = _correlation_id()
+        if not call_id or call_id in _inflight_calls:
+            return await fn(*args, **kwargs)
+        task = asyncio.create_task(fn(*args, **kwargs))
+        _inflight_calls[call_id] = task
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                task.cancel() # 请求本身被取消，停止工具任务
+                raise
+            logger.info(f"🛑 工具调用已被客户端取消 ({call_id})")
+            return "Error: 调用已被客户端取消"
+        finally:
+            _inflight_calls.pop(call_id, None)
+    return wrapper
+
 
 @mcp.tool()
-async def web_search(query:str):
+@cancellable
+async def web_search(query:str, timelimit:str = "y"):
     """
     快速搜索15个摘要文件，内含标题、链接和摘要
+    timelimit: 时间范围 d(一天)/w(一周)/m(一月)/y(一年)，默认一年
     """
     try:
         logger.info(f'🔍 [Async] 正在搜索: {query}')
-        # 确保时效性:最近一个月 | 后续更新可以自由选择需要的时间段
+        if timelimit not in TIMELIMIT_TTL_SEC:
+            timelimit = "y"
 
         # 【核心逻辑】使用同步的 DDGS，但用 to_thread 包装成异步
         # 理由：DDGS 官方库变动频繁，AsyncDDGS 可能不存在，而 to_thread 是 Python 标准库，永远稳定。
         def _sync_search():
             # max_results 建议 10-15
-            # timelimit="y" (过去一年)
-            return list(DDGS().text(query, max_results=15, timelimit="y"))
+            return list(DDGS().text(query, max_results=15, timelimit=timelimit))
 
-        # 扔到线程池跑，不阻塞主线程
-        results = await asyncio.to_thread(_sync_search)
+        # 扔到线程池跑，不阻塞主线程；相同(归一化)查询走缓存，并发的相同查询只打一次上游
+        results = await search_cache.get_or_search(query, timelimit, lambda: asyncio.to_thread(_sync_search))
 
         if not results:
             return "未找到相关结果，请尝试更换关键词。"
@@ -60,26 +140,53 @@ async def web_search(query:str):
         return f'搜索服务暂时不可用: {str(e)}'
 
 
+async def _fetch_page(url: str):
+    """
+    抓取单个URL的正文:缓存 -> (条件)下载 -> 抽取 -> 回写缓存
+    """
+    # 缓存读写是同步sqlite(带锁，正文最大几MB)，放到线程里，不阻塞其他并发抓取
+    cached = await asyncio.to_thread(fetch_cache.get, url)
+    if cached and cached.fresh:
+        logger.info(f"💾 [Cache] 命中抓取缓存: {url}")
+        return cached.text
+
+    # 过期条目带上校验头做条件请求，内容没变服务器只回304
+    try:
+        resp = await fetcher.fetch(
+            url,
+            etag=cached.etag if cached else None,
+            last_modified=cached.last_modified if cached else None,
+        )
+    except httpx.HTTPError:
+        return "Error: 无法访问该页面"
+
+    if resp.status == 304 and cached:
+        await asyncio.to_thread(fetch_cache.mark_revalidated, url, resp.etag, resp.last_modified)
+        logger.info(f"💾 [Cache] 304 未修改，复用缓存: {url}")
+        return cached.text
+    if resp.status != 200 or not resp.body:
+        return "Error: 无法访问该页面"
+
+    # 正文抽取在独立进程池里做，大页面不会拖慢其他会话的抓取
+    downloaded, result = await extraction_pool.extract(resp.body)
+    if not result:
+        return "Error: 无法提取正文内容"
+    # 被截断的页面不缓存，下次仍尝试完整抓取
+    if not resp.truncated:
+        await asyncio.to_thread(fetch_cache.put, url, downloaded, result, resp.etag, resp.last_modified)
+    return result
+
+
 @mcp.tool()
+@cancellable
 async def get_page_content(url: str):
     """
     获取单个url里的全文信息
     """
     logger.info(f'⚡ [Async] 正在抓取: {url}')
-
-    def _fetch():
-        downloaded = trafilatura.fetch_url(url)
-        if not downloaded:
-            return "Error: 无法访问该页面"
-        result = trafilatura.extract(downloaded)
-        return result or "Error: 无法提取正文内容"
-
     try:
         # 单URL超时兜底
-        return await asyncio.wait_for(
-            asyncio.to_thread(_fetch),
-            timeout=SINGLE_FETCH_TIMEOUT_SEC
-        )
+        return await asyncio.wait_for(_fetch_page(url), timeout=SINGLE_FETCH_TIMEOUT_SEC)
     except asyncio.TimeoutError:
         logger.warning(f"⏰ 单URL抓取超时: {url}")
         return f"Error: 抓取超时（>{SINGLE_FETCH_TIMEOUT_SEC}s）: {url}"
@@ -88,30 +195,66 @@ async def get_page_content(url: str):
 
 
 @mcp.tool()
-async def batch_fetch(urls: list[str]):
+@cancellable
+async def batch_fetch(urls: list[str], ctx: Context = None):
     """
     批量获取url里的全文信息(并行)
     如果是批量获取，优先使用该工具
     """
+    urls = list(dict.fromkeys(urls)) # 去重且保序
     logger.info(f'正在批量获取{len(urls)}个URL的全文信息...')
-    sem = asyncio.Semaphore(MAX_BATCH_CONCURRENCY)
-    async def fetch_one(url:str):
-        async with sem:
-            try:
-                return await asyncio.wait_for(
-                    get_page_content(url),
-                    timeout=SINGLE_FETCH_TIMEOUT_SEC
-                )
-            except Exception as e:
-                return f"Error: {url} 抓取失败: {e}"
+    # 不再设全局并发上限:所有URL同时发起，由抓取引擎按域名限流，整批耗时≈最慢的那一页
+    tasks = {asyncio.create_task(get_page_content(url)): url for url in urls}
+    pages = []
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BATCH_FETCH_TIMEOUT_SEC
+    pending = set(tasks)
+    # 按完成顺序逐篇收集:截止时间只淘汰还没回来的页面，已抓到的不再整批作废
     try:
-        results = await asyncio.wait_for(
-            asyncio.gather(*(fetch_one(url) for url in urls)),
-            timeout=BATCH_FETCH_TIMEOUT_SEC
-        )
-    except asyncio.TimeoutError:
-        return "Error: 批量抓取超时，请减少URL数量后重试。"
-    return "\n\n=== 文章分隔线 ===\n\n".join(results)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                url = tasks[task]
+                pages.append(format_article(url, task.result()))
+                if ctx is not None:
+                    # 支持进度通知的客户端可以边抓边看到每一篇的完成情况
+                    await ctx.report_progress(len(pages), len(urls), message=f"已完成: {url}")
+    finally:
+        # 截止或调用方取消时，停止剩余的抓取
+        for task in pending:
+            task.cancel()
+
+    for task in pending:
+        url = tasks[task]
+        logger.warning(f"⏰ 批量截止，放弃未完成的URL: {url}")
+        pages.append(format_article(url, f"Error: 批量抓取截止（>{BATCH_FETCH_TIMEOUT_SEC}s），该页面未完成"))
+    return ARTICLE_SEPARATOR.join(pages)
+
+
+@mcp.custom_route("/calls/{call_id}/cancel", methods=["POST"])
+async def cancel_call(request: Request):
+    """
+    取消进行中的工具调用(客户端研究被取消时调用，按请求 _meta 里的关联ID定位)
+    """
+    task = _inflight_calls.get(request.path_params["call_id"])
+    if task is not None:
+        task.cancel()
+    return JSONResponse({"cancelled": task is not None})
+
+
+@mcp.custom_route("/cache/stats", methods=["GET"])
+async def cache_stats(request: Request):
+    """
+    缓存命中统计(HTTP接口，不注册为MCP工具，避免出现在Agent的工具菜单里)
+    """
+    return JSONResponse({
+        "fetch_cache": fetch_cache.stats(),
+        "search_cache": search_cache.stats(),
+        "extraction": extraction_pool.stats(),
+    })
+
 
 if __name__ == '__main__':
     mcp.run("streamable-http")
\ No newline at end of file
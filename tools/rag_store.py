@@ -1,25 +1,76 @@
+import asyncio
 import os
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-# 导入 Flashrank (Reranker 始终用轻量级本地版)
-from flashrank import Ranker, RerankRequest
 # LangChain 组件
-from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from loguru import logger
 
+from tools.articles import iter_articles
+from tools.chunk_dedup import ChunkDeduplicator
+from tools.corpus import DocumentCorpus, make_doc_id, make_private_doc_id
+from tools.embedding_cache import CachedEmbeddings
+from tools.embedding_dispatcher import EmbeddingDispatcher
+from tools.reranker import RerankBatcher, RerankScoreCache, load_ranker
+from tools.vector_backends import ChromaBackend, MemoryBackend, SessionChromaBackend
 # 导入配置
-from config import USE_LOCAL_EMBEDDING, EMBEDDING_API_KEY, EMBEDDING_BASE_URL, EMBEDDING_MODEL_NAME
-
+from config import USE_LOCAL_EMBEDDING, EMBEDDING_API_KEY, EMBEDDING_BASE_URL, EMBEDDING_MODEL_NAME, \
+    VECTOR_BACKEND, MEMORY_INDEX_HNSW_THRESHOLD, LOCAL_EMBEDDING_ENGINE, LOCAL_EMBEDDING_ONNX_REPO, LOCAL_EMBEDDING_ONNX_FILE
+
+# 云端embedding调度(按硅基流动 bge-m3 的限额配置)
+EMBED_RPS = 30 # 每秒请求数预算
+EMBED_TPM = 500_000 # 每分钟token预算
+EMBED_MAX_CONCURRENCY = 8 # 同时在途请求数上限(遇到429自动减半)
+EMBED_BATCH_TOKENS = 8000 # 单次请求的token上限(按token切批，而不是固定片段数)
+EMBED_BATCH_ITEMS = 64 # 硅基流动限制单次 batch <= 64
+
+# 本地ONNX推理合批
+LOCAL_EMBED_BATCH_TEXTS = 64 # 单次合批的文本条数上限
+LOCAL_EMBED_MAX_WAIT_MS = 10 # 凑批的最长等待
+
+CHROMA_DIR = "./chroma_db"
+DOC_IDLE_TTL_SEC = 3 * 24 * 3600 # 无会话引用的文档闲置超过该时长后回收
+GC_INTERVAL_SEC = 10 * 60 # 回收检查的最小间隔
+COMPACT_INTERVAL_SEC = 3600 # 向量库磁盘回收(清理残留段目录 + VACUUM)的周期，丢弃的会话集合要靠它清掉
+COMPACT_IDLE_WAIT_SEC = 30 # 回收时最多等本进程空闲多久(不拦新请求)
+COMPACT_RETRY_SEC = 5 * 60 # 没等到空闲/别的 worker 正忙时，多久后再试
+
+RAG_QUERY_WORKERS = 4 # 检索线程数(多为等待embedding响应；rerank统一交给微批线程，不会多线程抢CPU)
+RAG_QUERY_MAX_PENDING = 16 # 同时提交到检索线程池的请求上限，超出的在协程里排队
+RERANK_MAX_BATCH_PAIRS = 256 # 单次rerank推理的 (query, passage) 对数上限
+RERANK_MAX_WAIT_MS = 5 # rerank凑批的最长等待
+RERANK_CACHE_SIZE = 50_000 # (问题, 片段) -> 分数 缓存条数
+ADAPTIVE_K_START = 10 # 自适应精排的初始候选数
+
+
+class QueryCancelled(Exception):
+    """异步检索的调用方已取消"""
 
 class RAGStore:
-    def __init__(self):
+    def __init__(self, reranker=None):
+        """
+        reranker: 可传入外部加载的 Ranker(启动时与本对象并行加载)，不传则在这里同步加载
+        """
         logger.info(f"🚀 [Init] 初始化 RAG 系统 | 模式: {'纯本地' if USE_LOCAL_EMBEDDING else '云端API'}")
 
         # Embedding
-        if USE_LOCAL_EMBEDDING:
-            # 【本地模式】加载 HuggingFace 模型 (吃内存，省钱)
+        if USE_LOCAL_EMBEDDING and LOCAL_EMBEDDING_ENGINE == "onnx":
+            # 【本地模式-ONNX】int8量化模型，进程内共享一份，跨请求合批推理
+            from tools.local_embedding import shared_engine
+            logger.info(f"📥 正在加载本地ONNX模型: {LOCAL_EMBEDDING_ONNX_REPO}/{LOCAL_EMBEDDING_ONNX_FILE}...")
+            self.embedding = shared_engine(
+                repo_id=LOCAL_EMBEDDING_ONNX_REPO,
+                model_file=LOCAL_EMBEDDING_ONNX_FILE,
+                max_batch_texts=LOCAL_EMBED_BATCH_TEXTS,
+                max_wait_ms=LOCAL_EMBED_MAX_WAIT_MS,
+            )
+        elif USE_LOCAL_EMBEDDING:
+            # 【本地模式-PyTorch】加载 HuggingFace 模型 (吃内存，省钱)
             from langchain_huggingface import HuggingFaceEmbeddings
             logger.info(f"📥 正在加载本地模型: {EMBEDDING_MODEL_NAME} (请确保显存/内存充足)...")
             self.embedding = HuggingFaceEmbeddings(
@@ -39,8 +90,25 @@ class RAGStore:
                 model=EMBEDDING_MODEL_NAME,
                 openai_api_key=EMBEDDING_API_KEY,
                 openai_api_base=EMBEDDING_BASE_URL,
-                check_embedding_ctx_length=False # 跳过长度检查，避免报错
+                check_embedding_ctx_length=False, # 跳过长度检查，避免报错
+                max_retries=0 # 429交给调度器统一退避，客户端不再各自重试
             )
+            # 按token切批 + 多批并发 + RPS/TPM预算 + 限流退避
+            self.embedding = EmbeddingDispatcher(
+                self.embedding,
+                rps=EMBED_RPS,
+                tpm=EMBED_TPM,
+                max_concurrency=EMBED_MAX_CONCURRENCY,
+                max_batch_tokens=EMBED_BATCH_TOKENS,
+                max_batch_items=EMBED_BATCH_ITEMS,
+            )
+        # 向量缓存:相同片段(同一文章被多个子图抓到/重复会话)不再重复调用Embedding
+        # int8量化模型的向量与原模型有细微差别，缓存分开存
+        cache_namespace = EMBEDDING_MODEL_NAME
+        if USE_LOCAL_EMBEDDING and LOCAL_EMBEDDING_ENGINE == "onnx":
+            cache_namespace = f"{EMBEDDING_MODEL_NAME}:{LOCAL_EMBEDDING_ONNX_REPO}/{LOCAL_EMBEDDING_ONNX_FILE}"
+        self.embedding = CachedEmbeddings(self.embedding, namespace=cache_namespace)
+
         # 切分器
         self.splitter = RecursiveCharacterTextSplitter(
             chunk_size=1200,
@@ -49,53 +117,127 @@ class RAGStore:
             separators=["\n\n", "\n", "。", "！", "？", ".", "!", "?", " "]
         )
 
-        # 向量库
-        self.vector_store = Chroma(
-            persist_directory="./chroma_db",
-            # 选择用该模型来做embedding的工作
-            embedding_function=self.embedding
-        )
+        # 向量库:默认Chroma共享集合；chroma_session为每个会话一个集合；memory为进程内索引(会话短命，省掉SQLite/持久化开销)
+        if VECTOR_BACKEND == "memory":
+            self.backend = MemoryBackend(hnsw_threshold=MEMORY_INDEX_HNSW_THRESHOLD)
+        elif VECTOR_BACKEND == "chroma_session":
+            self.backend = SessionChromaBackend(persist_directory=CHROMA_DIR, embedding=self.embedding)
+        else:
+            self.backend = ChromaBackend(persist_directory=CHROMA_DIR, embedding=self.embedding)
+        logger.info(f"🗄️ [Init] 向量后端: {VECTOR_BACKEND}")
+        # 定期磁盘回收(后台线程，持有向量库排他锁时执行；启动时的那次在后端打开客户端之前已经做过)
+        threading.Thread(target=self._compact_loop, name="rag-compact", daemon=True).start()
         # Reranker:精排序 (Flashrank:为了适应格式，在精排序前后要转换协议)
-        # Flashrank 只有 100MB，4G 服务器完全跑得动，为了逻辑简单，保持本地运行
-        self.reranker = Ranker(
-            model_name="ms-marco-MiniLM-L-12-v2",
-            cache_dir="./models"
-        )
+        self.reranker = reranker if reranker is not None else load_ranker()
+        # 跨请求微批:并发的检索请求在几毫秒窗口内合并成一次推理
+        self.rerank_batcher = RerankBatcher(self.reranker, max_batch_pairs=RERANK_MAX_BATCH_PAIRS, max_wait_ms=RERANK_MAX_WAIT_MS)
+        # 精排分数缓存 + 节省统计(scored:实际推理；cache_hits:缓存命中；skipped:自适应跳过)
+        self.rerank_cache = RerankScoreCache(RERANK_CACHE_SIZE)
+        self.rerank_stats = {"scored": 0, "cache_hits": 0, "skipped": 0}
+
+        # 共享文档登记簿:文档按 URL+内容哈希 去重，会话只持有引用
+        os.makedirs(CHROMA_DIR, exist_ok=True)
+        self.corpus = DocumentCorpus(os.path.join(CHROMA_DIR, "corpus.sqlite"))
+        # 会话内片段去重:同一会话多篇文章里的重复样板/转载段落不再送去Embedding
+        self.chunk_dedup = ChunkDeduplicator()
+        self._last_gc = 0.0
+
+        # 检索专用线程池(限定大小)，异步检索不再和其他阻塞任务抢默认线程池
+        self._query_executor = ThreadPoolExecutor(max_workers=RAG_QUERY_WORKERS, thread_name_prefix="rag-query")
+        self._query_slots = asyncio.Semaphore(RAG_QUERY_MAX_PENDING)
 
         logger.info("✅ [Init] RAG 系统就绪")
 
     # RAG - 离线模块(加载与切块/向量化/存入向量数据库)
-    def add_documents(self, text_content: str, source_url: str = "",session_id : str = None):
+    def split_documents(self, text_content: str, source_url: str = "", doc_id: str = None):
         """
-        存入向量数据库 (自动分批处理)
-        text_content:需要存储的原始文本内容
-        source_url:文本的来源标识，用于后续检索时展示出处 (方便AI标识精确来源，比如url)
+        切片:把原始文本切成带元数据的 Document 片段，内容过短返回空列表
         """
         if not text_content or len(text_content) < 50:
             logger.warning("⚠️ 内容过短，跳过入库")
-            return False
+            return []
 
         # 封装 Document(Document是langchain固定接收的对象格式) metadata则指明具体身份
         # 注:后续我们会不断沿用这个数据结构，可以理解为数据库反复读写查询，但其参数没变
-        raw_doc = Document(page_content=text_content, metadata={"source": source_url,"session_id":session_id})
-        # 切片
+        # 片段不再归属某个会话，而是归属共享文档(doc_id)，会话通过 corpus 引用文档
+        raw_doc = Document(page_content=text_content, metadata={"source": source_url,"doc_id":doc_id})
         chunks = self.splitter.split_documents([raw_doc])
+        # 确定性ID:同一文档重复写入时是覆盖而不是追加
+        for i, chunk in enumerate(chunks):
+            chunk.id = f"{doc_id}:{i}"
+        return chunks
 
-        # --- 分批入库 ---
-        # 硅基流动限制单次 batch <= 64，我们设为 50 比较安全
-        batch_size = 50
-        total_chunks = len(chunks)
+    def dedup_chunks(self, chunks, session_id: str):
+        """
+        丢掉该会话已入库过的重复/近似重复片段，返回 (保留的片段, doc_id, 指纹)
+        有片段被丢掉时文档不完整:保留的片段改挂到会话私有的 doc_id 下(登记为不共享)，
+        共享 doc_id 留给完整入库，别的会话 attach 时不会拿到缺了内容的文档
+        指纹在写入成功后由 remember_chunks 记录
+        """
+        doc_id = chunks[0].metadata["doc_id"] if chunks else None
+        kept, marks = self.chunk_dedup.filter(chunks, session_id)
+        if kept and len(kept) < len(chunks):
+            logger.info(f"✂️ [Dedup] 丢弃 {len(chunks) - len(kept)}/{len(chunks)} 个重复片段，文档仅本会话可见")
+            doc_id = make_private_doc_id(doc_id, session_id)
+            for chunk in kept:
+                chunk.metadata["doc_id"] = doc_id
+                chunk.id = f"{doc_id}:{chunk.id.rsplit(':', 1)[1]}"
+        elif not kept:
+            logger.info(f"✂️ [Dedup] 整篇 {len(chunks)} 个片段均与本会话已入库内容重复")
+        return kept, doc_id, marks
+
+    def remember_chunks(self, marks, session_id: str):
+        self.chunk_dedup.remember(marks, session_id)
+
+    def attach_document(self, doc_id: str, session_id: str) -> bool:
+        """
+        共享库里已有该文档(同URL同内容)时，直接给会话挂引用，跳过切分和向量化
+        登记簿有记录但向量已不在后端(如内存后端重启/淘汰、按会话分区时在别的会话集合里)时视为不存在，重新入库
+        """
+        if not self.backend.has_doc(doc_id, session_id):
+            return False
+        return self.corpus.attach(doc_id, session_id)
 
-        for i in range(0, total_chunks, batch_size):
-            batch = chunks[i: i + batch_size]
-            # 调用向量库内置方法:将这一批次(50个)文本片段发送给 Embedding模型进行向量化，再将生成的向量连同原始文本、元数据一同持久化存储到本地Chroma数据库中
-            # 简单讲，此处囊括了 文本向量化+存入向量数据库 两步
-            # 注意:在此步前，我们的batch一直都还是非向量形态
-            self.vector_store.add_documents(batch)
-            logger.info(f"💾 [Store] 分批入库: {len(batch)} 个片段 ({i + len(batch)}/{total_chunks})")
+    def register_document(self, doc_id: str, source_url: str, chunk_count: int, session_id: str, shared: bool = True):
+        self.corpus.register(doc_id, source_url, chunk_count, session_id, shared)
 
-        logger.info(f"✅ [Store] 全部入库完成 (共 {total_chunks} 个片段 | 来源: {source_url})")
-        return True
+    def add_chunks(self, chunks, session_id: str = None):
+        """
+        入库:向量化 + 写入向量后端 (阻塞调用，异步场景由 IngestPipeline 丢到线程里执行)
+        """
+        # 将整篇文档的片段交给 Embedding(先查缓存，未命中的由调度器按token切批并发请求)，再将向量连同原始文本、元数据一同写入向量后端
+        # 注意:在此步前，我们的chunks一直都还是非向量形态
+        vectors = self.embedding.embed_documents([chunk.page_content for chunk in chunks])
+        self.backend.add(chunks, vectors, session_id)
+        logger.info(f"💾 [Store] 入库: {len(chunks)} 个片段")
+
+    def add_documents(self, text_content: str, source_url: str = "",session_id : str = None):
+        """
+        存入向量数据库 (同步版本，自动分批处理；服务端请使用 IngestPipeline)
+        text_content:需要存储的原始文本内容(batch_fetch 的多篇拼接结果会按分隔线拆成单篇，各自标注来源)
+        source_url:文本的来源标识，用于后续检索时展示出处 (方便AI标识精确来源，比如url)
+        """
+        stored = False
+        for url, article in iter_articles(text_content, source_url):
+            doc_id = make_doc_id(article, url)
+            if self.attach_document(doc_id, session_id):
+                logger.info(f"♻️ [Store] 共享库已有该文档，直接引用 (来源: {url})")
+                stored = True
+                continue
+
+            chunks = self.split_documents(article, url, doc_id)
+            if not chunks:
+                continue
+            stored = True
+            kept, kept_doc_id, marks = self.dedup_chunks(chunks, session_id)
+            if not kept:
+                continue # 内容已被本会话其他文档覆盖
+
+            self.add_chunks(kept, session_id)
+            self.register_document(kept_doc_id, url, len(kept), session_id, shared=kept_doc_id == doc_id)
+            self.remember_chunks(marks, session_id)
+            logger.info(f"✅ [Store] 全部入库完成 (共 {len(kept)} 个片段 | 来源: {url})")
+        return stored
 
     # RAG - 在线模块(粗排/精排/过滤)
     def query(self, question: str,session_id:str, k_retrieve=50, k_final=6, score_threshold=0.6):
@@ -109,54 +251,182 @@ class RAGStore:
         k_final:精排个数;
         score_threshold:得分阈值/低于此抛弃
         """
-        # Phase 1: 粗排
-        logger.info(f"🔍 [Search] 向量检索 Top-{k_retrieve}...")
-        # 这个doc与前面的Document(xx)指向同一个参数(page_content,metadata)封装，是因为二者(Chroma/langchain-langchain_chroma)已经互相集成好,所以可以直接调用
-        docs = self.vector_store.similarity_search(question, k=k_retrieve,filter={"session_id":session_id}) # filter作为检索条件
+        return self.query_many([question], session_id, k_retrieve, k_final, score_threshold)[0]
 
-        if not docs:
-            logger.warning("⚠️ 未找到相关文档")
+    def query_many(self, questions: list[str], session_id: str, k_retrieve=50, k_final=6, score_threshold=0.6,
+                   adaptive=True, cancel_event: threading.Event = None):
+        """
+        批量检索:多个问题一次性完成 向量化 -> 粗排 -> 精排，返回与 questions 一一对应的结果列表
+        writer 的多个课题不再各自串行跑一遍 embedding/检索/rerank
+        adaptive:精排候选从 ADAPTIVE_K_START 起步，只有新增的一段里仍有过阈值的片段时才继续翻倍
+        cancel_event:被置位时在阶段之间提前退出(异步调用方已取消，没必要再跑完)
+        """
+        if not questions:
             return []
+        empty = [[] for _ in questions]
+
+        def check_cancelled():
+            if cancel_event is not None and cancel_event.is_set():
+                raise QueryCancelled()
+
+        # 只在该会话引用的文档范围内检索
+        doc_ids = self.corpus.session_doc_ids(session_id)
+        if not doc_ids:
+            logger.warning("⚠️ 当前会话尚无入库文档")
+            return empty
+
+        # Phase 1: 粗排 - 所有问题一次embedding请求，一次向量后端批量查询
+        logger.info(f"🔍 [Search] 向量检索 {len(questions)} 个问题 x Top-{k_retrieve}...")
+        vectors = self.embedding.embed_documents(questions)
+        check_cancelled()
+        hits = self.backend.search(vectors, k_retrieve, doc_ids, session_id)
+
+        # 多个课题召回的相同片段只保留一份
+        chunks = {}
+        candidates = []
+        for rows in hits:
+            for chunk_id, text, meta in rows:
+                chunks.setdefault(chunk_id, (text, meta))
+            candidates.append([chunk_id for chunk_id, _, _ in rows])
+
+        if not chunks:
+            logger.warning("⚠️ 未找到相关文档")
+            return empty
 
-        # Phase 2: 精排
-        logger.info(f"⚡️ [Rerank] Flashrank 重排序...")
-        # 把数据封装成FlashRank接受的格式(doc.page_content是原始文本内容;doc.metadata是档案来源：比如你可以指定为last_msg.tool_call_id)
-        # FlashRank是针对精排序的。所以这里在数据传过去与传回来都需要调整格式。
-        passages = []
-        for i,doc in enumerate(docs):
-            passages.append({"id": str(i), "text": doc.page_content, "meta": doc.metadata}) # 调用add_documents里的参数
-
-        # 把LangChain的Document列表转换为FlashRank理解的passages列表
-        rerank_request = RerankRequest(query=question, passages=passages)
-        # 将数据喂给精排模型，并返回一个打分列表
-        results = self.reranker.rerank(rerank_request)
+        check_cancelled()
+        # Phase 2: 精排 - 所有问题的 (问题, 片段) 组合合并推理；命中分数缓存的跳过，候选数按需增长
+        logger.info(f"⚡️ [Rerank] Flashrank 批量重排序 (去重后片段 {len(chunks)} 个)...")
+        all_scores = self._rerank(questions, candidates, chunks, score_threshold, adaptive, check_cancelled)
 
         # Phase 3: 过滤
-        final_docs = []
-        score = []
-        # 必须得分超过0.3才能返回
-        for res in results:
-            if res['score'] >= score_threshold:
-                # 将FlashRank返回的py字典转化为LangChain接受的Document对象
-                doc = Document(page_content=res['text'], metadata=res['meta'])
-                doc.metadata['rerank_score'] = res['score']
-                score.append(res['score'])
-                final_docs.append(doc)
-            if len(final_docs) >= k_final:
+        results = []
+        for scores in all_scores:
+            scored = sorted(((score, cid) for cid, score in scores.items()), reverse=True)
+            final_docs = []
+            for score, cid in scored:
+                # 必须得分超过阈值才能返回
+                if score < score_threshold or len(final_docs) >= k_final:
+                    break
+                text, meta = chunks[cid]
+                # 转化为LangChain接受的Document对象(拷贝metadata，共享片段在不同问题下得分不同)
+                final_docs.append(Document(page_content=text, metadata={**meta, "rerank_score": score}))
+            results.append(final_docs)
+
+        logger.info(f"✅ [Result] 各问题返回高分结果数: {[len(r) for r in results]}")
+        return results
+
+    def _rerank(self, questions, candidates, chunks, score_threshold, adaptive, check_cancelled):
+        """
+        返回每个问题的 {片段ID: 分数}。candidates 为按向量相似度排好序的片段ID
+        """
+        all_scores = [{} for _ in questions]
+        covered = [0] * len(questions)  # 每个问题已精排的候选前缀长度
+        targets = [min(len(ids), ADAPTIVE_K_START) if adaptive else len(ids) for ids in candidates]
+        model_calls = [0] * len(questions)
+
+        while True:
+            # 本轮各问题新增的候选窗口
+            windows = {qi: candidates[qi][covered[qi]:targets[qi]] for qi in range(len(questions)) if targets[qi] > covered[qi]}
+            if not windows:
                 break
-
-        logger.info(f"✅ [Result] 返回 {len(final_docs)} 个高分结果 | 打分结果:{score}")
-        return final_docs
+            check_cancelled()
+            keys = [(questions[qi], cid) for qi, ids in windows.items() for cid in ids]
+            cached = self.rerank_cache.get_many(keys)
+            missing = list(dict.fromkeys(k for k in keys if k not in cached))
+            fresh = dict(zip(missing, self.rerank_batcher.score([(q, chunks[cid][0]) for q, cid in missing])))
+            self.rerank_cache.put_many(fresh)
+            scores = {**cached, **fresh}
+            self.rerank_stats["cache_hits"] += len(keys) - len(missing)
+            self.rerank_stats["scored"] += len(missing)
+
+            for qi, ids in windows.items():
+                window_scores = [scores[(questions[qi], cid)] for cid in ids]
+                all_scores[qi].update(zip(ids, window_scores))
+                model_calls[qi] += sum(1 for cid in ids if (questions[qi], cid) in fresh)
+                covered[qi] = targets[qi]
+                # 新增的一段里还有过阈值的片段，说明更靠后的候选可能也有价值，继续翻倍
+                if adaptive and any(s >= score_threshold for s in window_scores):
+                    targets[qi] = min(len(candidates[qi]), targets[qi] * 2)
+
+        for qi, ids in enumerate(candidates):
+            saved = len(ids) - model_calls[qi]
+            self.rerank_stats["skipped"] += len(ids) - covered[qi]
+            logger.info(f"💡 [Rerank] 问题#{qi + 1} 精排 {covered[qi]}/{len(ids)} 个候选，"
+                        f"实际推理 {model_calls[qi]} 对，节省 {saved} 次推理")
+        return all_scores
+
+    async def aquery_many(self, questions: list[str], session_id: str, **kwargs):
+        """
+        异步检索:embedding请求/向量检索/ONNX推理都在专用线程池里跑，不占用事件循环
+        调用方被取消(如客户端断开)时，尚未开始的检索直接丢弃，进行中的在下个阶段退出
+        """
+        cancel_event = threading.Event()
+        async with self._query_slots:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(
+                    self._query_executor,
+                    partial(self.query_many, questions, session_id, cancel_event=cancel_event, **kwargs)
+                )
+            except asyncio.CancelledError:
+                cancel_event.set()
+                logger.warning(f"🛑 [Search] 检索已取消 | Session: {session_id}")
+                raise
+
+    async def aquery(self, question: str, session_id: str, **kwargs):
+        return (await self.aquery_many([question], session_id, **kwargs))[0]
 
     def clear_session(self,session_id):
         """
-        任务完成时，清空该用户的RAG数据（临时RAG）
+        任务完成时，释放该用户对共享文档的引用；文档本身保留，供后续同主题会话直接复用
+        按会话分区时，该会话的集合整体删除
         """
         try:
-            self.vector_store.delete(where={"session_id":session_id}) # 选中该session_id对应的数据并删除
-            logger.success(f"🧹 [Clear] 已清空用户({session_id}) 的临时 RAG 数据")
+            released = self.corpus.release_session(session_id)
+            self.backend.drop_session(session_id)
+            self.chunk_dedup.release(session_id)
+            logger.success(f"🧹 [Clear] 已释放用户({session_id}) 的 {released} 个文档引用")
         except Exception as e:
             logger.error(f"❌ 清库失败: {e}")
+        self.collect_garbage()
+
+    def collect_garbage(self):
+        """
+        回收无人引用且闲置超过 DOC_IDLE_TTL_SEC 的文档(节流:每 GC_INTERVAL_SEC 最多一次)
+        """
+        now = time.time()
+        if now - self._last_gc < GC_INTERVAL_SEC:
+            return
+        self._last_gc = now
+        try:
+            doc_ids = self.corpus.collect_garbage(DOC_IDLE_TTL_SEC, self.backend.delete_docs)
+            if doc_ids:
+                logger.success(f"🧹 [GC] 已回收 {len(doc_ids)} 个闲置文档")
+        except Exception as e:
+            logger.error(f"❌ 文档回收失败: {e}")
+
+    def _compact_loop(self):
+        delay = COMPACT_INTERVAL_SEC
+        while True:
+            time.sleep(delay)
+            delay = COMPACT_INTERVAL_SEC if self.compact() else COMPACT_RETRY_SEC
+
+    def compact(self) -> bool:
+        """
+        磁盘回收:删除/丢弃集合后持久化目录只增不减，清理残留段目录并 VACUUM
+        由后端在排他锁下执行(本进程与其他 worker 都没有进行中的读写)，拿不到锁返回 False
+        """
+        try:
+            report = self.backend.compact(wait_sec=COMPACT_IDLE_WAIT_SEC)
+        except Exception as e:
+            logger.error(f"❌ 向量库磁盘回收失败: {e}")
+            return True # 出错不频繁重试，等下个周期
+        if report is None:
+            logger.info("⏳ [Compact] 向量库正忙，稍后再做磁盘回收")
+            return False
+        if report:
+            logger.success(f"🧹 [Compact] 向量库磁盘回收完成: {report}")
+        return True
 
 
     # RAG检索返回逻辑
@@ -164,9 +434,22 @@ class RAGStore:
         """
         直接返回格式化好的字符串，给Tool和Writer用
         """
+        return self.format_results(self.query(query,session_id))
+
+    def query_many_formatted(self, queries: list[str], session_id: str):
+        """
+        批量版 query_formatted，返回与 queries 一一对应的字符串
+        """
+        return [self.format_results(docs) for docs in self.query_many(queries, session_id)]
+
+    async def aquery_formatted(self, query: str, session_id: str):
+        return self.format_results(await self.aquery(query, session_id))
 
-        results = self.query(query,session_id)
+    async def aquery_many_formatted(self, queries: list[str], session_id: str):
+        return [self.format_results(docs) for docs in await self.aquery_many(queries, session_id)]
 
+    @staticmethod
+    def format_results(results):
         if not results:
             return "知识库中未找到相关内容。"
 
@@ -182,8 +465,8 @@ class RAGStore:
 # --- 测试代码 ---
 if __name__ == "__main__":
     # 清理旧库测试
-    if os.path.exists("./chroma_db"):
-        shutil.rmtree("./chroma_db")
+    if os.path.exists(CHROMA_DIR):
+        shutil.rmtree(CHROMA_DIR)
 
     rag = RAGStore()
 
@@ -2,13 +2,33 @@ import os
 
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
-from langchain_mcp_adapters.client import MultiServerMCPClient
 from loguru import logger
 
 
-from tools.rag_store import RAGStore
+from tools.ingest_pipeline import IngestPipeline
+from tools.mcp_pool import McpToolPool
+from tools.startup import LazyComponent
 
-global_rag_store = RAGStore()
+MCP_SERVER_NAME = "搜索服务"
+MCP_INITIAL_WAIT_SEC = 5 # 构建图时最多等待MCP首次连接的时长，连不上也不阻塞，之后由后台探测自动接入
+
+
+def _load_reranker():
+    from tools.reranker import load_ranker
+    return load_ranker()
+
+
+def _load_rag_store():
+    # 向量库/Embedding 与 Reranker 模型并行加载；RAGStore 只持有 Reranker 的代理，首次精排时才需要它就绪
+    from tools.rag_store import RAGStore
+    return RAGStore(reranker=global_reranker)
+
+
+# 导入本模块不做任何重初始化(HTTP服务先起来)；lifespan 里 start() 后台并行加载，首次使用时未就绪则等待
+global_reranker = LazyComponent("reranker", _load_reranker)
+global_rag_store = LazyComponent("rag_store", _load_rag_store)
+# 异步入库流水线(core_node投递，writer_node等待)
+global_ingest_pipeline = IngestPipeline(global_rag_store)
 
 # 全局服务状态
 SERVICE_STATUS = {
@@ -17,42 +37,61 @@ SERVICE_STATUS = {
 }
 
 
+def _on_mcp_status(online: bool):
+    # 记录MCP连接状态(由连接池在连上/断开时回调)
+    SERVICE_STATUS["mcp_online"] = online
+
+
+# 动态地址获取 docker环境会自动注入MCP_HOST
+global_mcp_pool = McpToolPool(
+    f"http://{os.getenv('MCP_HOST','127.0.0.1')}:8003/mcp",
+    MCP_SERVER_NAME,
+    on_status=_on_mcp_status,
+)
+
+
 # 定义 RAG 检索工具 (给 Agent 查库用)
 @tool
-def search_knowledge_base(query: str,config:RunnableConfig): # 声明使用RunnableConfig来提取我们最初定义的thread_id
+async def search_knowledge_base(query: str,config:RunnableConfig): # 声明使用RunnableConfig来提取我们最初定义的thread_id
     """
     当系统提示'资料已存入知识库'时，或者需要回答基于事实的问题时，
     必须调用此工具从本地知识库(RAG)中检索。
     """
     session_id = config.get("configurable",{}).get("thread_id","default_session")
     logger.info(f"📚 Agent 正在查询知识库: {query} | Session_ID: {session_id}")
-    return global_rag_store.query_formatted(query,session_id)
+    # 异步检索:不阻塞事件循环，会话取消时检索随之取消
+    rag_store = await global_rag_store.aget()
+    return await rag_store.aquery_formatted(query,session_id)
+
+
+class Toolbox:
+    """
+    研究员子图的工具集:MCP工具(随连接池热更新) + RAG检索工具
+    图只编译一次:surfer 每次取当前工具绑定给模型；tools 节点按工具列表版本缓存 ToolNode，MCP重连/工具变化后自动换用
+    """
+
+    def __init__(self, pool: McpToolPool, local_tools: list):
+        self.pool = pool
+        self.local_tools = local_tools
+        self._node = None
+        self._node_version = -1
+
+    def tools(self) -> list:
+        return self.pool.tools + self.local_tools
+
+    async def run(self, state, config: RunnableConfig):
+        if self._node is None or self._node_version != self.pool.version:
+            from langgraph.prebuilt import ToolNode
+            self._node = ToolNode(self.tools())
+            self._node_version = self.pool.version
+        return await self._node.ainvoke(state, config)
+
 
 # 加载所有工具
-async def load_all_tools():
+async def load_toolbox() -> Toolbox:
     """
-    初始化并返回所有可用工具列表(MCP+RAG)
+    启动MCP连接池(后台探测/重连)，返回工具集(MCP+RAG)
     """
-    # 动态地址获取 docker环境会自动注入MCP_HOST
-    mcp_host = os.getenv("MCP_HOST","127.0.0.1") #
-    mcp_url = f"http://{mcp_host}:8003/mcp"
-
-    mcp_config = {
-        "搜索服务": {
-            "transport": "http",
-            "url": mcp_url,
-        }
-    }
-    logger.info("🔌 正在连接 MCP 服务器...")
-    try:
-        client = MultiServerMCPClient(mcp_config)
-        mcp_tools = await client.get_tools()
-        logger.success(f"✅ MCP 工具加载成功: {[t.name for t in mcp_tools]}")
-        # 记录成功状态
-        SERVICE_STATUS["mcp_online"] = True
-    except Exception as e:
-        logger.error(f"❌ MCP 连接失败: {e}")
-        mcp_tools = []
-        # 记录失败状态
-        SERVICE_STATUS["mcp_online"] = False
-    return mcp_tools + [search_knowledge_base]
\ No newline at end of file
+    logger.info(f"🔌 正在连接 MCP 服务器 {global_mcp_pool.url} ...")
+    await global_mcp_pool.start(wait_sec=MCP_INITIAL_WAIT_SEC)
+    return Toolbox(global_mcp_pool, [search_knowledge_base])
@@ -0,0 +1,177 @@
+# FlashRank 批量打分:把多组 (query, passage) 拼进同一次 ONNX 推理
+# FlashRank 的 rerank 一次只接受一个 query；这里直接复用它的 tokenizer 和 onnx session
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from flashrank import Ranker, RerankRequest
+
+
+def load_ranker() -> Ranker:
+    """
+    加载 FlashRank 模型(首次会下载到 ./models)
+    Flashrank 只有 100MB，4G 服务器完全跑得动，为了逻辑简单，保持本地运行
+    """
+    return Ranker(model_name="ms-marco-MiniLM-L-12-v2", cache_dir="./models")
+
+
+def score_pairs(ranker: Ranker, pairs: list[tuple[str, str]]) -> list[float]:
+    """
+    对任意多组 (query, passage) 打分，返回与输入等长的分数列表(0~1)
+    """
+    if not pairs:
+        return []
+    # 依赖 FlashRank==0.2.10 的内部结构；取不到时退回逐条rerank，结果一致只是慢一些
+    if not (hasattr(ranker, "tokenizer") and hasattr(ranker, "session")) or getattr(ranker, "llm_model", None):
+        return _score_pairs_fallback(ranker, pairs)
+
+    encoded = ranker.tokenizer.encode_batch([[q, p] for q, p in pairs])
+    input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+    attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+    token_type_ids = np.array([e.type_ids for e in encoded], dtype=np.int64)
+
+    onnx_input = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if not np.all(token_type_ids == 0):
+        onnx_input["token_type_ids"] = token_type_ids
+
+    logits = ranker.session.run(None, onnx_input)[0]
+    # 与 FlashRank 相同的归一化:单输出走sigmoid，双输出取正类softmax
+    if logits.shape[1] == 1:
+        scores = 1 / (1 + np.exp(-logits.flatten()))
+    else:
+        exp_logits = np.exp(logits)
+        scores = exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+    return [float(s) for s in scores]
+
+
+def _score_pairs_fallback(ranker: Ranker, pairs: list[tuple[str, str]]) -> list[float]:
+    # 按query分组后逐组调用官方rerank
+    groups: dict[str, list[int]] = {}
+    for i, (q, _) in enumerate(pairs):
+        groups.setdefault(q, []).append(i)
+    scores = [0.0] * len(pairs)
+    for q, idxs in groups.items():
+        passages = [{"id": str(i), "text": pairs[i][1]} for i in idxs]
+        for res in ranker.rerank(RerankRequest(query=q, passages=passages)):
+            scores[int(res["id"])] = float(res["score"])
+    return scores
+
+
+class _RerankJob:
+    __slots__ = ("pairs", "future")
+
+    def __init__(self, pairs: list[tuple[str, str]]):
+        self.pairs = pairs
+        self.future: Future = Future()
+
+
+class RerankBatcher:
+    """
+    跨请求的rerank微批调度:多个会话/课题同时检索时，在 max_wait_ms 内到达的请求合并成一次ONNX推理
+    - max_batch_pairs: 单次推理的 (query, passage) 对数上限(单个请求超过上限时独立成批)
+    - max_wait_ms: 第一个请求到达后最多再等多久凑批
+    所有推理都在同一个后台线程里串行执行，ONNX自身的多线程吃满CPU，不再多个小推理互相抢核
+    """
+
+    def __init__(self, ranker: Ranker, max_batch_pairs: int = 256, max_wait_ms: float = 5):
+        self.ranker = ranker
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait_sec = max_wait_ms / 1000
+        self._queue: queue.Queue[_RerankJob] = queue.Queue()
+        self._carry: _RerankJob | None = None  # 上一批放不下的请求，下一批优先处理
+        self.stats_counter = {"requests": 0, "batches": 0, "pairs": 0}
+        self._thread = threading.Thread(target=self._loop, name="rerank-batcher", daemon=True)
+        self._thread.start()
+
+    def score(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """
+        (阻塞) 提交一组 (query, passage) 并等待打分结果，可在任意线程调用
+        """
+        if not pairs:
+            return []
+        job = _RerankJob(pairs)
+        self._queue.put(job)
+        return job.future.result()
+
+    def _collect(self) -> list[_RerankJob]:
+        first, self._carry = self._carry, None
+        jobs = [first or self._queue.get()]
+        size = len(jobs[0].pairs)
+        deadline = time.monotonic() + self.max_wait_sec
+        while size < self.max_batch_pairs:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(job.pairs) > self.max_batch_pairs:
+                # 放不下就留到下一批的开头
+                self._carry = job
+                break
+            jobs.append(job)
+            size += len(job.pairs)
+        return jobs
+
+    def _loop(self):
+        while True:
+            jobs = self._collect()
+            pairs = [p for job in jobs for p in job.pairs]
+            try:
+                scores = score_pairs(self.ranker, pairs)
+            except Exception as e:
+                for job in jobs:
+                    job.future.set_exception(e)
+                continue
+            offset = 0
+            for job in jobs:
+                job.future.set_result(scores[offset: offset + len(job.pairs)])
+                offset += len(job.pairs)
+            self.stats_counter["requests"] += len(jobs)
+            self.stats_counter["batches"] += 1
+            self.stats_counter["pairs"] += len(pairs)
+
+    def stats(self) -> dict:
+        batches = self.stats_counter["batches"]
+        return {
+            **self.stats_counter,
+            "avg_requests_per_batch": round(self.stats_counter["requests"] / batches, 2) if batches else 0.0,
+            "avg_pairs_per_batch": round(self.stats_counter["pairs"] / batches, 1) if batches else 0.0,
+        }
+
+
+class RerankScoreCache:
+    """
+    (query, chunk_id) -> rerank分数 的LRU缓存
+    writer 经常重复研究员用 search_knowledge_base 问过的问题；片段ID是确定性的(doc_id:序号)，跨会话也有效
+    """
+
+    def __init__(self, max_entries: int = 50_000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list[tuple[str, str]]) -> dict[tuple[str, str], float]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                score = self._entries.get(key)
+                if score is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = score
+        return found
+
+    def put_many(self, items: dict[tuple[str, str], float]):
+        with self._lock:
+            self._entries.update(items)
+            for key in items:
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,99 @@
+# 搜索结果缓存 + 同查询合并(single-flight)
+# Planner拆出的任务经常重叠，Leader重试也会反复发出几乎一样的查询，没必要每次都打到DDGS
+import asyncio
+import time
+import unicodedata
+from collections import OrderedDict
+
+from loguru import logger
+
+# 缓存有效期随 timelimit 缩放:时间窗越短，结果越"新鲜"，缓存也应越短
+TIMELIMIT_TTL_SEC = {
+    "d": 10 * 60,
+    "w": 60 * 60,
+    "m": 6 * 3600,
+    "y": 24 * 3600,
+}
+DEFAULT_TTL_SEC = 10 * 60
+
+
+def normalize_query(query: str) -> str:
+    """
+    查询归一化:全角转半角、统一大小写、合并空白
+    标点/词序/引号/排除词(-term)都保留:"C++ 教程" 和 "C# 教程" 是不同的查询
+    "DeepSeek 融资" / "ＤｅｅｐＳｅｅｋ  融资" 视为同一查询
+    """
+    q = unicodedata.normalize("NFKC", query).casefold()
+    return " ".join(q.split())
+
+
+class SearchCache:
+    """
+    进程内LRU缓存，key = (归一化查询, timelimit)
+    get_or_search: 命中直接返回；未命中时，同一key的并发请求共享同一次上游调用
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()  # key -> (过期时间, 结果)
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.stats_counter = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def _get(self, key: tuple):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key: tuple, value, ttl: float):
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_search(self, query: str, timelimit: str, search_fn):
+        """
+        search_fn: 无参协程函数，真正发起上游搜索
+        结果为空时不缓存(可能是临时限流)，异常直接透传给所有等待者
+        """
+        key = (normalize_query(query), timelimit)
+        cached = self._get(key)
+        if cached is not None:
+            self.stats_counter["hits"] += 1
+            logger.info(f"💾 [SearchCache] 命中缓存: {query}")
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats_counter["coalesced"] += 1
+            logger.info(f"🔗 [SearchCache] 合并到进行中的相同查询: {query}")
+        else:
+            self.stats_counter["misses"] += 1
+            # 上游调用放进独立Task:发起者被取消时，其他等待者仍能拿到结果
+            task = asyncio.create_task(self._run(key, timelimit, search_fn))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # 无人等待时也取走异常，避免告警
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _run(self, key: tuple, timelimit: str, search_fn):
+        try:
+            result = await search_fn()
+            if result:
+                self._put(key, result, TIMELIMIT_TTL_SEC.get(timelimit, DEFAULT_TTL_SEC))
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.stats_counter["hits"] + self.stats_counter["misses"] + self.stats_counter["coalesced"]
+        saved = self.stats_counter["hits"] + self.stats_counter["coalesced"]
+        return {
+            **self.stats_counter,
+            "hit_rate": round(saved / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,158 @@
+# 启动编排:重组件(向量库/Embedding/Reranker/图编译+MCP工具)在后台并行初始化，HTTP服务先起来
+# /service/status 按组件报告就绪状态；使用方首次访问时若组件还没就绪则等待
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+# name -> 组件，供 /service/status 汇总
+COMPONENTS: dict[str, "_Component"] = {}
+
+
+class _Component:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "pending" # pending / loading / ready / failed
+        self.error: str | None = None
+        self._t0: float | None = None
+        self._elapsed: float | None = None
+        COMPONENTS[name] = self
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def _begin(self):
+        self.state = "loading"
+        self._t0 = time.perf_counter()
+        logger.info(f"⏳ [Startup] {self.name} 开始初始化")
+
+    def _finish(self, error: BaseException | None = None):
+        self._elapsed = time.perf_counter() - self._t0
+        if error is None:
+            self.state = "ready"
+            logger.success(f"✅ [Startup] {self.name} 就绪 ({self._elapsed:.2f}s)")
+        else:
+            self.state = "failed"
+            self.error = f"{type(error).__name__}: {error}"
+            logger.error(f"❌ [Startup] {self.name} 初始化失败 ({self._elapsed:.2f}s): {self.error}")
+
+    def status(self) -> dict:
+        elapsed = self._elapsed
+        if elapsed is None and self._t0 is not None:
+            elapsed = time.perf_counter() - self._t0
+        return {
+            "state": self.state,
+            "seconds": round(elapsed, 2) if elapsed is not None else None,
+            "error": self.error,
+        }
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class LazyComponent(_Component):
+    """
+    在后台线程里构造的组件(同步工厂函数，如加载模型/打开数据库)
+    - start(): 开始后台初始化(可重复调用)
+    - 代理属性访问:global_x.method(...) 会等到组件就绪后转发给真实对象；初始化失败则抛出原异常
+    - 在事件循环里应先 await aget()，避免属性访问时阻塞循环
+    """
+
+    def __init__(self, name: str, factory: Callable[[], object]):
+        super().__init__(name)
+        self._factory = factory
+        self._future: Future = Future()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> "LazyComponent":
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+        threading.Thread(target=self._load, name=f"init-{self.name}", daemon=True).start()
+        return self
+
+    def _load(self):
+        self._begin()
+        try:
+            obj = self._factory()
+        except BaseException as e:
+            self._finish(e)
+            self._future.set_exception(e)
+        else:
+            self._finish()
+            self._future.set_result(obj)
+
+    def get(self, timeout: float | None = None):
+        self.start()
+        return self._future.result(timeout)
+
+    async def aget(self):
+        self.start()
+        # shield:调用方超时/取消不影响共享的初始化结果
+        return await asyncio.shield(asyncio.wrap_future(self._future))
+
+    def __getattr__(self, item):
+        # 只有本类没有的属性才会走到这里
+        if not self._future.done() and _in_event_loop():
+            # 在事件循环线程里同步等待会卡住整个服务，直接报错，提醒调用方改用 await aget()
+            raise RuntimeError(f"组件 {self.name} 尚未就绪，事件循环中请先 await aget() 再访问 .{item}")
+        return getattr(self.get(), item)
+
+
+class AsyncComponent(_Component):
+    """
+    在事件循环里初始化的组件(异步工厂函数，如连接MCP并编译图)，必须在事件循环内 start()
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Awaitable[object]]):
+        super().__init__(name)
+        self._factory = factory
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> "AsyncComponent":
+        if self._task is None:
+            self._task = asyncio.create_task(self._load())
+            # 失败信息已记录在状态里；没人等待时也不要报 "exception was never retrieved"
+            self._task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self
+
+    async def _load(self):
+        self._begin()
+        try:
+            obj = await self._factory()
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._finish()
+        return obj
+
+    async def aget(self):
+        self.start()
+        return await asyncio.shield(self._task)
+
+    def get(self):
+        # 仅用于已就绪后同步取值
+        return self._task.result()
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+
+def component_status() -> dict:
+    return {name: c.status() for name, c in COMPONENTS.items()}
+
+
+def all_ready() -> bool:
+    return all(c.ready for c in COMPONENTS.values())
@@ -0,0 +1,158 @@
+# 入库前的正文清洗:图片/噪音行/站点模板行/空白规范化
+# core_node 在线程里调用 clean_payload，不占用事件循环
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from tools.articles import ARTICLE_SEPARATOR, format_article, iter_articles
+
+NOISE_KEYWORDS = ["版权所有", "©", "备案", "110报警", "营业执照", "免责声明", "出版物许可证"]
+
+_IMAGE_RE = re.compile(r"!\[.*?\]\(.*?\)") # 去掉![]()的图片格式
+# 所有噪音关键词合成一个预编译正则，整段文本只扫描一遍(原来是 行数 x 关键词数 次子串查找)，命中后删掉所在整行
+_NOISE_RE = re.compile("|".join(re.escape(k) for k in NOISE_KEYWORDS))
+
+# 空白规范化
+_INVISIBLE_CHARS = "\u200b\u200c\u200d\u2060\ufeff\u00ad" # 零宽字符/软连字符
+_INVISIBLE_TABLE = dict.fromkeys(map(ord, _INVISIBLE_CHARS))
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3000-\u303f\uff00-\uffef"
+# 中日文字符之间的空格是排版/抽取残留，去掉(以空格开头，正则引擎可以先快速定位空格)
+_CJK_GAP_RE = re.compile(rf" (?<=[{_CJK}] )(?=[{_CJK}])")
+
+
+def drop_noise_lines(text: str) -> str:
+    parts = []
+    pos = 0
+    for m in _NOISE_RE.finditer(text):
+        line_start = text.rfind("\n", 0, m.start()) + 1
+        if line_start < pos:
+            continue # 同一行里的第二个关键词，这一行已经删掉了
+        line_end = text.find("\n", m.end())
+        line_end = len(text) if line_end == -1 else line_end + 1
+        parts.append(text[pos:line_start])
+        pos = line_end
+    if not parts:
+        return text
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+def normalize_whitespace(text: str) -> str:
+    """
+    逐行:各类空白(含全角空格/不换行空格/制表符)压成一个半角空格，去首尾空白；连续空行最多保留一个(段落分隔)
+    全文:去掉零宽字符，去掉中日文字符之间的空格(英文单词间的空格保留)
+    """
+    if any(c in text for c in _INVISIBLE_CHARS):
+        text = text.translate(_INVISIBLE_TABLE)
+    lines = []
+    blank = True # 开头的空行直接丢掉
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if line:
+            lines.append(line)
+            blank = False
+        elif not blank:
+            lines.append("")
+            blank = True
+    if blank and lines:
+        lines.pop()
+    return _CJK_GAP_RE.sub("", "\n".join(lines))
+
+
+class BoilerplateDetector:
+    """
+    站点模板行识别:同一域名下，在 min_pages 个及以上不同页面出现过的短行(导航/页脚/推荐阅读等)视为模板
+    - 记忆跨请求保留(按域名LRU)，第一次见到某站点时无法识别，之后同站的页面都能去掉
+    - 页面按 域名+路径 区分(去掉 query/fragment/末尾斜杠)，同一文章的参数/分页/锚点变体不算"不同页面"
+    - 只看导航长度的短行(max_line_chars)；中文一两百字已是整段正文，被转载/引用也不在这里删(交给入库去重)
+    """
+
+    def __init__(self, max_hosts: int = 2048, max_lines_per_host: int = 5000, max_line_chars: int = 40,
+                 min_line_chars: int = 4, min_pages: int = 3):
+        self.max_hosts = max_hosts
+        self.max_lines_per_host = max_lines_per_host
+        self.max_line_chars = max_line_chars
+        self.min_line_chars = min_line_chars
+        self.min_pages = min_pages
+        # host -> {行哈希: 出现过的页面哈希(不足 min_pages 个)，确认为模板后置为 None}
+        self._hosts: OrderedDict[str, OrderedDict[bytes, tuple[bytes, ...] | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counter = {"pages": 0, "lines_removed": 0}
+
+    @staticmethod
+    def _digest(value: str) -> bytes:
+        return hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+
+    def _lines_for(self, host: str) -> OrderedDict:
+        lines = self._hosts.get(host)
+        if lines is None:
+            lines = self._hosts[host] = OrderedDict()
+            while len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(host)
+        return lines
+
+    def strip(self, text: str, url: str) -> str:
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        if not host:
+            return text
+        page = self._digest(f"{host}{parsed.path.rstrip('/')}")
+        lines = text.split("\n")
+        keys = [
+            self._digest(line) if self.min_line_chars <= len(line) <= self.max_line_chars else None
+            for line in lines
+        ]
+        kept = []
+        with self._lock:
+            known = self._lines_for(host)
+            for line, key in zip(lines, keys):
+                if key is None:
+                    kept.append(line)
+                    continue
+                pages = known.get(key, ())
+                if pages is not None and page not in pages:
+                    pages += (page,)
+                    if len(pages) >= self.min_pages:
+                        pages = None # 第 min_pages 个页面出现，确认为模板
+                    known[key] = pages
+                if pages is None:
+                    known.move_to_end(key)
+                    self.stats_counter["lines_removed"] += 1
+                    continue
+                kept.append(line)
+            while len(known) > self.max_lines_per_host:
+                known.popitem(last=False)
+            self.stats_counter["pages"] += 1
+        return "\n".join(kept)
+
+    def stats(self) -> dict:
+        return {**self.stats_counter, "hosts": len(self._hosts)}
+
+
+def clean_article(text: str, url: str = "", boilerplate: BoilerplateDetector | None = None) -> str:
+    """
+    单篇清洗:图片 -> 噪音行 -> 空白规范化 -> 站点模板行
+    """
+    text = _IMAGE_RE.sub("", text)
+    text = drop_noise_lines(text)
+    text = normalize_whitespace(text)
+    if boilerplate is not None and url:
+        text = normalize_whitespace(boilerplate.strip(text, url))
+    return text
+
+
+def clean_payload(text: str, default_source: str = "", boilerplate: BoilerplateDetector | None = None) -> str:
+    """
+    清洗工具返回的全文(batch_fetch 多篇拼接或单篇)，保持"来源/分隔线"格式以便入库时按篇拆分
+    """
+    articles = [
+        (url, clean_article(body, url, boilerplate))
+        for url, body in iter_articles(text, default_source)
+    ]
+    if len(articles) == 1 and articles[0][0] == default_source:
+        return articles[0][1]
+    return ARTICLE_SEPARATOR.join(format_article(url, body) for url, body in articles if body)
@@ -0,0 +1,515 @@
+# 向量后端:RAGStore 只依赖这里的接口，底层可以是持久化的 Chroma，也可以是进程内的 NumPy/HNSW 索引
+# 片段按 doc_id 归属(见 tools/corpus.py)，检索时限定在会话引用的那一组 doc_id 内
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+from langchain_core.documents import Document
+from loguru import logger
+
+try:
+    import hnswlib
+    HNSW_AVAILABLE = True
+except ImportError:
+    HNSW_AVAILABLE = False
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 100
+HNSW_EF_SEARCH = 200
+
+SESSION_COLLECTION_PREFIX = "session_"
+SESSION_COLLECTION_MAX_AGE_SEC = 24 * 3600  # 超过该时长仍未被 drop 的会话集合视为崩溃残留
+STORE_LOCK_FILE = ".store.lock" # 持久化目录下的跨进程锁文件(多个 uvicorn worker 共用同一目录)
+_SEGMENT_DIR_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+class StoreLock:
+    """
+    持久化目录的读写锁(进程内 + 跨进程)
+    - shared(): 普通读写持有，多个线程/多个 worker 可以同时进行
+    - exclusive(wait_sec): 磁盘回收持有；拿到时同目录的所有 worker 都没有进行中的操作，之后的操作等回收结束
+      只等本进程空闲 wait_sec 秒(不拦新操作)，别的 worker 正忙时立即放弃，下个周期再试
+    跨进程部分用 flock 锁同一个锁文件(本进程第一个操作开始时加共享锁，最后一个结束时释放)；没有 fcntl 的平台只做进程内互斥
+    """
+
+    def __init__(self, path: str):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._exclusive = False
+        self._shared_fd = self._exclusive_fd = None
+        if FCNTL_AVAILABLE:
+            # flock 按打开的文件描述区分持有者，共享/排他各用一个
+            self._shared_fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._exclusive_fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            while self._exclusive:
+                self._cond.wait()
+            if not self._active and self._shared_fd is not None:
+                fcntl.flock(self._shared_fd, fcntl.LOCK_SH) # 别的 worker 正在回收时在这里等
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                if not self._active:
+                    if self._shared_fd is not None:
+                        fcntl.flock(self._shared_fd, fcntl.LOCK_UN)
+                    self._cond.notify_all()
+
+    def _acquire_exclusive(self, wait_sec: float) -> bool:
+        with self._cond:
+            if not self._cond.wait_for(lambda: not self._active and not self._exclusive, timeout=wait_sec):
+                return False
+            if self._exclusive_fd is not None:
+                try:
+                    fcntl.flock(self._exclusive_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False # 别的 worker 有进行中的操作(或正在回收)
+            self._exclusive = True
+            return True
+
+    @contextmanager
+    def exclusive(self, wait_sec: float = 0.0):
+        """
+        yield 是否拿到排他锁
+        """
+        ok = self._acquire_exclusive(wait_sec)
+        try:
+            yield ok
+        finally:
+            if ok:
+                with self._cond:
+                    if self._exclusive_fd is not None:
+                        fcntl.flock(self._exclusive_fd, fcntl.LOCK_UN)
+                    self._exclusive = False
+                    self._cond.notify_all()
+
+
+def _shared_op(method):
+    # 后端的读写操作:持有共享锁，磁盘回收期间等待
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.store_lock.shared():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def compact_directory(path: str) -> dict:
+    """
+    Chroma 持久化目录的磁盘回收:删集合后Chroma不会删除对应的HNSW段目录；删片段后SQLite也不会自动缩小
+    - 删除 segments 表里已不存在的段目录
+    - VACUUM chroma.sqlite3
+    用独立连接直接改数据库文件和段目录，调用方必须持有该目录的 StoreLock.exclusive()
+    """
+    db_path = os.path.join(path, "chroma.sqlite3")
+    if not os.path.exists(db_path):
+        return {}
+    before = _dir_size(path)
+    # 先列目录再读段表:列出来的目录一定早于其段记录的提交，不会误删新建集合
+    dirs = [d for d in os.listdir(path) if _SEGMENT_DIR_RE.match(d) and os.path.isdir(os.path.join(path, d))]
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        live = {row[0] for row in conn.execute("SELECT id FROM segments")}
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    orphans = [d for d in dirs if d not in live]
+    for d in orphans:
+        shutil.rmtree(os.path.join(path, d), ignore_errors=True)
+    return {"segments_removed": len(orphans), "bytes_before": before, "bytes_after": _dir_size(path)}
+
+
+class VectorBackend:
+    """
+    - add: 写入一批已向量化的片段(片段需带 id 与 metadata.doc_id)，同ID覆盖
+    - search: 多个查询向量一次检索，返回每个查询的 [(片段ID, 文本, metadata), ...]，按相似度降序
+    - has_doc / delete_docs: 供共享文档库判断是否可复用、回收
+    - drop_session / compact: 会话结束时的清理、启动时/定期的磁盘回收(按需实现，拿不到锁时返回 None)
+    session_id 只有按会话分区的后端才会用到，共享后端忽略
+    """
+
+    def add(self, chunks: list[Document], vectors: list[list[float]], session_id: str = None):
+        raise NotImplementedError
+
+    def search(self, vectors: list[list[float]], k: int, doc_ids: list[str],
+               session_id: str = None) -> list[list[tuple[str, str, dict]]]:
+        raise NotImplementedError
+
+    def has_doc(self, doc_id: str, session_id: str = None) -> bool:
+        raise NotImplementedError
+
+    def delete_docs(self, doc_ids: list[str], session_id: str = None):
+        raise NotImplementedError
+
+    def drop_session(self, session_id: str):
+        pass
+
+    def compact(self, wait_sec: float = 0.0) -> dict | None:
+        return {}
+
+    def stats(self) -> dict:
+        return {}
+
+
+class ChromaBackend(VectorBackend):
+    """
+    持久化后端(默认):所有片段在同一个Chroma集合里，靠 where={"doc_id": {"$in": ...}} 限定范围
+    """
+
+    def __init__(self, persist_directory: str, embedding):
+        from langchain_chroma import Chroma
+        self.persist_directory = persist_directory
+        os.makedirs(persist_directory, exist_ok=True)
+        self.store_lock = StoreLock(os.path.join(persist_directory, STORE_LOCK_FILE))
+        # 客户端打开之前先回收一次:本进程还没有任何读写，只要别的 worker 此刻也空闲就能安全地 VACUUM/删段目录
+        with self.store_lock.exclusive() as ok:
+            if ok:
+                report = compact_directory(persist_directory)
+                if report:
+                    logger.success(f"🧹 [Compact] 启动时向量库磁盘回收完成: {report}")
+        self.vector_store = Chroma(
+            persist_directory=persist_directory,
+            # 选择用该模型来做embedding的工作(向量由RAGStore算好后直接写入，这里只作兜底)
+            embedding_function=embedding
+        )
+
+    @property
+    def collection(self):
+        return self.vector_store._collection
+
+    @_shared_op
+    def add(self, chunks, vectors, session_id=None):
+        self.collection.upsert(
+            ids=[c.id for c in chunks],
+            embeddings=vectors,
+            documents=[c.page_content for c in chunks],
+            metadatas=[c.metadata for c in chunks],
+        )
+
+    @_shared_op
+    def search(self, vectors, k, doc_ids, session_id=None):
+        hits = self.collection.query(
+            query_embeddings=vectors,
+            n_results=k,
+            where={"doc_id": {"$in": doc_ids}},  # where作为检索条件
+            include=["documents", "metadatas"],
+        )
+        return [
+            [(cid, text, meta or {}) for cid, text, meta in zip(ids, texts, metas)]
+            for ids, texts, metas in zip(hits["ids"], hits["documents"], hits["metadatas"])
+        ]
+
+    @_shared_op
+    def has_doc(self, doc_id, session_id=None):
+        # 片段可能被去重丢掉，不能假设 "{doc_id}:0" 一定存在
+        return bool(self.collection.get(where={"doc_id": doc_id}, limit=1, include=[])["ids"])
+
+    @_shared_op
+    def delete_docs(self, doc_ids, session_id=None):
+        self.collection.delete(where={"doc_id": {"$in": doc_ids}})
+
+    def compact(self, wait_sec: float = 0.0) -> dict | None:
+        """
+        定期磁盘回收:等本进程空闲(最多 wait_sec 秒)并拿到跨进程排他锁后执行，拿不到返回 None
+        """
+        with self.store_lock.exclusive(wait_sec) as ok:
+            if not ok:
+                return None
+            return self._compact_locked()
+
+    def _compact_locked(self) -> dict:
+        return compact_directory(self.persist_directory)
+
+    @_shared_op
+    def stats(self):
+        return {"backend": "chroma", "chunks": self.collection.count()}
+
+
+class SessionChromaBackend(ChromaBackend):
+    """
+    按会话分区:每个会话一个独立集合，检索不带metadata过滤，会话结束整个集合 drop 掉(O(1))
+    共享集合越大、删得越多，where过滤和碎片化的HNSW就越慢；分区后每次检索只面对本会话的几百个片段
+    代价:跨会话不再共享向量，同一文档在别的会话里要再写一份(向量命中Embedding缓存，不会重复调用API)
+    """
+
+    def __init__(self, persist_directory: str, embedding):
+        super().__init__(persist_directory, embedding)
+        self.client = self.vector_store._client
+        self._collections: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _name(session_id: str) -> str:
+        # 集合名只允许 [a-zA-Z0-9._-]，session_id 来自前端，哈希后再用
+        return SESSION_COLLECTION_PREFIX + hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:24]
+
+    def _collection_for(self, session_id: str, create: bool):
+        with self._lock:
+            col = self._collections.get(session_id)
+            if col is not None:
+                return col
+        name = self._name(session_id)
+        if create:
+            col = self.client.get_or_create_collection(name, metadata={"created_at": time.time()})
+        else:
+            try:
+                col = self.client.get_collection(name)
+            except Exception:
+                return None
+        with self._lock:
+            self._collections[session_id] = col
+        return col
+
+    @_shared_op
+    def add(self, chunks, vectors, session_id=None):
+        self._collection_for(session_id, create=True).upsert(
+            ids=[c.id for c in chunks],
+            embeddings=vectors,
+            documents=[c.page_content for c in chunks],
+            metadatas=[c.metadata for c in chunks],
+        )
+
+    @_shared_op
+    def search(self, vectors, k, doc_ids, session_id=None):
+        col = self._collection_for(session_id, create=False) if session_id else None
+        if col is None:
+            return [[] for _ in vectors]
+        # 集合里只有本会话的片段，不需要where过滤
+        hits = col.query(query_embeddings=vectors, n_results=k, include=["documents", "metadatas"])
+        return [
+            [(cid, text, meta or {}) for cid, text, meta in zip(ids, texts, metas)]
+            for ids, texts, metas in zip(hits["ids"], hits["documents"], hits["metadatas"])
+        ]
+
+    @_shared_op
+    def has_doc(self, doc_id, session_id=None):
+        col = self._collection_for(session_id, create=False) if session_id else None
+        return col is not None and bool(col.get(where={"doc_id": doc_id}, limit=1, include=[])["ids"])
+
+    @_shared_op
+    def delete_docs(self, doc_ids, session_id=None):
+        # 共享集合在按会话分区时不写入，只需要删会话集合里的
+        col = self._collection_for(session_id, create=False) if session_id else None
+        if col is not None:
+            col.delete(where={"doc_id": {"$in": doc_ids}})
+
+    @_shared_op
+    def drop_session(self, session_id):
+        # 集合删除后段目录还留在磁盘上，由定期的 compact 清掉
+        with self._lock:
+            self._collections.pop(session_id, None)
+        try:
+            self.client.delete_collection(self._name(session_id))
+        except Exception:
+            pass  # 会话没有入库过任何文档
+
+    def _compact_locked(self):
+        # 先清理崩溃等原因遗留的会话集合，再回收磁盘
+        cutoff = time.time() - SESSION_COLLECTION_MAX_AGE_SEC
+        stale = [
+            col.name for col in self.client.list_collections()
+            if col.name.startswith(SESSION_COLLECTION_PREFIX) and (col.metadata or {}).get("created_at", 0) < cutoff
+        ]
+        for name in stale:
+            self.client.delete_collection(name)
+        with self._lock:
+            self._collections = {sid: col for sid, col in self._collections.items() if col.name not in stale}
+        return {"stale_sessions_dropped": len(stale), **super()._compact_locked()}
+
+    @_shared_op
+    def stats(self):
+        return {
+            "backend": "chroma_session",
+            "session_collections": sum(1 for col in self.client.list_collections() if col.name.startswith(SESSION_COLLECTION_PREFIX)),
+        }
+
+
+class _DocBlock:
+    """单个文档的全部片段:ID/文本/metadata 与归一化后的 float32 矩阵"""
+    __slots__ = ("ids", "texts", "metas", "rows", "_buf")
+
+    def __init__(self, dim: int):
+        self.ids: list[str] = []
+        self.texts: list[str] = []
+        self.metas: list[dict] = []
+        self.rows: dict[str, int] = {}  # 片段ID -> 行号
+        self._buf = np.empty((16, dim), dtype=np.float32)  # 容量翻倍增长，追加均摊O(1)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._buf[:len(self.ids)]
+
+    def upsert(self, chunks: list[Document], matrix: np.ndarray) -> int:
+        """写入同一文档的一批片段，同ID覆盖，返回新增条数"""
+        added = 0
+        for chunk, vec in zip(chunks, matrix):
+            row = self.rows.get(chunk.id)
+            if row is None:
+                row = self.rows[chunk.id] = len(self.ids)
+                if row == len(self._buf):
+                    # 扩容时换新数组，已取走的快照(视图)不受影响
+                    grown = np.empty((len(self._buf) * 2, self._buf.shape[1]), dtype=np.float32)
+                    grown[:row] = self._buf[:row]
+                    self._buf = grown
+                self.ids.append(chunk.id)
+                self.texts.append(chunk.page_content)
+                self.metas.append(chunk.metadata)
+                added += 1
+            else:
+                self.texts[row], self.metas[row] = chunk.page_content, chunk.metadata
+            self._buf[row] = vec
+        return added
+
+
+class _ScopeIndex:
+    """一组 doc_id(通常就是一个会话)拼出来的检索索引:小范围暴力矩阵乘，大范围HNSW"""
+    __slots__ = ("ids", "texts", "metas", "matrix", "hnsw")
+
+    def __init__(self, ids: list[str], texts: list[str], metas: list[dict], matrices: list[np.ndarray], hnsw_threshold: int):
+        self.ids, self.texts, self.metas = ids, texts, metas
+        self.matrix = np.concatenate(matrices) if matrices else None
+        self.hnsw = None
+        if HNSW_AVAILABLE and len(ids) >= hnsw_threshold:
+            index = hnswlib.Index(space="ip", dim=self.matrix.shape[1])
+            index.init_index(max_elements=len(ids), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+            index.add_items(self.matrix, np.arange(len(ids)))
+            self.hnsw = index
+
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def _normalize(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class MemoryBackend(VectorBackend):
+    """
+    进程内后端:会话短命且总在会话范围内检索，没必要走Chroma的SQLite/HNSW持久化
+    - 片段少于 hnsw_threshold 时，用归一化矩阵乘做精确暴力检索(两万条以内单次检索几十毫秒)
+    - 超过阈值且装了 hnswlib 时，为该范围建HNSW近似索引(建索引本身要数秒到数十秒，只适合大范围反复检索)
+    - 总片段数超过 max_chunks 时，按最近使用淘汰整篇文档(共享库会在下次引用时重新入库)
+    注意:进程重启后内容丢失
+    """
+
+    def __init__(self, hnsw_threshold: int = 50_000, max_chunks: int = 200_000, max_scopes: int = 32):
+        self.hnsw_threshold = hnsw_threshold
+        self.max_chunks = max_chunks
+        self.max_scopes = max_scopes
+        self._docs: OrderedDict[str, _DocBlock] = OrderedDict()
+        # 检索范围(doc_id集合) -> 拼好的索引，同一会话的多次检索复用
+        self._scopes: OrderedDict[frozenset, _ScopeIndex] = OrderedDict()
+        self._chunk_count = 0
+        self._lock = threading.Lock()
+
+    def add(self, chunks, vectors, session_id=None):
+        matrix = _normalize(vectors)
+        by_doc: dict[str, list[int]] = {}
+        for i, chunk in enumerate(chunks):
+            by_doc.setdefault(chunk.metadata.get("doc_id"), []).append(i)
+        with self._lock:
+            for doc_id, idxs in by_doc.items():
+                block = self._docs.get(doc_id)
+                if block is None:
+                    block = self._docs[doc_id] = _DocBlock(matrix.shape[1])
+                self._chunk_count += block.upsert([chunks[i] for i in idxs], matrix[idxs])
+                self._docs.move_to_end(doc_id)
+                self._invalidate(doc_id)
+            self._evict()
+
+    def _invalidate(self, doc_id: str):
+        for key in [k for k in self._scopes if doc_id in k]:
+            del self._scopes[key]
+
+    def _evict(self):
+        while self._chunk_count > self.max_chunks and len(self._docs) > 1:
+            doc_id, block = self._docs.popitem(last=False)
+            self._chunk_count -= len(block.ids)
+            self._invalidate(doc_id)
+            logger.info(f"🧹 [MemoryIndex] 超出容量，淘汰文档 {doc_id}")
+
+    def _scope(self, doc_ids: list[str]) -> _ScopeIndex:
+        with self._lock:
+            key = frozenset(d for d in doc_ids if d in self._docs)
+            for d in key:
+                self._docs.move_to_end(d)
+            scope = self._scopes.get(key)
+            if scope is not None:
+                self._scopes.move_to_end(key)
+                return scope
+            # 在锁内取快照(列表复制一份，矩阵取到当前行数的视图)，拼矩阵/建HNSW可能较慢，放到锁外
+            blocks = [self._docs[d] for d in key]
+            snapshot = (
+                [cid for b in blocks for cid in b.ids],
+                [t for b in blocks for t in b.texts],
+                [m for b in blocks for m in b.metas],
+                [b.matrix for b in blocks],
+            )
+        scope = _ScopeIndex(*snapshot, hnsw_threshold=self.hnsw_threshold)
+        with self._lock:
+            # 构建期间文档有增删时，这份索引已过期，只用于本次检索，不进缓存
+            if all(self._docs.get(d) is b for d, b in zip(key, blocks)) and len(scope.ids) == sum(len(b.ids) for b in blocks):
+                self._scopes[key] = scope
+                while len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+        return scope
+
+    def search(self, vectors, k, doc_ids, session_id=None):
+        queries = _normalize(vectors)
+        scope = self._scope(doc_ids)
+        if not scope.ids:
+            return [[] for _ in range(len(queries))]
+
+        k = min(k, len(scope.ids))
+        if scope.hnsw is not None:
+            scope.hnsw.set_ef(max(HNSW_EF_SEARCH, k))
+            labels, _ = scope.hnsw.knn_query(queries, k=k)
+        else:
+            # (片段数, 查询数) 的相似度矩阵，一次矩阵乘算完所有查询
+            sims = scope.matrix @ queries.T
+            top = np.argpartition(-sims, k - 1, axis=0)[:k]
+            order = np.take_along_axis(sims, top, axis=0).argsort(axis=0)[::-1]
+            labels = np.take_along_axis(top, order, axis=0).T
+        return [[(scope.ids[i], scope.texts[i], scope.metas[i]) for i in row] for row in labels]
+
+    def has_doc(self, doc_id, session_id=None):
+        return doc_id in self._docs
+
+    def delete_docs(self, doc_ids, session_id=None):
+        with self._lock:
+            for doc_id in doc_ids:
+                block = self._docs.pop(doc_id, None)
+                if block is not None:
+                    self._chunk_count -= len(block.ids)
+                    self._invalidate(doc_id)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "docs": len(self._docs),
+            "chunks": self._chunk_count,
+            "cached_scopes": len(self._scopes),
+            "hnsw_available": HNSW_AVAILABLE,
+        }